@@ -0,0 +1,28 @@
+"""
+The time of the backend. Everything that schedules calls or takes timestamps goes through this module, so the whole
+station can run on a virtual clock like twisted.internet.task.Clock instead of the reactor, see backend.simulation.
+"""
+from typing import Callable
+
+from twisted.internet import reactor
+from twisted.internet.interfaces import IDelayedCall, IReactorTime
+
+_clock: IReactorTime = reactor
+
+
+def get_clock() -> IReactorTime:
+    return _clock
+
+
+def set_clock(clock: IReactorTime):
+    global _clock
+    _clock = clock
+
+
+def seconds() -> float:
+    """The current time in s since the epoch, as time.time() unless a virtual clock is set."""
+    return _clock.seconds()
+
+
+def call_later(delay: float, function: Callable, *args, **kwargs) -> IDelayedCall:
+    return _clock.callLater(delay, function, *args, **kwargs)
@@ -1,7 +1,7 @@
-import time
 from abc import ABC
 from py_expression_eval import Parser
 
+from backend import clock
 from backend.helpers_exceptions import IObservable, IObserver
 from backend.devices.base import AbstractBaseDevice
 
@@ -9,10 +9,12 @@ from backend.devices.base import AbstractBaseDevice
 class ABCombinedObservable(IObserver, ABC):
     observable: IObservable
     starting_time: float
+    name: str
 
     def start(self):
+        self.observable.set_observable_datatype(self.name, float)
         self.observable.subscribe(self)
-        self.starting_time = time.time()
+        self.starting_time = clock.seconds()
 
     def stop(self):
         self.observable.unsubscribe(self)
@@ -33,31 +35,30 @@ class TimeIntegral(ABCombinedObservable):
     def _update_integral(self, time_value_pair, last_time_value_pair=None):
         last_time_value_pair = last_time_value_pair or self.combined_observable[-1]
         last_timestamp, last_value = last_time_value_pair
-        last_value = float(last_value)
         timestamp, value = time_value_pair
         time_passed = timestamp - last_timestamp
         try:
             new_integral = time_passed * float(value)
-        except ValueError:
+        except (TypeError, ValueError):
             new_integral = 0
         value = new_integral + last_value
-        self.observable.update_observables({self.name: str(value)}, timestamp)
-        return str(value)
+        self.observable.update_observables({self.name: value}, timestamp)
+        return value
 
     def _initial_values(self):
         observable_values = self.observable.get_updates(
             self.observable_key, self.starting_time)
         if observable_values:
-            last_time_value_pair = (self.starting_time, "0")
+            last_time_value_pair = (self.starting_time, 0.)
             initial_values = []
             for time_value_pair in observable_values:
                 timestamp, _ = time_value_pair
-                initial_values.append((timestamp, self._update_integral(
-                    time_value_pair, last_time_value_pair)))
-                last_time_value_pair = time_value_pair
+                last_time_value_pair = (timestamp, self._update_integral(
+                    time_value_pair, last_time_value_pair))
+                initial_values.append(last_time_value_pair)
             return initial_values
         else:
-            return [(self.starting_time, 0)]
+            return [(self.starting_time, 0.)]
 
     def update(self, observable, observable_key, updated_value, timestamp):
         if observable_key == self.observable_key:
@@ -82,6 +83,6 @@ class MathExpression(ABCombinedObservable):
                         variable)[1]) for variable in self.expression.variables()}
                     result = self.expression.evaluate(last_values)
                     self.observable.update_observables(
-                        {self.name: str(result)}, timestamp)
+                        {self.name: float(result)}, timestamp)
                 except IndexError:
                     pass
@@ -5,16 +5,21 @@ from contextlib import ContextDecorator
 from typing import Optional, Type, Any
 
 from twisted.internet import defer
-from twisted.internet import reactor
 
+from backend import clock
 from backend.commands import commandstate, parser
 from backend.commands.results import Result
-from backend.commands.helpers_exceptions import (CommandAction,
-    BaseParameterFactoryClass, CommandError, CommandSeriesError)
+from backend.commands.helpers_exceptions import (CommandAction, CommandPriority,
+    BaseParameterFactoryClass, CommandDroppedError, CommandError, CommandSeriesError, CommandTimeoutError)
 from backend.helpers_exceptions import StateMachineMixIn, WrongStateError
 from backend.devices import devicestate
+from backend import metrics
+from backend.tracing import tracer
 
 class DeviceCommandParameterFactory(BaseParameterFactoryClass):
+    __slots__ = ("retries", "inter_command_time", "on_error", "urgent", "run_while_device_busy", "channel",
+                 "devicestate_while_executing", "next_devicestate", "priority", "max_queue_time")
+
     def __init__(
             self,
             retries: int = 3,
@@ -29,19 +34,27 @@ class DeviceCommandParameterFactory(BaseParameterFactoryClass):
             next_devicestate: \
                 devicestate.DeviceState | Type[devicestate.DeviceState] \
                 = devicestate.Ready,
+            priority: Optional[CommandPriority] = None,  # derived from urgent if not given
+            max_queue_time: Optional[float] = None,  # s, dropped if it waits longer in the device's queue
             **kwargs
     ):
-        self.retries = retries
-        self.inter_command_time = inter_command_time
-        self.on_error = on_error
-        self.urgent = urgent
-        self.run_while_device_busy = run_while_device_busy
-        self.channel = channel
-        self.devicestate_while_executing = devicestate_while_executing
-        self.next_devicestate = next_devicestate
+        self._set(
+            retries=retries,
+            inter_command_time=inter_command_time,
+            on_error=on_error,
+            urgent=urgent,
+            run_while_device_busy=run_while_device_busy,
+            channel=channel,
+            devicestate_while_executing=devicestate_while_executing,
+            next_devicestate=next_devicestate,
+            priority=priority,
+            max_queue_time=max_queue_time,
+        )
 
 
 class CommandParameterFactory(DeviceCommandParameterFactory):
+    __slots__ = ("commandstring", "timeout", "command_execution_time", "on_timeout", "command_values", "query")
+
     def __init__(
             self,
             commandstring: str = "",
@@ -54,12 +67,14 @@ class CommandParameterFactory(DeviceCommandParameterFactory):
             command_values: dict[Any, Any] = None,
             **kwargs
     ):
-        self.commandstring = commandstring
-        self.timeout = timeout
-        self.command_execution_time = command_execution_time
-        self.on_timeout = on_timeout
-        self.command_values = command_values if command_values is not None else {}
-        self.query = query
+        self._set(
+            commandstring=commandstring,
+            timeout=timeout,
+            command_execution_time=command_execution_time,
+            on_timeout=on_timeout,
+            command_values=command_values if command_values is not None else {},
+            query=query,
+        )
         super().__init__(**kwargs)
 
 
@@ -80,6 +95,8 @@ class ABDeviceCommand(StateMachineMixIn, ABC):
         self.device = device
         self.log = self.device.log
         self.parameters = command_parameter(**kwargs)
+        self.deferred_dropped = defer.Deferred()  # fires if the command is dropped from the queue unsent
+        self.trace_marks: list[tuple[str, float, Optional[str]]] = []  # see backend.tracing
         super().__init__(initial_stateclass=commandstate.NotSent)
 
     @abstractmethod
@@ -103,10 +120,12 @@ class ABDeviceCommand(StateMachineMixIn, ABC):
 
 class Command(ABDeviceCommand, IProtocolCommand):
     def __init__(self, device, command_parameter: CommandParameterFactory = CommandParameterFactory(),
-                 parser_parameter: parser.ParserParameterFactory = parser.ParserParameterFactory()):
+                 parser_parameter: parser.ParserParameterFactory = parser.ParserParameterFactory(),
+                 bytestring: Optional[bytes] = None):
         super().__init__(device, command_parameter)
-        self.bytestring = command_parameter.commandstring.encode()
+        self.bytestring = bytestring if bytestring is not None else command_parameter.commandstring.encode()
         self.parser = parser_parameter.parserclass(self, **parser_parameter.kwargs)
+        self.name: Optional[str] = None  # set by get_cmd, labels the metrics of the command
         self.timer = None
         self.fail_count = 0
         self._result = None
@@ -121,6 +140,7 @@ class Command(ABDeviceCommand, IProtocolCommand):
         return f"{self.__class__.__name__} {self.parameters.commandstring}"
 
     def execute(self):
+        tracer.mark(self, "written")
         self.device.protocol.write_command(self)
         self.state = commandstate.Sent
         deferred, self.deferred_execution = self.deferred_execution, defer.Deferred()
@@ -151,6 +171,8 @@ class Command(ABDeviceCommand, IProtocolCommand):
         self._result = result
         result.command = self
         self.response_time = result.time - self.time
+        if not isinstance(result, CommandTimeoutError):
+            metrics.command_response_seconds.observe(self.response_time, *metrics.command_labels(self))
 
 
 class CommandSeries(ABDeviceCommand, ContextDecorator):
@@ -158,8 +180,8 @@ class CommandSeries(ABDeviceCommand, ContextDecorator):
                  command_parameter: DeviceCommandParameterFactory = DeviceCommandParameterFactory(retries=1)):
         self.commandlist = commandlist if commandlist is not None else []
         super().__init__(device, command_parameter)
-        for cmd in self.commandlist:
-            self.parameters.urgent = self.parameters.urgent or cmd.parameters.urgent
+        if any(cmd.parameters.urgent for cmd in self.commandlist):
+            self.parameters = self.parameters(urgent=True)
         self.cmd_counter = 0
         self.fail_count = 0
         self._cached_devicestate = None
@@ -178,15 +200,16 @@ class CommandSeries(ABDeviceCommand, ContextDecorator):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        for cmd in self.commandlist:
-            self.parameters.urgent = self.parameters.urgent or cmd.parameters.urgent
+        if any(cmd.parameters.urgent for cmd in self.commandlist):
+            self.parameters = self.parameters(urgent=True)
         if self.parameters.urgent:
             for cmd in self.commandlist:
-                cmd.parameters.urgent = True
+                cmd.parameters = cmd.parameters(urgent=True)
         self.device.reuse_state_without_enter(self._cached_devicestate)
         self.device.send_cmd(self)
 
     def execute(self):
+        tracer.mark(self, "written")
         for cmd in self.commandlist:
             if isinstance(cmd, CommandSeries):
                 self.has_command_series = True
@@ -196,7 +219,7 @@ class CommandSeries(ABDeviceCommand, ContextDecorator):
         else:
             self._temp_result = Result()
             self._temp_result.command = self
-            reactor.callLater(self.parameters.inter_command_time, self.succeed)
+            clock.call_later(self.parameters.inter_command_time, self.succeed)
 
     def cancel(self):
         for command in self.commandlist:
@@ -262,7 +285,8 @@ class CommandSeries(ABDeviceCommand, ContextDecorator):
         if self.fail_count > self.parameters.retries:
             return self.fail()
         else:
-            self.log.info(f"last executed command failed, retrying {self}")
+            self.log.info("last executed command failed, retrying {command}", command=self)
+            metrics.command_retries.inc(*metrics.command_labels(self), type(self.current_command.temp_result).__name__)
             self.cmd_counter = 0
             for cmd in self.commandlist:
                 cmd.fail_count = 0
@@ -277,7 +301,7 @@ class CommandSeries(ABDeviceCommand, ContextDecorator):
         self.stateobject.new_state(commandstate.Success(self))
 
     def fail(self):
-        self.log.error(f"{self} failed.")
+        self.log.error("{command} failed.", command=self)
         self.stateobject.new_state(commandstate.Fail(self))
         for i in range(0, self.cmd_counter):
             cmd = self.commandlist[i]
@@ -315,23 +339,34 @@ class RepeatedCommand(ABDeviceCommand):
         self.write_function = write_function
         self._continue_running = False
         self.stop_condition = stop_condition
-        kwargs["urgent"] = True
+        # polls run while the device is busy, but after other commands, and are dropped once they are stale
+        kwargs.setdefault("priority", CommandPriority.BACKGROUND)
+        kwargs.setdefault("run_while_device_busy", True)
+        kwargs.setdefault("max_queue_time", interval)
         self.kwargs = kwargs
 
     def __repr__(self):
         return f"Repeated Command '{self.command_name}' every {self.interval} s"
 
     def _next_iteration(self, result):
-        reactor.callLater(self.interval, self._run_command)
+        clock.call_later(self.interval, self._run_command)
         self.last_command = result.command
         return result
 
+    def _dropped(self, result):
+        clock.call_later(self.interval, self._run_command)
+        return result
+
     def _run_command(self):
         if self._continue_running:
-            self.write_function(self.command_name, **self.kwargs).deferred_result.addCallback(self._next_iteration)
+            cmd = self.write_function(self.command_name, **self.kwargs)
+            cmd.deferred_result.addCallback(self._next_iteration)
+            cmd.deferred_dropped.addCallback(self._dropped)
+            # the next iteration is scheduled by _dropped
+            cmd.deferred_result.addErrback(lambda failure: failure.trap(CommandDroppedError))
 
     def stop_running(self):
-        self.log.info(f"Stopping repeated command {self}")
+        self.log.info("Stopping repeated command {command}", command=self)
         self._continue_running = False
         if self.stop_condition is not None:
             try:
@@ -345,7 +380,7 @@ class RepeatedCommand(ABDeviceCommand):
         self._continue_running = True
         if self.stop_condition:
             self.device.conditionhandler.add_condition(self.stop_condition, self.deferred_stop)
-        reactor.callLater(0, self._run_command)
+        clock.call_later(0, self._run_command)
         self.deferred_result.callback(Result())
 
     def cancel(self):
@@ -368,14 +403,17 @@ class WaitCommand(ABDeviceCommand):
                  command_parameter: DeviceCommandParameterFactory = DeviceCommandParameterFactory(
                      devicestate_while_executing=devicestate.Waiting),
                  **kwargs):
+        self.condition = condition  # before the state machine logs the command
         super().__init__(device, command_parameter, *args, **kwargs)
-        self.condition = condition
         self._temp_result = None
 
         self.deferred_result = defer.Deferred().addBoth(self._set_result)
         self.deferred_execution = defer.Deferred()
-        self.parameters.devicestate_while_executing = self.parameters.devicestate_while_executing(
-            self.device, self.condition, self)
+        self.parameters = self.parameters(devicestate_while_executing=self.parameters.devicestate_while_executing(
+            self.device, self.condition, self))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} {self.condition}"
 
     def _set_result(self, result):
         self.result = self._temp_result = Result()
@@ -383,6 +421,7 @@ class WaitCommand(ABDeviceCommand):
         return self.result
 
     def execute(self):
+        tracer.mark(self, "written")
         self.deferred_execution.callback(None)
 
     def cancel(self):
@@ -1,16 +1,17 @@
 from abc import ABC, abstractmethod
-import time
-
-from twisted.internet import reactor
 
+from backend import clock
 from backend.commands.helpers_exceptions import (CommandError, CommandRetryError, CommandTimeoutError,
-                                                 CommandResponseError, CommandAction, CommandErrorError)
+                                                 CommandResponseError, CommandAction, CommandErrorError,
+                                                 CommandDroppedError)
 from backend.helpers_exceptions import IState
 from backend.commands.results import Result
+from backend import metrics
+from backend.tracing import tracer
 
 
 class CommandState(IState, ABC):
-    callLater = reactor.callLater
+    callLater = staticmethod(clock.call_later)
 
     def __init__(self, command):
         self._command = command
@@ -26,13 +27,14 @@ class NotSent(CommandState):
 
 class Sent(CommandState):
     def enter(self):
-        self._command.time = time.time()
+        self._command.time = clock.seconds()
 
         def timedout():
             self._command.timer = None
             reply = Result()
             reply.command = self._command
             self._command.temp_result = CommandTimeoutError(reply=reply)
+            metrics.command_timeouts.inc(*metrics.command_labels(self._command))
             self._command.state = Retry
 
         self._command.timer = self.callLater(self._command.parameters.timeout, timedout)
@@ -64,15 +66,32 @@ class Retry(CommandState):
         return super().__new__(cls)
 
     def enter(self):
+        reason = type(self._command.temp_result).__name__
+        metrics.command_retries.inc(*metrics.command_labels(self._command), reason)
+        tracer.mark(self._command, "retry", reason)
         self._command.execute()
 
 
 class Fail(CommandState):
     def enter(self):
         self._command.temp_result.command = self._command
+        metrics.command_failures.inc(*metrics.command_labels(self._command))
         self._command.deferred_result.errback(self._command.temp_result)
 
 
 class Cancelled(CommandState):
     def enter(self):
         pass
+
+
+class Dropped(CommandState):
+    """The command waited in the queue longer than its max_queue_time and was never sent. Its deferred_result fails with
+    CommandDroppedError, so whatever waits for the result goes on."""
+    def enter(self):
+        reply = Result()
+        reply.command = self._command
+        error = CommandDroppedError(reply=reply)
+        metrics.commands_dropped.inc(*metrics.command_labels(self._command))
+        tracer.finish(self._command, "dropped")
+        self._command.deferred_dropped.callback(error)
+        self._command.deferred_result.errback(error)
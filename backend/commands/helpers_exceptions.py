@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 from backend.commands.results import Result
 
@@ -8,6 +8,14 @@ class CommandAction(Enum):
     FAIL = "fail"
 
 
+class CommandPriority(IntEnum):
+    """Order in which queued commands are sent, lower values first."""
+    SAFETY_STOP = 0
+    URGENT = 1
+    NORMAL = 2
+    BACKGROUND = 3
+
+
 class CommandError(Exception, Result):
     """Baseclass for all errors that commands take as their temp_result."""
     errorcode = ""
@@ -56,16 +64,44 @@ class CommandSeriesError(CommandError):
     errorcode = "CommandSeries failed"
 
 
+class CommandDroppedError(CommandError):
+    """Temp_result of a command that waited in the queue longer than its max_queue_time"""
+    errorcode = "Command dropped from queue."
+
+
 class BaseParameterFactoryClass:
+    """Immutable parameter record. Calling it returns a copy with the given values replaced, values that are not
+    fields of the record are ignored."""
+    __slots__ = ()
+    _fields: tuple[str, ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = tuple(field for klass in reversed(cls.__mro__) for field in klass.__dict__.get("__slots__", ()))
+        # generated like namedtuple does, which is a lot faster than looping over the fields on every copy
+        lines = [f"    _set(new, {field!r}, kwargs[{field!r}] if {field!r} in kwargs else self.{field})"
+                 for field in cls._fields]
+        source = "def _copy(self, kwargs):\n    new = _new(cls)\n" + "\n".join(lines) + "\n    return new\n"
+        namespace = {"_new": object.__new__, "_set": object.__setattr__, "cls": cls}
+        exec(source, namespace)
+        cls._copy = namespace["_copy"]
+
+    def _copy(self, kwargs: dict):
+        return self
+
+    def _set(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable, call it with {name}=... to get an updated copy.")
+
     def __call__(self, **kwargs):
         """Makes parameters easily updatable by calling them"""
-        new_parameters = self.__dict__.copy()
-        try:
-            old_kwargs = new_parameters.pop("kwargs")
-        except KeyError:
-            pass
-        else:
-            new_parameters.update(old_kwargs)
-        for key, value in kwargs.items():
-            new_parameters[key] = value
-        return type(self)(**new_parameters)
+        if not kwargs:
+            return self
+        return self._copy(kwargs)
+
+    def __repr__(self):
+        values = ", ".join(f"{field}={getattr(self, field)!r}" for field in self._fields)
+        return f"{type(self).__name__}({values})"
@@ -90,7 +90,14 @@ class SuccessParser(BaseParser):
 
 
 class ParserParameterFactory(BaseParameterFactoryClass):
+    """Values other than parserclass are collected in kwargs and passed on to the parser."""
+    __slots__ = ("parserclass", "kwargs")
+
     def __init__(self, parserclass: Type[BaseParser] = CommandReplyParser, **kwargs):
-        self.parserclass = parserclass
-        self.kwargs = kwargs
+        self._set(parserclass=parserclass, kwargs=kwargs)
+
+    def __call__(self, parserclass: Type[BaseParser] = None, **kwargs):
+        if parserclass is None and not kwargs:
+            return self
+        return type(self)(parserclass=parserclass or self.parserclass, **{**self.kwargs, **kwargs})
 
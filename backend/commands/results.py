@@ -1,11 +1,11 @@
-import time
+from backend import clock
 # from datetime import datetime
 
 
 class Result:
     def __init__(self, line: str = ""):
         self.line = line
-        self.time = time.time()
+        self.time = clock.seconds()
         self.parameters = {}
         self.command = None
 
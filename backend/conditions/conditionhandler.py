@@ -1,22 +1,45 @@
 from collections import defaultdict
-import time
+import heapq
+from itertools import count
+from typing import Iterable
 
-from twisted.internet import defer, reactor
-from twisted.logger import Logger
+from twisted.internet import defer
+from twisted.internet.interfaces import IDelayedCall
 
+from backend import clock, metrics
 from backend.helpers_exceptions import IObserver, IObservable
 from backend.conditions import ABCondition
+from backend.logger import Logger
 
 
 class ConditionHandler(IObserver):
+    """Calls back deferreds once their conditions turn true.
+
+    Conditions are indexed by the (observable, observable_key) pairs they depend on, so an update only
+    evaluates the conditions it can affect. Updates arriving while callbacks are running are queued and
+    handled in the same loop instead of recursing. Conditions whose result changes with time alone report
+    their next_deadline, those are kept in a heap and re-evaluated by a single timer at the earliest one.
+    """
+    callLater = staticmethod(clock.call_later)
+
     def __init__(self, devices_and_channels: list[IObservable] | None = None):
         self._observed_objects = []
         self.log = Logger(namespace="Condition Handler")
         self._busy = False
+        self._conditions: dict[ABCondition, list[defer.Deferred]] = defaultdict(list)
+        self._dependencies: dict[ABCondition, set[tuple[IObservable, str | None]]] = {}
+        # dicts with None values serve as insertion ordered sets, conditions are checked in the order they were added
+        self._index: dict[tuple[IObservable, str | None], dict[ABCondition, None]] = defaultdict(dict)
+        self._conditions_to_check: dict[ABCondition, None] = {}
+        # heap entries are (deadline, sequence number, condition), entries not matching _scheduled_deadlines are stale
+        self._deadlines: list[tuple[float, int, ABCondition]] = []
+        self._scheduled_deadlines: dict[ABCondition, float] = {}
+        self._deadline_sequence = count()
+        self._timer: IDelayedCall | None = None
+        self._timer_deadline: float | None = None
         if devices_and_channels is not None:
             for device_or_channel in devices_and_channels:
                 self.add_observable(device_or_channel)
-        self._conditions: dict[ABCondition, list[defer.Deferred]] = defaultdict(list)
 
     def add_observable(self, observable):
         self._observed_objects.append(observable)
@@ -25,10 +48,19 @@ class ConditionHandler(IObserver):
     def add_condition(self, condition: ABCondition, deferred: defer.Deferred = None) -> defer.Deferred:
         deferred = deferred or defer.Deferred()
         self._conditions[condition].append(deferred)
-        for observable in condition.observable_objects:
-            if not observable in self._observed_objects:
-                self.add_observable(observable) 
+        # dependencies are collected anew, channels may have added themselves to observable_objects
+        self._unindex_condition(condition)
+        self._index_condition(condition)
         condition.start()
+        if self._busy:
+            # a callback added it, it is evaluated once the running callbacks are done
+            self._conditions_to_check[condition] = None
+        elif not self._dependencies[condition] and condition.next_deadline() is None:
+            # no update or deadline would ever evaluate it, e.g. a TimeCondition of 0 s
+            self.callLater(0, self.check_conditions_and_callback, (condition,))
+        else:
+            self._schedule_deadline(condition)
+            self._reset_timer()
         return deferred
 
     def remove_deferred_for_condition(self, deferred: defer.Deferred, condition: ABCondition):
@@ -36,28 +68,101 @@ class ConditionHandler(IObserver):
         deferreds.remove(deferred)
         if len(deferreds) == 0:
             self._conditions.pop(condition)
+            self._unindex_condition(condition)
+
+    def _index_condition(self, condition: ABCondition):
+        dependencies = condition.get_dependencies()
+        for observable, observable_key in dependencies:
+            if observable not in self._observed_objects:
+                self.add_observable(observable)
+            self._index[(observable, observable_key)][condition] = None
+        self._dependencies[condition] = dependencies
+
+    def _unindex_condition(self, condition: ABCondition):
+        for dependency in self._dependencies.pop(condition, ()):
+            conditions = self._index[dependency]
+            conditions.pop(condition, None)
+            if not conditions:
+                del self._index[dependency]
+        self._conditions_to_check.pop(condition, None)
+        self._scheduled_deadlines.pop(condition, None)
+
+    def _schedule_deadline(self, condition: ABCondition):
+        deadline = condition.next_deadline()
+        if deadline is None or deadline <= clock.seconds():
+            # a deadline that is due already was evaluated, scheduling it again would spin the reactor
+            self._scheduled_deadlines.pop(condition, None)
+        elif self._scheduled_deadlines.get(condition) != deadline:
+            self._scheduled_deadlines[condition] = deadline
+            heapq.heappush(self._deadlines, (deadline, next(self._deadline_sequence), condition))
+
+    def _reset_timer(self):
+        while self._deadlines:
+            deadline, _, condition = self._deadlines[0]
+            if self._scheduled_deadlines.get(condition) == deadline:
+                break
+            heapq.heappop(self._deadlines)
+        if not self._deadlines:
+            if self._timer is not None and self._timer.active():
+                self._timer.cancel()
+            self._timer = None
+            return
+        deadline = self._deadlines[0][0]
+        if self._timer is not None and self._timer.active():
+            if self._timer_deadline <= deadline:
+                return
+            self._timer.cancel()
+        self._timer_deadline = deadline
+        self._timer = self.callLater(max(deadline - clock.seconds(), 0), self._deadlines_reached)
 
+    def _deadlines_reached(self):
+        self._timer = None
+        now = clock.seconds()
+        due_conditions = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, _, condition = heapq.heappop(self._deadlines)
+            if self._scheduled_deadlines.get(condition) == deadline:
+                del self._scheduled_deadlines[condition]
+                due_conditions.append(condition)
+        self.check_conditions_and_callback(due_conditions)
+        self._reset_timer()
 
-    def check_conditions_and_callback(self, condition_dict):
-        if not self._busy:
+    def check_conditions_and_callback(self, conditions: Iterable[ABCondition]):
+        self._conditions_to_check.update(dict.fromkeys(conditions))
+        if self._busy:
+            return
+        while self._conditions_to_check:
+            conditions_to_check = list(self._conditions_to_check)
+            self._conditions_to_check.clear()
             true_conditions = []
-            for condition, deferred in condition_dict.items():
+            for condition in conditions_to_check:
+                if condition not in self._conditions:
+                    continue
+                metrics.condition_checks.inc()
                 if condition():
                     true_conditions.append(condition)
-            if true_conditions:
-                self._busy = True
+                else:
+                    self._schedule_deadline(condition)
+            if not true_conditions:
+                continue
+            self._busy = True
+            try:
                 for condition in true_conditions:
-                    deferreds = self._conditions.pop(condition)
-                    self.log.info(f"Calling back {deferreds} due to {condition}")
+                    deferreds = self._conditions.pop(condition, None)
+                    if deferreds is None:
+                        # removed by one of the callbacks before
+                        continue
+                    self._unindex_condition(condition)
+                    metrics.conditions_met.inc()
+                    self.log.info("Calling back {deferreds} due to {condition}", deferreds=deferreds,
+                                  condition=condition)
                     for deferred in deferreds:
                         deferred.callback(None)
+            finally:
                 self._busy = False
-                self.check_conditions_and_callback(self._conditions)
+        self._reset_timer()
 
     def update(self, observable, observable_key, updated_value, timestamp):
-        if not self._busy:
-            conditions_to_check = {}
-            for condition, deferreds in self._conditions.items():
-                if observable in condition.observable_objects:
-                    conditions_to_check[condition] = deferreds
-            self.check_conditions_and_callback(conditions_to_check)
\ No newline at end of file
+        conditions = self._index.get((observable, observable_key), {}) | self._index.get((observable, None), {})
+        if conditions:
+            self.check_conditions_and_callback(conditions)
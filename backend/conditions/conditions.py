@@ -3,20 +3,26 @@ from typing import TYPE_CHECKING
 
 from abc import ABC, abstractmethod
 from inspect import signature
-import time
 from itertools import zip_longest
 
-from twisted.internet import reactor
-
+from backend import clock
 from backend.devices import devicestate
-from backend.helpers_exceptions import IObservable, BaseObservable
+from backend.helpers_exceptions import IObservable
 
 if TYPE_CHECKING:
     from backend.devices.base import AbstractBaseDevice
 
 
+def _numeric(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
 class ABCondition(ABC):
     observable_objects: list[IObservable]
+    observable_keys: tuple[str, ...] | None = None  # keys of observable_objects the condition reads, None means all
 
     def __init__(self, title, *args, **kwargs):
         self.title = title
@@ -27,7 +33,7 @@ class ABCondition(ABC):
 
     def start(self):
         if not self.started:
-            self.starting_time = time.time()
+            self.starting_time = clock.seconds()
 
     def __call__(self) -> bool:
         self._turned_true = self._turned_true or self.check_condition()
@@ -39,6 +45,15 @@ class ABCondition(ABC):
     def check_condition(self) -> bool:
         raise NotImplementedError
 
+    def get_dependencies(self) -> set[tuple[IObservable, str | None]]:
+        """(observable, observable_key) pairs whose updates can change the result, a key of None stands for any key."""
+        keys = (None,) if self.observable_keys is None else self.observable_keys
+        return {(observable, key) for observable in self.observable_objects for key in keys}
+
+    def next_deadline(self) -> float | None:
+        """Future time at which the result may change without any observable update, None if there is none."""
+        return None
+
     @classmethod
     def from_configsnippet(
             cls, setup, config_args: list, config_kwargs,
@@ -88,6 +103,14 @@ class CombinedCondition(ABCondition):
     def check_condition(self) -> bool:
         return all((condition() for condition in self.conditions))
 
+    def get_dependencies(self) -> set[tuple[IObservable, str | None]]:
+        return set().union(*(condition.get_dependencies() for condition in self.conditions))
+
+    def next_deadline(self) -> float | None:
+        # parts that turned true stay true, their deadlines don't matter anymore
+        deadlines = [condition.next_deadline() for condition in self.conditions if not condition._turned_true]
+        return min((deadline for deadline in deadlines if deadline is not None), default=None)
+
     def __repr__(self) -> str:
         return (
             f"{self.__class__.__name__} {self.title} "
@@ -126,14 +149,21 @@ class OngoingCondition(ABCondition):
         self.condition.start()
         return super().start()
 
+    def get_dependencies(self) -> set[tuple[IObservable, str | None]]:
+        return self.condition.get_dependencies()
+
+    def next_deadline(self) -> float | None:
+        if self._true_since is None or clock.seconds() >= self._true_since + self.duration:
+            return None
+        return self._true_since + self.duration
+
     def check_condition(self) -> bool:
-        if self.condition():
+        # not latched, the condition has to hold for the whole duration
+        if self.condition.check_condition():
+            now = clock.seconds()
             if self._true_since is None:
-                self._true_since = time.time()
-            if time.time() - self._true_since >= self.duration:
-                return True
-            else:
-                return False
+                self._true_since = now
+            return now - self._true_since >= self.duration
         else:
             self._true_since = None
             return False
@@ -168,7 +198,9 @@ class ObservableEqualsValueCondition(ABCondition):
         super().__init__(title)
         self.observable_objects = [observable_object]
         self.observable_name = observable_name
+        self.observable_keys = (observable_name,)
         self.value = value
+        self._numeric_value = _numeric(value)  # typed observables are compared without parsing strings
 
     def __repr__(self) -> str:
         return (
@@ -190,6 +222,8 @@ class ObservableEqualsValueCondition(ABCondition):
         except IndexError:
             return False
         else:
+            if not isinstance(value, str):
+                return value == self._numeric_value and timestamp >= self.starting_time
             return value == self.value and timestamp >= self.starting_time
 
 
@@ -201,7 +235,7 @@ class ObservableGreaterOrEqualValueCondition(ObservableEqualsValueCondition):
         except IndexError:
             return False
         else:
-            return (float(value) >= float(self.value)
+            return (float(value) >= self._numeric_value
                     and timestamp >= self.starting_time)
 
     def __repr__(self) -> str:
@@ -220,7 +254,7 @@ class ObservableLessOrEqualValueCondition(ObservableEqualsValueCondition):
         except IndexError:
             return False
         else:
-            return (float(value) <= float(self.value)
+            return (float(value) <= self._numeric_value
                     and timestamp >= self.starting_time)
 
     def __repr__(self) -> str:
@@ -238,8 +272,10 @@ class ObservableInsideIntervalCondition(ABCondition):
         super().__init__(title)
         self.observable_objects = [observable_object]
         self.observable_name = observable_name
+        self.observable_keys = (observable_name,)
         self.lower_limit = lower_limit
         self.upper_limit = upper_limit
+        self._limits = float(lower_limit), float(upper_limit)
 
     def __repr__(self) -> str:
         return (
@@ -261,12 +297,15 @@ class ObservableInsideIntervalCondition(ABCondition):
         except IndexError:
             return False
         else:
+            lower_limit, upper_limit = self._limits
             return (
-                float(self.lower_limit) < float(value) < float(self.upper_limit)
+                lower_limit < float(value) < upper_limit
                 and timestamp >= self.starting_time)
 
 
 class DevicesStateEqualsCondition(ABCondition):
+    observable_keys = ("state",)
+
     def __init__(
             self, title, devices: list[AbstractBaseDevice],
             target_state: devicestate.DeviceState = devicestate.Waiting):
@@ -310,27 +349,30 @@ class DevicesWaitingCondition(DevicesStateEqualsCondition):
         return super()._from_config_kwargs(setup, kwargs_strings)
 
 
-class TimeCondition(ABCondition, BaseObservable):
+class TimeCondition(ABCondition):
+    observable_keys = ()
+
     def __init__(self, title, time_to_wait: float):
-        self.observable_objects = [self]
+        self.observable_objects = []
         super().__init__(title)
         self.time_to_wait = time_to_wait
-        self._done_waiting = False
+        self._deadline = None
 
     def __repr__(self) -> str:
         return f"{self.__class__.__name__} {self.title} ({self.time_to_wait} s)"
 
-    def _done(self):
-        self._done_waiting = True
-        self.update_observables({"waited time": str(self.time_to_wait)})
-
     def start(self):
-        if not self.started:
-            reactor.callLater(self.time_to_wait, self._done)
-            return super().start()
+        super().start()
+        if self._deadline is None:
+            self._deadline = self.starting_time + self.time_to_wait
+
+    def next_deadline(self) -> float | None:
+        if self._deadline is None or clock.seconds() >= self._deadline:
+            return None
+        return self._deadline
 
     def check_condition(self) -> bool:
-        return self._done_waiting
+        return self._deadline is not None and clock.seconds() >= self._deadline
 
     @classmethod
     def _from_config_kwargs(cls, setup, kwargs_strings) -> ABCondition:
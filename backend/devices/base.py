@@ -2,10 +2,8 @@
 
 from abc import ABC, abstractmethod
 import re
-import time
-from typing import Optional
+from typing import Any, Optional
 
-from twisted.logger import Logger
 from twisted.protocols.basic import LineReceiver
 from twisted.internet.protocol import ClientFactory, connectionDone
 from twisted.internet.serialport import SerialPort
@@ -13,13 +11,18 @@ from twisted.internet import defer, reactor, error
 from twisted.internet.abstract import isIPAddress
 from twisted.python import failure
 
+from backend import clock
 from backend.commands import (commandstate, parser, ABDeviceCommand, IProtocolCommand, Command, CommandSeries,
-                              RepeatedCommand, WaitCommand, CommandErrorError, CommandParameterFactory)
+                              RepeatedCommand, WaitCommand, CommandErrorError, CommandParameterFactory,
+                              CommandPriority)
 from backend.commands.results import Result
 from backend.devices import devicestate
+from backend.devices.commandqueue import CommandQueue
 from backend.conditions.conditionhandler import ConditionHandler
 from .helpers_exceptions import UnknownConnectionTypeError
 from backend.helpers_exceptions import IObservable, BaseObservable, StateMachineMixIn
+from backend.logger import Logger
+from backend.tracing import tracer
 
 
 class ICommander(IObservable):
@@ -43,7 +46,7 @@ class ICommunicator(ABC):
 
 
 class IStateDevice(ABC):
-    """work with backend.devices.states.devicestate and provide a list called cmd_queue"""
+    """work with backend.devices.states.devicestate and provide a CommandQueue called cmd_queue"""
     @property
     @abstractmethod
     def state(self):
@@ -90,7 +93,7 @@ class BaseDeviceProtocol(LineReceiver):
 
     def write_command(self, command_object: IProtocolCommand):
         self.sendLine(command_object.bytestring)
-        self.device.log.info(f"Wrote {command_object.parameters.commandstring} to device.")
+        self.device.log.info("Wrote {commandstring} to device.", commandstring=command_object.parameters.commandstring)
 
     def lose_connection(self):
         if not isinstance(self.transport, SerialPort):
@@ -141,7 +144,7 @@ class DeviceAndChannelBase(StateDeviceMixIn, BaseObservable, ABC):
 
     def reuse_state_without_enter(self, state):
         self._state = state
-        self.log.info(f"Set state back to {state}")
+        self.log.info("Set state back to {state}", state=state)
 
     @property
     def commandseries(self):
@@ -151,6 +154,7 @@ class DeviceAndChannelBase(StateDeviceMixIn, BaseObservable, ABC):
         return CommandSeries(self, *args, **kwargs)
 
     def send_cmd(self, cmd: ABDeviceCommand):
+        tracer.mark(cmd, "queued")
         self.stateobject.add_command_callbacks(cmd)
         self.stateobject.send_cmd(cmd)
 
@@ -199,10 +203,12 @@ class DeviceAndChannelBase(StateDeviceMixIn, BaseObservable, ABC):
 
 class AbstractBaseDevice(ICommander, ICommunicator, DeviceAndChannelBase):
     protocol_factory_class = BaseDeviceProtocolFactory
-    callLater = reactor.callLater
+    callLater = staticmethod(clock.call_later)
     reply_to_state = {}
     event_patterns = []
     error_patterns = []
+    _reply_pattern: Optional[re.Pattern] = None
+    _reply_pattern_alternatives: dict[str, re.Pattern] = {}
     replies_commands = False
     serial_parameters = {}
     delimiter = "\r"
@@ -227,9 +233,37 @@ class AbstractBaseDevice(ICommander, ICommunicator, DeviceAndChannelBase):
                     command[1] = cls.parser_parameter_factory(parserclass=parser.REParser,
                                                               pattern=re.compile(parser_info))
                 elif parser_info.parserclass == parser.REParser:
-                    parser_info.kwargs["pattern"] = re.compile(parser_info.kwargs["pattern"])
-
-    def __init__(self, address, *args, conditionhandler: ConditionHandler = ConditionHandler(), command_parameters: dict = None, parser_parameters: dict = None, **kwargs):
+                    command[1] = parser_info(pattern=re.compile(parser_info.kwargs["pattern"]))
+        cls._reply_pattern, cls._reply_pattern_alternatives = cls._combine_patterns(
+            cls.event_patterns, cls.error_patterns)
+
+    @staticmethod
+    def _combine_patterns(event_patterns: list[str], error_patterns: list[str]) \
+            -> tuple[Optional[re.Pattern], dict[str, re.Pattern]]:
+        """Joins event and error patterns into one alternation, so a reply is classified by a single scan.
+
+        Every alternative is wrapped in a group named _event_<i> or _error_<i>, the groups inside are prefixed with
+        that name to keep them unique. Error patterns only match at the start of a reply. Also returns the
+        separately compiled patterns by wrapping group name, to hand their own matches to handle_event and
+        CommandErrorError.
+        """
+        alternatives = {}
+        parts = []
+        for kind, patterns in (("event", event_patterns), ("error", error_patterns)):
+            for i, pattern in enumerate(patterns):
+                pattern = getattr(pattern, "pattern", pattern)
+                if re.search(r"(?<!\\)\\[1-9]", pattern):
+                    raise ValueError(f"Use named backreferences in {kind} pattern {pattern!r}.")
+                name = f"_{kind}_{i}"
+                prefixed = re.sub(r"\(\?P([<=])(\w+)", rf"(?P\1{name}_\2", pattern)
+                anchor = r"\A" if kind == "error" else ""
+                parts.append(f"{anchor}(?P<{name}>{prefixed})")
+                alternatives[name] = re.compile(pattern)
+        if not parts:
+            return None, alternatives
+        return re.compile("|".join(parts)), alternatives
+
+    def __init__(self, address, *args, conditionhandler: ConditionHandler = ConditionHandler(), command_parameters: dict = None, parser_parameters: dict = None, cache_settings: bool = False, **kwargs):
         self.conditionhandler = conditionhandler
         self.full_address = address
         self.log_name = f"{self.log_name} on {self.full_address}"
@@ -239,8 +273,13 @@ class AbstractBaseDevice(ICommander, ICommunicator, DeviceAndChannelBase):
         self.connection_method = self.get_connection_method()
         self.protocol_factory = self.protocol_factory_class(self)
         self.protocol = None
-        self.cmd_queue: list[ABDeviceCommand] = []
+        self.cmd_queue = CommandQueue()
         self.current_command: Optional[ABDeviceCommand] = None
+        # (command_name, query, channel) -> (commandstring, bytestring) for commands without command_values
+        self._commandstring_cache: dict[tuple[str, bool, Optional[int]], tuple[str, bytes]] = {}
+        # setting -> value it has once the queued commands ran, only used if cache_settings is set
+        self.cache_settings = cache_settings
+        self._settings: dict[str, Any] = {}
 
         command_parameters = command_parameters if command_parameters is not None else {}
         parser_parameters = parser_parameters if parser_parameters is not None else {}
@@ -260,15 +299,17 @@ class AbstractBaseDevice(ICommander, ICommunicator, DeviceAndChannelBase):
     def get_connection_method(self):
         if isIPAddress(self.address):
             return self._tcp
-        elif re.match("COM[0-9]{1,3}", self.address.upper()):
+        elif re.match("COM[0-9]{1,3}", self.address.upper()) or self.address.startswith("/dev/"):
             return self._serial
         else:
             raise UnknownConnectionTypeError(f"Could not recognize address: {self.full_address}")
 
     def stop(self):
-        self.cmd_queue = []
+        self.discard_queued_commands()
         # self.state = devicestate.Ready
-        with self.get_commandseries(command_parameter = self.command_parameter_factory(urgent = True, next_devicestate = devicestate.Stopped)) as series:
+        with self.get_commandseries(command_parameter = self.command_parameter_factory(
+                urgent=True, priority=CommandPriority.SAFETY_STOP,
+                next_devicestate=devicestate.Stopped)) as series:
             self.final_commands()
         self.stop_repeated_commands()
         return series.deferred_result
@@ -277,8 +318,10 @@ class AbstractBaseDevice(ICommander, ICommunicator, DeviceAndChannelBase):
         return self.stop().addBoth(self.set_state, devicestate.Shutdown)
 
     def connection_done(self, protocol) -> defer.Deferred:
-        self.log.info(f"Connected to {self.full_address}.")
+        self.log.info("Connected to {address}.", address=self.full_address)
         self.protocol = protocol
+        # the device may have been switched off or changed by hand in the meantime
+        self.invalidate_settings()
         self.state = devicestate.Initializing
         with self.commandseries as series:
             self.initial_commands()
@@ -297,6 +340,7 @@ class AbstractBaseDevice(ICommander, ICommunicator, DeviceAndChannelBase):
         return d_protocol
 
     def connection_lost(self, reason):
+        self.invalidate_settings()
         if not self.state == devicestate.Shutdown:
             self.state = devicestate.Shutdown
             self.update_observables({"errorcode": reason})
@@ -323,6 +367,48 @@ class AbstractBaseDevice(ICommander, ICommunicator, DeviceAndChannelBase):
     def query(self, command_name: str, **kwargs):
         return self.write(command_name, query=True, **kwargs)
 
+    def write_setting(self, setting: str, value, command_name: str, **kwargs) -> Optional[ABDeviceCommand]:
+        """
+        Writes command_name to change a setting, unless cache_settings is set and the setting already has this value.
+        The value is recorded when the command is written, so it is compared to what the device is set to once the
+        queued commands ran. It is forgotten if the command fails or is dropped and all values are forgotten on errors
+        and reconnects.
+        :param setting: name of the setting, e.g. "position"
+        :param value: comparable value the setting is changed to, e.g. the formatted command value
+        :return: the command or None, if it was skipped
+        """
+        if self.setting_is_current(setting, value):
+            self.log.info("Skipped {command_name}, {setting} is already {value}.", command_name=command_name,
+                          setting=setting, value=value)
+            return None
+        cmd = self.write(command_name, **kwargs)
+        # commands written while stopped are discarded
+        if self.cache_settings and self.state is not devicestate.Stopped:
+            self._settings[setting] = value
+            cmd.deferred_result.addErrback(self._forget_setting, setting, value)
+        return cmd
+
+    def setting_is_current(self, setting: str, value) -> bool:
+        """True if cache_settings is set and the setting has this value once the queued commands ran."""
+        return self.cache_settings and setting in self._settings and self._settings[setting] == value
+
+    def _forget_setting(self, result, setting: str, value):
+        if self._settings.get(setting, value) == value:
+            self._settings.pop(setting, None)
+        return result
+
+    def invalidate_settings(self):
+        """Forgets all settings, the next write_setting calls write their commands."""
+        if self._settings:
+            self.log.info("Forgetting settings {settings}.", settings=dict(self._settings))
+            self._settings.clear()
+
+    def discard_queued_commands(self):
+        """Clears the queue. Settings are forgotten if commands were discarded, they may have changed them."""
+        if self.cmd_queue:
+            self.invalidate_settings()
+            self.cmd_queue.clear()
+
     @abstractmethod
     def cmd_string(self, command_parameters: CommandParameterFactory) -> str:
         """
@@ -339,15 +425,29 @@ class AbstractBaseDevice(ICommander, ICommunicator, DeviceAndChannelBase):
         command_parameter = raw_cmd[0](**kwargs)
         parser_parameter = raw_cmd[1](**kwargs)
 
-        commandstring = self.cmd_string(command_parameter)
-        command_parameter = command_parameter(commandstring=commandstring)
-        cmd = Command(self, command_parameter, parser_parameter)
-        if isinstance(cmd.parser, parser.SuccessParser) and not self.replies_commands:
+        if command_parameter.command_values:
+            commandstring = self.cmd_string(command_parameter)
+            bytestring = None
+        else:
+            key = (command_name, command_parameter.query, command_parameter.channel)
+            try:
+                commandstring, bytestring = self._commandstring_cache[key]
+            except KeyError:
+                commandstring = self.cmd_string(command_parameter)
+                bytestring = commandstring.encode()
+                self._commandstring_cache[key] = commandstring, bytestring
+        overrides = {"commandstring": commandstring}
+        no_reply = issubclass(parser_parameter.parserclass, parser.SuccessParser) and not self.replies_commands
+        if no_reply:
+            overrides["timeout"] = (command_parameter.timeout + command_parameter.command_execution_time
+                                    + command_parameter.inter_command_time)
+        cmd = Command(self, command_parameter(**overrides), parser_parameter, bytestring=bytestring)
+        cmd.name = command_name
+        if no_reply:
             def receive_dummy_result(result):
                 self.callLater(cmd.parameters.command_execution_time + cmd.parameters.inter_command_time,
                                self.receive, Result(f"NO RESULT for {cmd}"))
                 return result
-            cmd.parameters.timeout += cmd.parameters.command_execution_time + cmd.parameters.inter_command_time
             cmd.deferred_execution.addCallback(receive_dummy_result)
         return cmd
 
@@ -355,24 +455,28 @@ class AbstractBaseDevice(ICommander, ICommunicator, DeviceAndChannelBase):
     def handle_event(self, match: re.Match) -> None:
         raise NotImplementedError
 
-    def _was_event(self, reply: Result) -> bool:
-        is_event = False
-        for pattern in self.event_patterns:
-            for match in re.finditer(pattern, reply.line):
-                is_event = True
-                self.handle_event(match)
-                self.update_observables(match.groupdict(), reply.time)
-        return is_event
-
-    def _was_error(self, reply: Result) -> bool:
-        is_error = False
-        for pattern in self.error_patterns:
-            match = re.match(pattern, reply.line)
-            if match:
-                is_error = True
-                self.current_command.temp_result = CommandErrorError(reply, match=match)
+    def _was_event_or_error(self, reply: Result) -> bool:
+        """Handles all events in the reply or, if there are none, an error at its start."""
+        if self._reply_pattern is None:
+            return False
+        line = reply.line
+        match = self._reply_pattern.search(line)
+        if match is None:
+            return False
+        if match.lastgroup.startswith("_error_"):
+            # events take precedence, errors can't match past the start
+            event_match = self._reply_pattern.search(line, 1)
+            if event_match is None:
+                error_match = self._reply_pattern_alternatives[match.lastgroup].match(line)
+                self.current_command.temp_result = CommandErrorError(reply, match=error_match)
                 self.current_command.state = commandstate.Retry
-        return is_error
+                return True
+            match = event_match
+        for match in self._reply_pattern.finditer(line, match.start()):
+            event_match = self._reply_pattern_alternatives[match.lastgroup].match(line, match.start())
+            self.handle_event(event_match)
+            self.update_observables(event_match.groupdict(), reply.time)
+        return True
 
     def receive(self, reply: Result) -> None:
         """
@@ -380,10 +484,13 @@ class AbstractBaseDevice(ICommander, ICommunicator, DeviceAndChannelBase):
         :param reply:
         :return: current_command, so that the protocol can read its state
         """
-        self.log.info(f"Received {reply}")
-        if not self._was_event(reply) and not self._was_error(reply):
+        self.log.info("Received {reply}", reply=reply)
+        if not self._was_event_or_error(reply):
+            tracer.mark_current(self.current_command, "reply")
             # get the state from parser, if commandstate.Fail is returned, no retries will be done.
-            self.current_command.temp_result, self.current_command.state = self.current_command.parser(reply)
+            temp_result, state = self.current_command.parser(reply)
+            tracer.mark_current(self.current_command, "parsed")
+            self.current_command.temp_result, self.current_command.state = temp_result, state
             self.current_command.device.update_observables(reply.parameters, reply.time)
 
     def execute_cmd(self, cmd: ABDeviceCommand):
@@ -406,7 +513,7 @@ class MultichannelBaseDevice(AbstractBaseDevice, ABC):
     def _get_channels(self) -> defer.Deferred:
         raise NotImplementedError
 
-    def update_observables(self, observables: dict, timestamp: float = time.time()):
+    def update_observables(self, observables: dict, timestamp: float = None):
         if "channel" in observables.keys():
             self.channels[int(observables.pop("channel"))].update_observables(observables, timestamp)
         else:
@@ -446,13 +553,14 @@ class MultichannelBaseDevice(AbstractBaseDevice, ABC):
     def stop(self):
         if self.channel_acting is None:
             deferreds = []
-            self.cmd_queue = []
+            self.discard_queued_commands()
             for channel in self.channels.values():
                 if not channel.state == devicestate.Stopped:
                     deferreds.append(channel.stop())
             return defer.DeferredList(deferreds).addCallback(self.set_state, devicestate.Stopped)
         else:
-            with self.get_commandseries(command_parameter = self.command_parameter_factory(urgent = True)) as series:
+            with self.get_commandseries(command_parameter = self.command_parameter_factory(
+                    urgent=True, priority=CommandPriority.SAFETY_STOP)) as series:
                 self.final_commands()
             self.stop_repeated_commands()
             return series.deferred_result.addCallback(self.channel_acting.set_state, devicestate.Stopped)
@@ -468,7 +576,7 @@ class ChannelProxy(ICommander, DeviceAndChannelBase):
         self.original_device_write = self.device.write
         self.original_device_wait = self.device.wait
         self.original_device_get_commandseries = self.device.get_commandseries
-        self.cmd_queue = []
+        self.cmd_queue = CommandQueue()
         self.current_command: Optional[ABDeviceCommand] = None
 
     def _temp_write_commandseries_change(self, function):
@@ -505,7 +613,7 @@ class ChannelProxy(ICommander, DeviceAndChannelBase):
         return command
 
     def stop(self):
-        self.cmd_queue = []
+        self.cmd_queue.clear()
         return self._temp_write_commandseries_change(self.device.stop)()
 
     def query(self, command_name: str, **kwargs):
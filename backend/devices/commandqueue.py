@@ -0,0 +1,89 @@
+from __future__ import annotations
+import heapq
+from itertools import count
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from backend import clock
+from backend.commands import commandstate
+from backend.commands.helpers_exceptions import CommandPriority
+from backend.tracing import tracer
+
+if TYPE_CHECKING:
+    from backend.commands import ABDeviceCommand
+
+
+class CommandQueue:
+    """Commands waiting to be sent to a device.
+
+    Commands are ordered by their priority and FIFO within one priority. Commands that may run while the device is
+    busy (urgent, run_while_device_busy or at least URGENT priority) are kept in a separate heap, so Busy states can
+    pick them without scanning the others. Commands with a max_queue_time are dropped when they are popped after it
+    has passed, they are never sent.
+    """
+    seconds = staticmethod(clock.seconds)
+
+    def __init__(self):
+        # entries are (priority, sequence number, deadline, command), the sequence number keeps FIFO order
+        self._busy_runnable: list[tuple[int, int, Optional[float], ABDeviceCommand]] = []
+        self._others: list[tuple[int, int, Optional[float], ABDeviceCommand]] = []
+        self._sequence = count()
+
+    def __len__(self):
+        return len(self._busy_runnable) + len(self._others)
+
+    def __bool__(self):
+        return bool(self._busy_runnable or self._others)
+
+    def __iter__(self) -> Iterator[ABDeviceCommand]:
+        """Queued commands in the order they would be sent."""
+        return (entry[3] for entry in sorted(self._busy_runnable + self._others))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self)})"
+
+    @staticmethod
+    def priority_of(cmd: ABDeviceCommand) -> CommandPriority:
+        parameters = cmd.parameters
+        if parameters.priority is not None:
+            return parameters.priority
+        return CommandPriority.URGENT if parameters.urgent else CommandPriority.NORMAL
+
+    def push(self, cmd: ABDeviceCommand):
+        parameters = cmd.parameters
+        priority = self.priority_of(cmd)
+        deadline = None if parameters.max_queue_time is None else self.seconds() + parameters.max_queue_time
+        entry = (priority, next(self._sequence), deadline, cmd)
+        if parameters.urgent or parameters.run_while_device_busy or priority <= CommandPriority.URGENT:
+            heapq.heappush(self._busy_runnable, entry)
+        else:
+            heapq.heappush(self._others, entry)
+
+    def pop(self, device_busy: bool = False) -> Optional[ABDeviceCommand]:
+        """Removes and returns the next command, None if there is none.
+
+        :param device_busy: only consider commands that may run while the device is busy
+        """
+        now = None
+        while True:
+            if device_busy or not self._others:
+                heap = self._busy_runnable
+            elif not self._busy_runnable:
+                heap = self._others
+            else:
+                heap = min(self._busy_runnable, self._others, key=lambda entries: entries[0][:2])
+            if not heap:
+                return None
+            _, _, deadline, cmd = heapq.heappop(heap)
+            if deadline is not None:
+                now = now or self.seconds()
+                if now > deadline:
+                    cmd.log.info("Dropping {command}, it was queued longer than {max_queue_time} s", command=cmd,
+                                 max_queue_time=cmd.parameters.max_queue_time)
+                    cmd.state = commandstate.Dropped
+                    continue
+            tracer.mark(cmd, "dequeued")
+            return cmd
+
+    def clear(self):
+        self._busy_runnable.clear()
+        self._others.clear()
@@ -1,14 +1,18 @@
 import importlib
+from typing import Callable, Optional
 
-from twisted.logger import Logger
 from twisted.internet import defer
 
+from backend.logger import Logger
 from .helpers_exceptions import UnknownDeviceError, UnknownChannelError, AddressInUseError
 
 
 class DeviceFactory:
-    def __init__(self):
+    def __init__(self, connect: Optional[Callable[[object, str], defer.Deferred]] = None):
+        """:param connect: connects devices instead of their connect method, called with the device and the driver
+        name, e.g. to put simulated instruments behind them"""
         self.log = Logger()
+        self.connect = connect
         self.deferred_devices: dict[str: defer.Deferred] = {}
 
     def construct_device(self, driver: str, address: str, channel: int = None, **kwargs) -> defer.Deferred:
@@ -20,7 +24,7 @@ class DeviceFactory:
             return defer.fail(UnknownDeviceError())
         except KeyError:
             device = device_module.Device(address, **kwargs)
-            deferred_protocol = device.connect()
+            deferred_protocol = device.connect() if self.connect is None else self.connect(device, driver)
             deferred_device = self.deferred_devices[address] = defer.Deferred()
 
             def callback_device(protocol, connected_device):
@@ -29,7 +33,7 @@ class DeviceFactory:
 
             def remove_device(reason):
                 self.deferred_devices.pop(address)
-                return reason
+                deferred_device.errback(reason)
 
             deferred_protocol.addCallbacks(callback_device, remove_device, [device])
         else:
@@ -2,11 +2,13 @@ from __future__ import annotations
 from multiprocessing.connection import wait
 from typing import TYPE_CHECKING
 
-from twisted.internet import reactor, defer, task
+from twisted.internet import defer, task
 
 from abc import ABC
 from .helpers_exceptions import DeviceShutdownError, DeviceErrorError
+from backend import clock
 from backend.helpers_exceptions import IState
+from backend.tracing import tracer
 
 
 if TYPE_CHECKING:
@@ -18,24 +20,21 @@ class DeviceState(IState, ABC):
         self.device = device
 
     def send_cmd(self, cmd: ABDeviceCommand):
-        if cmd.parameters.urgent:
-            pos = 0
-            for queued_cmd in self.device.cmd_queue:
-                if queued_cmd.parameters.urgent:
-                    pos += 1
-                else:
-                    break
-            self.device.cmd_queue.insert(pos, cmd)
-        else:
-            self.device.cmd_queue.append(cmd)
+        self.device.cmd_queue.push(cmd)
 
     def handle_success(self, result):
         cmd = result.command
-        return task.deferLater(reactor, cmd.parameters.inter_command_time, self.device.set_state, result,
-                                cmd.parameters.next_devicestate).addCallback(lambda _: result)
+        tracer.mark(cmd, "succeeded")
+
+        def delay_done(_):
+            tracer.finish(cmd, "delay done")
+            return result
+        return task.deferLater(clock.get_clock(), cmd.parameters.inter_command_time, self.device.set_state, result,
+                                cmd.parameters.next_devicestate).addCallback(delay_done)
 
     def handle_fail(self, failure):
         cmd = failure.value.command
+        tracer.finish(cmd, "failed", type(failure.value).__name__)
         cmd.device.state = Error
         return failure
 
@@ -72,7 +71,7 @@ class CollectingCommands(DeviceState):
 
     def send_cmd(self, cmd: ABDeviceCommand):
         if cmd.parameters.urgent:
-            self.commandseries.parameters.urgent = True
+            self.commandseries.parameters = self.commandseries.parameters(urgent=True)
         self.commandseries.commandlist.append(cmd)
 
     def add_command_callbacks(self, cmd):
@@ -81,11 +80,8 @@ class CollectingCommands(DeviceState):
 
 class Ready(DeviceState):
     def enter(self):
-        try:
-            cmd = self.device.cmd_queue.pop(0)
-        except IndexError:
-            pass
-        else:
+        cmd = self.device.cmd_queue.pop()
+        if cmd is not None:
             self.send_cmd(cmd)
 
     def send_cmd(self, cmd: ABDeviceCommand):
@@ -99,7 +95,8 @@ class Initializing(Ready):
 
 class Error(DeviceState):
     def enter(self):
-        self.device.cmd_queue = []
+        self.device.cmd_queue.clear()
+        self.device.invalidate_settings()
 
     def send_cmd(self, cmd: ABDeviceCommand):
         error = DeviceErrorError("Cannot send commands in Error state!")
@@ -112,7 +109,7 @@ class Error(DeviceState):
 
 class Stopped(DeviceState):
     def enter(self):
-        self.device.cmd_queue = []
+        self.device.cmd_queue.clear()
 
     def send_cmd(self, cmd: ABDeviceCommand):
         self.device.log.error("Device stopped, cannot send Commands in this state.")
@@ -144,14 +141,11 @@ class Busy(DeviceState):
         self._defer_result = None
 
     def _run_next_urgent_cmd(self):
-        try:
-            parameters = self.device.cmd_queue[0].parameters
-            if (parameters.urgent or parameters.run_while_device_busy) and self._ready_for_urgent_command:
-                cmd = self.device.cmd_queue.pop(0)
+        if self._ready_for_urgent_command:
+            cmd = self.device.cmd_queue.pop(device_busy=True)
+            if cmd is not None:
                 self._ready_for_urgent_command = False
                 self.device.execute_cmd(cmd)
-        except IndexError:
-            pass
 
     def _ready(self):
         try:
@@ -177,7 +171,7 @@ class Busy(DeviceState):
             return super().handle_success(result)
 
     def enter(self):
-        self.device.log.info(f"Waiting for {self.condition}")
+        self.device.log.info("Waiting for {condition}", condition=self.condition)
         self.device.conditionhandler.add_condition(self.condition, self.waitcommand.deferred_result)
         self._ready()
 
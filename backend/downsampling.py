@@ -0,0 +1,143 @@
+"""Reduces long series of samples to few points that look the same when plotted."""
+from array import array
+from bisect import bisect_left
+import math
+from typing import Iterable
+
+
+class MinMaxSummary:
+    """Minimum and maximum sample of every bucket of width seconds, bucket b holds b * width <= timestamp < (b+1) *
+    width. Only buckets that got samples are stored."""
+
+    def __init__(self, width: float):
+        self.width = width
+        self.buckets = array("q")
+        self.min_timestamps = array("d")
+        self.min_values = array("d")
+        self.max_timestamps = array("d")
+        self.max_values = array("d")
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def add(self, timestamp: float, value: float):
+        bucket = math.floor(timestamp / self.width)
+        if not self.buckets or bucket > self.buckets[-1]:
+            index = len(self.buckets)
+        else:
+            index = bisect_left(self.buckets, bucket)
+            if self.buckets[index] == bucket:
+                if value < self.min_values[index]:
+                    self.min_timestamps[index], self.min_values[index] = timestamp, value
+                if value > self.max_values[index]:
+                    self.max_timestamps[index], self.max_values[index] = timestamp, value
+                return
+        self.buckets.insert(index, bucket)
+        self.min_timestamps.insert(index, timestamp)
+        self.min_values.insert(index, value)
+        self.max_timestamps.insert(index, timestamp)
+        self.max_values.insert(index, value)
+
+    def extend(self, timestamps: Iterable[float], values: Iterable[float]):
+        """Adds many samples, faster than add if they are in order."""
+        width = self.width
+        buckets = self.buckets
+        min_timestamps, min_values = self.min_timestamps, self.min_values
+        max_timestamps, max_values = self.max_timestamps, self.max_values
+        last_bucket = buckets[-1] if buckets else None
+        for timestamp, value in zip(timestamps, values):
+            bucket = timestamp // width
+            if bucket == last_bucket:
+                if value < min_values[-1]:
+                    min_timestamps[-1], min_values[-1] = timestamp, value
+                elif value > max_values[-1]:
+                    max_timestamps[-1], max_values[-1] = timestamp, value
+            elif last_bucket is None or bucket > last_bucket:
+                last_bucket = bucket
+                buckets.append(int(bucket))
+                min_timestamps.append(timestamp)
+                min_values.append(value)
+                max_timestamps.append(timestamp)
+                max_values.append(value)
+            else:
+                self.add(timestamp, value)
+
+    def trim(self, timestamp: float):
+        """Drops the buckets that end before timestamp."""
+        index = bisect_left(self.buckets, math.floor(timestamp / self.width))
+        if index:
+            for samples in (self.buckets, self.min_timestamps, self.min_values, self.max_timestamps, self.max_values):
+                del samples[:index]
+
+    def between(self, first_bucket: int, last_bucket: int) -> range:
+        """Indices of the stored buckets with first_bucket <= bucket < last_bucket."""
+        return range(bisect_left(self.buckets, first_bucket), bisect_left(self.buckets, last_bucket))
+
+
+class MinMaxBuckets:
+    """Collects the minimum and maximum sample of buckets of width seconds, samples have to be added in order."""
+
+    def __init__(self, width: float):
+        self.width = width
+        self.points: list[tuple[float, float]] = []
+        self._bucket = None
+        self._min = self._max = None
+
+    def add(self, bucket_start: float, min_timestamp: float, min_value: float, max_timestamp: float,
+            max_value: float):
+        bucket = math.floor(bucket_start / self.width)
+        if bucket != self._bucket:
+            self._flush()
+            self._bucket = bucket
+            self._min = (min_timestamp, min_value)
+            self._max = (max_timestamp, max_value)
+            return
+        if min_value < self._min[1]:
+            self._min = (min_timestamp, min_value)
+        if max_value > self._max[1]:
+            self._max = (max_timestamp, max_value)
+
+    def add_samples(self, samples: Iterable[tuple[float, float]]):
+        for timestamp, value in samples:
+            self.add(timestamp, timestamp, value, timestamp, value)
+
+    def _flush(self):
+        if self._bucket is None:
+            return
+        if self._min[0] == self._max[0]:
+            self.points.append(self._min)
+        else:
+            self.points.extend(sorted((self._min, self._max)))
+
+    def result(self) -> list[tuple[float, float]]:
+        self._flush()
+        self._bucket = None
+        return self.points
+
+
+def lttb(points: list[tuple[float, float]], threshold: int) -> list[tuple[float, float]]:
+    """Largest-Triangle-Three-Buckets: keeps the first and the last point and from each of threshold - 2 buckets in
+    between the point spanning the largest triangle with the point kept before and the average of the next bucket."""
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+    sampled = [points[0]]
+    every = (len(points) - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(points))
+        next_points = points[next_start:next_end] or points[-1:]
+        avg_x = sum(point[0] for point in next_points) / len(next_points)
+        avg_y = sum(point[1] for point in next_points) / len(next_points)
+        ax, ay = points[a]
+        largest_area = -1.
+        for index in range(int(i * every) + 1, next_start):
+            x, y = points[index]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > largest_area:
+                largest_area = area
+                chosen = index
+        sampled.append(points[chosen])
+        a = chosen
+    sampled.append(points[-1])
+    return sampled
@@ -38,8 +38,12 @@ class Device(SinglechannelBaseDevice, BaseDevice):
         return f"{command}{sep}{value}{query}"
 
     def set_position(self, position, **kwargs):
+        position = int(float(position))
+        if self.setting_is_current("position", position):
+            # write_setting logs and skips SET_POS, returning here skips the GET_POS after it too
+            return self.write_setting("position", position, "SET_POS", command_values={"value": position}, **kwargs)
         with self.commandseries as series:
-            result = self.write("SET_POS", command_values={"value": int(float(position))}, **kwargs)
+            result = self.write_setting("position", position, "SET_POS", command_values={"value": position}, **kwargs)
             self.query("GET_POS")
         return result
 
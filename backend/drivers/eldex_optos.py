@@ -1,5 +1,4 @@
 import re
-from time import sleep
 from backend.conditions.conditions import TimeCondition
 from .pump_base import BaseDevice, SinglechannelBaseDevice, commandstate, CommandParameterFactory
 
@@ -51,7 +50,8 @@ class Device(BaseDevice, SinglechannelBaseDevice):
 
     def initial_commands(self):
         self.stop_pumping()
-        self.write("SET_REFILL_RATE_FACTOR", command_values={"value": "4"})
+        self.write_setting("refill rate factor", self._refillratefactorformat(4), "SET_REFILL_RATE_FACTOR",
+                           command_values={"value": "4"})
 
     def final_commands(self):
         self.stop_pumping()
@@ -62,8 +62,10 @@ class Device(BaseDevice, SinglechannelBaseDevice):
     def dispense(self, rate, volume, **kwargs):
         if float(volume) == 0:
             return
-        self.write("SET_VOL_RATE", command_values={"value": self._rateformat(rate)}, **kwargs)
-        sleep(0.5)
+        # the pump needs half a second after setting the rate before it is started
+        inter_command_time = max(
+            .5, kwargs.pop("inter_command_time", self.commands["SET_VOL_RATE"][0].inter_command_time))
+        self.set_rate(rate, inter_command_time=inter_command_time, **kwargs)
         time_to_pump = 60 * float(volume) / float(rate)
 
         self.write("START", **kwargs).deferred_result
@@ -77,8 +79,8 @@ class Device(BaseDevice, SinglechannelBaseDevice):
     def dispense_with_compressability(self, compressability, rate, volume, **kwargs):
         if float(volume) == 0:
             return
-        self.write("SET_COMPRESSIBILITY_COMPENSATION", command_values={"value": self._compressibilityformat(compressability)}, **kwargs)
-        self.write("SET_VOL_RATE", command_values={"value": self._rateformat(rate)}, **kwargs)
+        self.compressability_compensation(compressability, **kwargs)
+        self.set_rate(rate, **kwargs)
         time_to_pump = 60 * float(volume) / float(rate)
         self.write("START", **kwargs).deferred_result
         def stop_pumping(result):
@@ -87,25 +89,33 @@ class Device(BaseDevice, SinglechannelBaseDevice):
         self.busy(TimeCondition("dispense finished", time_to_pump)).deferred_result.addBoth(stop_pumping)
 
     def continuous_flow(self, rate, **kwargs):
-        self.write("SET_VOL_RATE", command_values={"value": self._rateformat(rate)}, **kwargs)
+        self.set_rate(rate, **kwargs)
         self.write("START", **kwargs)
 
     def continuous_flow_with_compressability(self, compressability, rate, **kwargs):
-        self.write("SET_COMPRESSIBILITY_COMPENSATION", command_values={"value": self._compressibilityformat(compressability)}, **kwargs)
-        self.write("SET_VOL_RATE", command_values={"value": self._rateformat(rate)}, **kwargs)
+        self.compressability_compensation(compressability, **kwargs)
+        self.set_rate(rate, **kwargs)
         self.write("START", **kwargs)
 
     def stop_pumping(self, **kwargs):
         self.write("STOP", **kwargs)
 
+    def set_rate(self, rate, **kwargs):
+        value = self._rateformat(rate)
+        return self.write_setting("rate", value, "SET_VOL_RATE", command_values={"value": value}, **kwargs)
+
     def set_refill_rate_factor(self, refillratefactor, **kwargs):
-        self.write("SET_REFILL_RATE_FACTOR", command_values={"value": self._refillratefactorformat(refillratefactor)}, **kwargs)
+        value = self._refillratefactorformat(refillratefactor)
+        return self.write_setting("refill rate factor", value, "SET_REFILL_RATE_FACTOR", command_values={"value": value},
+                                  **kwargs)
 
     # def start_pumping(self, **kwargs):
     #     self.write("START", **kwargs)
 
     def compressability_compensation(self, compressability, **kwargs):
-        self.write("SET_COMPRESSIBILITY_COMPENSATION", command_values={"value": self._compressibilityformat(compressability)}, **kwargs)
+        value = self._compressibilityformat(compressability)
+        return self.write_setting("compressibility compensation", value, "SET_COMPRESSIBILITY_COMPENSATION",
+                                  command_values={"value": value}, **kwargs)
 
     @staticmethod
     def _rateformat(value):
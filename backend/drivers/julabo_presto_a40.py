@@ -160,7 +160,7 @@ class Device(SinglechannelBaseDevice, BaseDevice):
     def set_temperature(self, temperature, tolerance, tolerance_duration, **kwargs):
         lower_limit, upper_limit = float(temperature) - float(tolerance), float(temperature) + float(tolerance)
         with self.commandseries as series:
-            series.parameters.urgent = True
+            series.parameters = series.parameters(urgent=True)
             self.write("SET_USE_WORKING_TEMP", command_values={"value": "0"}, **kwargs)
             self.write("SET_WORKING_TEMP_1", command_values={"value": f"{float(temperature):.2f}"}, **kwargs)
             self.write("SET_START_STOP", command_values={"value": "1"}, **kwargs)
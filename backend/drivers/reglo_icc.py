@@ -329,7 +329,7 @@ class Device(BaseDevice, MultichannelBaseDevice):
 
         observable = self.channel_acting or self
         remaining_time = MathExpression(
-            observable, "remaining_time", f"abs(60*({volume}-(dosed_volume/1000))/{rate})")
+            observable, "remaining_time", f"abs(60*({volume}-(dosed_volume/1000))/{abs(float(rate))})")
 
         def start_time(result):
             remaining_time.start()
@@ -1,48 +1,120 @@
 #This wants to be the driver for a Magritek Spinsolve 60 benchtop NMR
 import re
-from backend.conditions.conditions import TimeCondition, ObservableEqualsValueCondition
+from xml.etree import ElementTree
+
+from backend import clock
+from backend.conditions.conditions import ObservableEqualsValueCondition
 from backend.commands.parser import ParserParameterFactory, SuccessParser
-from .nmr_base import BaseDevice, SinglechannelBaseDevice, commandstate, CommandParameterFactory
-from backend.devices.base import AbstractBaseDevice
-import socket
-import time
+from .nmr_base import BaseDevice, SinglechannelBaseDevice, CommandParameterFactory
+from backend.devices import devicestate
+from backend.devices.base import BaseDeviceProtocol, BaseDeviceProtocolFactory, IProtocolCommand
 
 
-class Device(BaseDevice, SinglechannelBaseDevice):
+class SpinsolveProtocol(BaseDeviceProtocol):
+    """Writes the XML requests as they are and splits the incoming stream into complete messages."""
+    MAX_LENGTH = 2 ** 20  # option and data responses can be long
+
+    def write_command(self, command_object: IProtocolCommand):
+        self.transport.write(command_object.bytestring)
+        self.device.log.info("Wrote {commandstring} to device.", commandstring=command_object.parameters.commandstring)
+
+    def lineReceived(self, line):
+        received = clock.seconds()
+        # the delimiter is the closing tag of the message, the xml declaration has to be at the very start
+        message = (line + self.delimiter).lstrip()
+        try:
+            root = ElementTree.fromstring(message)
+        except ElementTree.ParseError as e:
+            self.device.log.warn("Could not parse message {message!r}: {error}", message=message, error=e)
+        else:
+            self.device.receive_message(root, received)
+
+
+class SpinsolveProtocolFactory(BaseDeviceProtocolFactory):
+    protocol = SpinsolveProtocol
+
+
+class ReportedValueCondition(ObservableEqualsValueCondition):
+    """Fulfilled by a value reported after command was written, also if the condition is added later, once the
+    device turned busy."""
+    def __init__(self, title, command, observable_object, observable_name: str, value: str):
+        super().__init__(title, observable_object, observable_name, value)
+        command.deferred_execution.addCallback(self._written)
+
+    def _written(self, result):
+        self.starting_time = clock.seconds()
+        self.reset_status()
+        return result
+
+    def start(self):
+        # it started when the command was written
+        pass
+
+    def check_condition(self) -> bool:
+        return self.starting_time is not None and super().check_condition()
+
 
-    #is_true = AbstractBaseDevice._was_event(reply=True)
+class Device(BaseDevice, SinglechannelBaseDevice):
     log_name = "BenchtopNMR"
+    protocol_factory_class = SpinsolveProtocolFactory
     replies_commands = False
-    reply_to_state = {"<?xml": commandstate.Success} #r"secondsRemaining=\"(?P<secondsRemaining>.*)\"""r"<.+>"
-    delimiter = "</Message>"  #"\r\n"receiving_delimiter = "</Message>"
-    #sending_delimiter = ""
-    event_patterns = [
-        r"completed=\"(?P<completed>.+?)\"",
-        # r"secondsRemaining=\"(?P<secondsRemaining>[0-9]+)",
-        # r"(?P<completed>.+)",
-        r"percentage",
-        r"status=\"Ready\"",
-        r"error=\"\""
-        # r"[\d\D]+"
-    ]
-#    error_pattern = [
-#        r"error=\".+?\""
-#    ]
+    reply_to_state = {}
+    delimiter = "</Message>"
     command_parameter_factory = CommandParameterFactory(timeout=5.0, inter_command_time=0.5, retries=3)
     parser_parameter_factory = ParserParameterFactory(parserclass=SuccessParser)
 
+    # attributes of notifications that are published, with the observable name they are published as
+    notification_observables = {
+        "status": "status",
+        "protocol": "protocol",
+        "completed": "completed",
+        "successful": "successful",
+        "percentage": "percentage",
+        "secondsRemaining": "time_remaining",
+        "error": "error",
+    }
+
     commands = {
         # Asks for protocol options
-        "PROTOCOL_OPTIONS" : ["<Message><AvailableOptionsRequest protocol='1D PROTON'/></Message>"],
+        "PROTOCOL_OPTIONS": ["<Message><AvailableOptionsRequest protocol='1D PROTON'/></Message>"],
         # Start a CheckShim
-        "CHECKSHIM" : ["<Message><CheckShimRequest/></Message>",r"(?P<Text>.+)"],#status=\"(?P<Status>.+?)\".+"],#r".+"],# r"OK(?P<refill_rate_factor>[0-4])"]
-        "WaitCommand" : ["",r".*"],
+        "CHECKSHIM": ["<Message><CheckShimRequest/></Message>"],
         # Aborts current action
-        "ABORT" : ["<Message><Abort/></Message>"],
+        "ABORT": ["<Message><Abort/></Message>"],
         # Starts a Proton Quickscan
-        "QUICKSCAN" : ["<Message><Start protocol='1D PROTON'><Option name='Scan' value='QuickScan'/></Start></Message>"],
+        "QUICKSCAN": ["<Message><Start protocol='1D PROTON'><Option name='Scan' value='QuickScan'/></Start></Message>"],
+        # Starts a Proton Standardscan
+        "STANDARDSCAN": [
+            "<Message><Start protocol='1D PROTON'><Option name='Scan' value='StandardScan'/></Start></Message>"],
+        "QUICKSHIM_ON_SOLVENT": [
+            "<Message><Start protocol='SHIM 1H SAMPLE'><Option name='Mode' value='Manual' />"
+            "<Option name='manualStart' value='60' /><Option name='manualEnd' value='-40' />"
+            "<Option name='Shim' value='QuickShim2' /></Start></Message>"],
+        "POWERSHIM_ON_SOLVENT": [
+            "<Message><Start protocol='SHIM 1H SAMPLE'><Option name='Mode' value='Manual' />"
+            "<Option name='manualStart' value='60' /><Option name='manualEnd' value='-40' />"
+            "<Option name='Shim' value='PowerShim' /></Start></Message>"],
+        "F19HDEC": [
+            "<Message><Start protocol='1D FLUORINE HDEC WALTZ'><Option name='Number' value='128'/>"
+            "<Option name='AcquisitionTime' value='3.2'/><Option name='RepetitionTime' value='30'/>"
+            "<Option name='PulseAngle' value='90'/><Option name='centerFrequency' value='-110'/>"
+            "<Option name='decouple' value='On'/><Processing><Press Name='MNOVA'/></Processing></Start></Message>"],
+    }
+    # expected duration of the protocols in s
+    protocol_durations = {
+        "CHECKSHIM": 18,
+        "QUICKSCAN": 18,
+        "STANDARDSCAN": 70,
+        "QUICKSHIM_ON_SOLVENT": 310,
+        "POWERSHIM_ON_SOLVENT": 2500,
+        "F19HDEC": 3900,
     }
-#(?m)
+    protocol_timeout_factor = 2
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._protocol = None  # (command name, busy condition, timeout) of the running protocol
+
 # <?xml version="1.0" encoding="utf-8"?>
 #   <Message>
 #       <StatusNotification timestamp="09:37:49">
@@ -56,66 +128,90 @@ class Device(BaseDevice, SinglechannelBaseDevice):
             value = ""
         return f"{command_parameters.commandstring}{value}"
 
+    def receive_message(self, message: ElementTree.Element, timestamp: float):
+        """Publishes status notifications as observables and responses by their tag as 'response'. Commands are
+        not answered by the instrument, they get their result independently of these messages."""
+        observables = {}
+        failure = None
+        for element in message:
+            if element.tag == "StatusNotification":
+                for notification in element:
+                    if notification.get("successful") == "false":
+                        failure = "not successful"
+                    if notification.get("error"):
+                        failure = notification.get("error")
+                    for attribute, value in notification.attrib.items():
+                        try:
+                            observables[self.notification_observables[attribute]] = value
+                        except KeyError:
+                            pass
+            elif element.tag.endswith("Response"):
+                observables["response"] = element.tag
+        if failure is not None and self._protocol is not None:
+            self._protocol_failed(failure)
+        if observables:
+            self.update_observables(observables, timestamp)
+
+    def _run_protocol(self, command_name, observable_name="status", value="Ready", **kwargs):
+        """Starts a protocol and keeps the device busy until the instrument reports observable_name as value. The
+        device turns to Error if the protocol reports an error or takes protocol_timeout_factor times longer than
+        expected."""
+        command = self.get_cmd(command_name, **kwargs)
+        condition = ReportedValueCondition(f"{command_name} finished", command, self, observable_name, value)
+        # a ready device writes the command right away
+        command.deferred_execution.addCallback(self._protocol_started, command_name, condition)
+        self.send_cmd(command)
+        wait = self.busy(condition)
+        # the instrument may have reported before the device turned busy, it is checked once it did
+        wait.deferred_execution.addCallback(
+            lambda result: self.callLater(0, self.conditionhandler.check_conditions_and_callback, [condition]))
+        wait.deferred_result.addBoth(self._protocol_ended, condition)
+        return wait
+
+    def _protocol_started(self, result, command_name: str, condition):
+        timeout = self.protocol_timeout_factor * self.protocol_durations[command_name]
+        self._protocol = (command_name, condition, self.callLater(timeout, self._protocol_failed,
+                                                                  f"not finished after {timeout} s"))
+        return result
+
+    def _protocol_ended(self, result, condition=None):
+        """Forgets the running protocol, if condition is given only if it is the condition of its wait."""
+        if self._protocol is not None and condition in (None, self._protocol[1]):
+            _, _, timer = self._protocol
+            if timer.active():
+                timer.cancel()
+            self._protocol = None
+        return result
+
+    def _protocol_failed(self, reason: str):
+        command_name, _, _ = self._protocol
+        self.log.error("{command_name} failed: {reason}", command_name=command_name, reason=reason)
+        self._protocol_ended(None)
+        self.state = devicestate.Error
+
     def stop_measurement(self, **kwargs):
-        print("NMR function Stop_measurment")
-        #self.write("ABORT")
-
-    def nmr_wait_function(self):
-        HOST = "127.0.0.1"    # Replace
-        PORT = 13000          # Default port
-        print('Connect to ' + HOST + ':' + str(PORT))
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((HOST, PORT))
-        s.send("<Message><Start protocol='1D PROTON'><Option name='Scan' value='StandardScan'/></Start></Message>".encode())
-        self.busy(TimeCondition("waiting finished in", 70))
-
-    def start_shimming(self):
-        # problem withe the second measuremnt while using the self.write command
-        # TODO fix this
-        HOST = "127.0.0.1"    # Replace
-        PORT = 13000          # Default port
-        print('Connect to ' + HOST + ':' + str(PORT))
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((HOST, PORT))
-        s.send("<Message><CheckShimRequest/></Message>".encode())
-        self.busy(TimeCondition("shimming finished in", 18))
-
-    def shim_on_solvent(self):
-        HOST = "127.0.0.1"    # Replace
-        PORT = 13000          # Default port
-        print('Connect to ' + HOST + ':' + str(PORT))
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((HOST, PORT))
-        s.send("<Message><Start protocol='SHIM 1H SAMPLE'><Option name='Mode' value='Manual' /><Option name='manualStart' value='60' /><Option name='manualEnd' value='-40' /><Option name='Shim' value='QuickShim2' /></Start></Message>".encode())
-        self.busy(TimeCondition("shimming finished in", 310))
-
-    def powershim_on_solvent(self):
-        HOST = "127.0.0.1"    # Replace
-        PORT = 13000          # Default port
-        print('Connect to ' + HOST + ':' + str(PORT))
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((HOST, PORT))
-        s.send("<Message><Start protocol='SHIM 1H SAMPLE'><Option name='Mode' value='Manual' /><Option name='manualStart' value='60' /><Option name='manualEnd' value='-40' /><Option name='Shim' value='PowerShim' /></Start></Message>".encode())
-        self.busy(TimeCondition("shimming finished in", 2500))
-
-
-    def h1_measurement(self):
-        HOST = "127.0.0.1"    # Replace
-        PORT = 13000          # Default port
-        print('Connect to ' + HOST + ':' + str(PORT))
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((HOST, PORT))
-        s.send("<Message><Start protocol='1D PROTON'><Option name='Scan' value='QuickScan'/></Start></Message>".encode())
-        self.busy(TimeCondition("measurement finished in", 18))
-
-    def f19hdec_measurement(self):
-        HOST = "127.0.0.1"    # Replace
-        PORT = 13000          # Default port
-        print('Connect to ' + HOST + ':' + str(PORT))
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((HOST, PORT))
-        s.send("<Message><Start protocol='1D FLUORINE HDEC WALTZ'><Option name='Number' value='128'/><Option name='AcquisitionTime' value='3.2'/><Option name='RepetitionTime' value='30'/><Option name='PulseAngle' value='90'/><Option name='centerFrequency' value='-110'/><Option name='decouple' value='On'/><Processing><Press Name='MNOVA'/></Processing></Start></Message>".encode())
-        self.busy(TimeCondition("measurement finished in", 3900))
+        # the aborted protocol reports it wasn't successful
+        self._protocol_ended(None)
+        kwargs.setdefault("urgent", True)
+        return self.write("ABORT", **kwargs)
+
+    def nmr_wait_function(self, **kwargs):
+        return self._run_protocol("STANDARDSCAN", **kwargs)
+
+    def start_shimming(self, **kwargs):
+        return self._run_protocol("CHECKSHIM", "response", "CheckShimResponse", **kwargs)
+
+    def shim_on_solvent(self, **kwargs):
+        return self._run_protocol("QUICKSHIM_ON_SOLVENT", **kwargs)
+
+    def powershim_on_solvent(self, **kwargs):
+        return self._run_protocol("POWERSHIM_ON_SOLVENT", **kwargs)
+
+    def h1_measurement(self, **kwargs):
+        return self._run_protocol("QUICKSCAN", **kwargs)
+
+    def f19hdec_measurement(self, **kwargs):
+        return self._run_protocol("F19HDEC", **kwargs)
 
     def start_measurement(self, **kwargs):
         pass
@@ -126,35 +222,5 @@ class Device(BaseDevice, SinglechannelBaseDevice):
     def final_commands(self):
         pass
 
-    # def cmd_string(self, command_parameters: CommandParameterFactory) -> str:
-    #     return command_parameters.commandstring
-    
     def handle_event(self, match: re.Match) -> None:
         pass
-
-    #def start_shimming(self):
-        # problem withe the second measuremnt while using the self.write command
-        # TODO fix this
-        ##HOST = "127.0.0.1"    # Replace
-        ##PORT = 13000          # Default port
-        ##print('Connect to ' + HOST + ':' + str(PORT))
-        ##s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        ##s.connect((HOST, PORT))
-        ##s.send("<Message><CheckShimRequest/></Message>".encode())
-        # def check_chunk(s : socket):
-        #     s.settimeout(5.0)
-        #     chunk = s.recv(8192)
-        #     if re.search(chunk,r"Please run a quickshim"):
-        #         s.send("<Message><QuickShimRequest/></Message>".encode())
-        #     else:
-        #         print("No QuickShim needed!")
-        #     print(chunk) #TODO delete me plx!
-        # def stop_measurement(result):
-        #     self.stop_measurement(urgent=True)
-        #     return result
-        ##self.busy(TimeCondition("shimming finished in", 18))
-        #print("Hallo Welt!")
-        #check_chunk(s)
-        #.deferred_result.addBoth(stop_measurement)
-        #observable = self
-        #self.busy(ObservableEqualsValueCondition("shimming finished",self,"completed","true")).deferred_result.addBoth(stop_measurement)
@@ -274,8 +274,8 @@ class Device(BaseDevice, SinglechannelBaseDevice):
             self._voltage_measuring = None
 
     def output_constant_current(self, current, max_voltage="MAX", amount_of_charge=None):
-        self.write("SET_CURRENT", command_values={"value": current})
-        self.write("SET_VOLTAGE", command_values={"value": max_voltage})
+        self.write_setting("current", str(current), "SET_CURRENT", command_values={"value": current})
+        self.write_setting("voltage", str(max_voltage), "SET_VOLTAGE", command_values={"value": max_voltage})
 
         deferred_result = self.write("SET_OUTPUT", command_values={"value": 1}).deferred_result
         
@@ -0,0 +1,103 @@
+"""
+Writes the observable updates of an experiment to disk while it runs. Updates are appended to values.jsonl, one json
+list [device name, observable, timestamp, value] per line, in batches from a background thread, so the reactor never
+waits for the disk and a crash loses at most the last batch. values.json with all updates by device name and
+observable is made from it on demand:
+
+    python -m backend.experiments.datawriter logs/2024/5/17/experiment_id
+"""
+from collections import defaultdict
+import json
+from pathlib import Path
+import sys
+import threading
+from typing import Optional
+
+from backend.logger import Logger
+
+
+class ExperimentDataWriter:
+    """Appends the updates given to write to path in a thread of its own every flush_interval s, or earlier once
+    flush_records updates are waiting."""
+
+    def __init__(self, path: Path, flush_interval: float = .5, flush_records: int = 1000):
+        self.log = Logger(namespace="Experiment Data")
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.flush_records = flush_records
+        self.records_written = 0
+        self._pending: list[tuple] = []
+        self._lock = threading.Lock()
+        self._flush_now = threading.Event()
+        self._closing = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"data writer {self.path.parent.name}", daemon=True)
+        self._thread.start()
+
+    def write(self, device_name: str, observable_key: str, timestamp: float, value):
+        with self._lock:
+            self._pending.append((device_name, observable_key, timestamp, value))
+            pending = len(self._pending)
+        if pending >= self.flush_records:
+            self._flush_now.set()
+
+    def close(self):
+        """Writes the updates still waiting and ends the thread."""
+        self._closing = True
+        self._flush_now.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        with self.path.open("a") as file:
+            while not self._closing:
+                self._flush_now.wait(self.flush_interval)
+                self._flush_now.clear()
+                self._flush(file)
+            self._flush(file)
+
+    def _flush(self, file):
+        with self._lock:
+            records, self._pending = self._pending, []
+        if not records:
+            return
+        try:
+            # values that json doesn't know, like enums of states, are written as their str
+            file.write("".join(json.dumps(record, default=str) + "\n" for record in records))
+            file.flush()
+        except Exception:
+            self.log.failure("Could not write {count} updates to {path}", count=len(records), path=str(self.path))
+        else:
+            self.records_written += len(records)
+
+
+def read_values(path: Path) -> dict[str, dict[str, list[tuple[float, object]]]]:
+    """The updates of values.jsonl at path by device name and observable. A line cut off by a crash is left out."""
+    values = defaultdict(lambda: defaultdict(list))
+    with Path(path).open("r") as file:
+        for line in file:
+            try:
+                device_name, observable_key, timestamp, value = json.loads(line)
+            except ValueError:
+                continue
+            values[device_name][observable_key].append((timestamp, value))
+    return values
+
+
+def write_values_json(log_path: Path) -> Path:
+    """Writes values.json of the experiment logged to log_path from its values.jsonl.
+    :return: the path of values.json
+    """
+    log_path = Path(log_path)
+    values_file = log_path / "values.json"
+    with values_file.open("w") as file:
+        json.dump(read_values(log_path / "values.jsonl"), file)
+    return values_file
+
+
+if __name__ == "__main__":
+    for log_path in sys.argv[1:]:
+        print(write_values_json(Path(log_path)))
@@ -1,18 +1,47 @@
 from typing import Callable, Optional
 from collections import defaultdict
 from datetime import date
-from pathlib import Path
 import json
 
-from twisted.logger import FilteringLogObserver, LogLevelFilterPredicate, LogLevel, jsonFileLogObserver, globalLogPublisher, Logger, textFileLogObserver
-from twisted.internet import defer
+from twisted.logger import FilteringLogObserver, ILogFilterPredicate, LogLevelFilterPredicate, LogLevel, PredicateResult, jsonFileLogObserver, globalLogPublisher, textFileLogObserver
+from twisted.internet import defer, threads
+from zope.interface import implementer
 
 from backend.helpers_exceptions import StateMachineMixIn, IObserver, BaseObservable
-from backend.conditions.conditions import DevicesWaitingCondition, DevicesStateEqualsCondition
+from backend.conditions.conditions import DevicesWaitingCondition, DevicesStateEqualsCondition, TimeCondition
 from backend.devices import devicestate
+from backend.logger import Logger
+from backend.logqueue import log_queue_options, queued_file_observer
+from backend.tracing import tracer
+from .datawriter import ExperimentDataWriter
 from .experimentstates import *
 
 
+@implementer(ILogFilterPredicate)
+class ExperimentLogFilterPredicate:
+    """Leaves out the events of the other running experiments and of their devices, which the experiment doesn't
+    use. Events of the setup and of idle devices are kept."""
+
+    def __init__(self, experiment: "Experiment"):
+        self.experiment = experiment
+        self.setup = experiment.factory.setup
+        self._own_namespaces = experiment.log_namespaces()
+        self._revision = None
+        self._other_namespaces = set()
+
+    def __call__(self, event: dict) -> PredicateResult:
+        namespace = event.get("log_namespace")
+        if namespace in self._own_namespaces:
+            return PredicateResult.maybe
+        # the running experiments only change with the revision of the setup
+        if self._revision != self.setup.revision:
+            self._revision = self.setup.revision
+            self._other_namespaces = set().union(
+                *(experiment.log_namespaces() for experiment in list(self.setup.running_experiments.values())
+                  if experiment is not self.experiment)) - self._own_namespaces
+        return PredicateResult.no if namespace in self._other_namespaces else PredicateResult.maybe
+
+
 class Experiment(StateMachineMixIn, BaseObservable, IObserver):
     def __init__(self, factory, commands: list[tuple[Callable, list, dict]], experiment_id: str, devices_and_channels: dict, parameters: dict, stopconditions: list, log_name: str, subexperiments: list):
         self.id = experiment_id
@@ -25,19 +54,22 @@ class Experiment(StateMachineMixIn, BaseObservable, IObserver):
             self.stopcondition_deferreds[condition].append(self.deferred_fail)
         self.starting_time: Optional[float] = None
         self.finishing_time: Optional[float] = None
+        self.trace_start: Optional[float] = None  # in the time of the tracer
         self.log_name = log_name
         self.log = Logger(namespace=self.log_name)
         self.json_log_observer = None
         self.text_log_observer = None
+        self._queued_log_observers = []
         self._log_path = None
         self.devices_and_channels = devices_and_channels
         self._device_to_name = {device: devicename for devicename, device in self.devices_and_channels.items()}
-        self.observed_updates = {devicename: defaultdict(list) for devicename in self.devices_and_channels.keys()}
+        self.data_writer: Optional[ExperimentDataWriter] = None
         super().__init__(initial_stateclass=Waiting)
         self.commands = commands
         self.subexperiments = subexperiments
         self.command_index = 0
         self.deferred_success = defer.Deferred()
+        self.deferred_stopped: Optional[defer.Deferred] = None  # fires once the devices of a failed experiment stopped
         for exp in subexperiments:
             exp.superexperiment = self
 
@@ -45,37 +77,79 @@ class Experiment(StateMachineMixIn, BaseObservable, IObserver):
     def log_path(self):
         if self._log_path is None:
             today = date.today()
-            log_path = Path(f"logs/{today.year}/{today.month}/{today.day}/{self.id}")
+            log_path = self.factory.setup.log_directory / f"{today.year}/{today.month}/{today.day}/{self.id}"
             log_path.mkdir(parents=True, exist_ok=True)
             self.log.info("setting self._log_path")
             self._log_path = log_path
         return self._log_path
 
+    def log_namespaces(self) -> set[str]:
+        """Namespaces of the events of the experiment, its subexperiments and their devices and channels."""
+        namespaces = {self.log_name}
+        for device in self.devices_and_channels.values():
+            namespaces.add(device.log_name)
+            if hasattr(device, "channel"):
+                namespaces.add(device.device.log_name)
+        for subexperiment in self.subexperiments:
+            namespaces |= subexperiment.log_namespaces()
+        return namespaces
+
     def start_log_observer(self):
-        filter_predicate = LogLevelFilterPredicate(defaultLogLevel=LogLevel.levelWithName(self.factory.setup.config["log_level"]))
+        # experiments running at the same time log to the same publisher
+        filter_predicates = [LogLevelFilterPredicate(defaultLogLevel=LogLevel.levelWithName(self.factory.setup.config["log_level"])),
+                             ExperimentLogFilterPredicate(self)]
+
+        queue_options = log_queue_options(self.factory.setup.config)
 
         json_log_file = self.log_path / "log.json"
-        json_observer = jsonFileLogObserver(json_log_file.open("w"))
-        self.json_log_observer = FilteringLogObserver(json_observer, [filter_predicate])
+        self._queued_log_observers = [
+            queued_file_observer(f"{self.id}/log.json", json_log_file.open("w"), jsonFileLogObserver, **queue_options)]
+        self.json_log_observer = FilteringLogObserver(self._queued_log_observers[0], filter_predicates)
         globalLogPublisher.addObserver(self.json_log_observer)
 
         text_log_file = self.log_path / "log.txt"
-        text_observer = textFileLogObserver(text_log_file.open("w"))
-        self.text_log_observer = FilteringLogObserver(text_observer, [filter_predicate])
+        self._queued_log_observers.append(
+            queued_file_observer(f"{self.id}/log.txt", text_log_file.open("w"), textFileLogObserver, **queue_options))
+        self.text_log_observer = FilteringLogObserver(self._queued_log_observers[1], filter_predicates)
         globalLogPublisher.addObserver(self.text_log_observer)
 
-    def _save_observed_updates(self):
-        values_file = self.log_path / "values.json"
-        with values_file.open("w") as file:
-            json.dump(self.observed_updates, file)
+    def start_data_writer(self):
+        data_config = self.factory.setup.config.get("experiment data") or {}
+        self.data_writer = ExperimentDataWriter(self.log_path / "values.jsonl",
+                                                float(data_config.get("flush interval", 500)) / 1000,
+                                                int(data_config.get("flush records", 1000)))
+        self.data_writer.start()
+
+    def chrome_trace(self) -> dict:
+        """Chrome trace of the commands of the devices of the experiment since it started."""
+        return tracer.chrome_trace(self.trace_start, devices=self.devices_and_channels.values(), process_name=self.id)
+
+    def _save_trace(self):
+        if tracer.enabled and self.trace_start is not None:
+            trace_file = self.log_path / "trace.json"
+            trace = self.chrome_trace()
+
+            def write():
+                with trace_file.open("w") as file:
+                    json.dump(trace, file)
+            threads.deferToThread(write).addErrback(
+                lambda failure: self.log.failure("Could not write the trace to {path}", failure, path=str(trace_file)))
+
+    def _stop_data_writer(self):
+        if self.data_writer is not None:
+            self.data_writer.close()
 
     def _stop_log_observer(self):
         globalLogPublisher.removeObserver(self.json_log_observer)
         globalLogPublisher.removeObserver(self.text_log_observer)
+        for observer in self._queued_log_observers:
+            observer.stop()
+        self._queued_log_observers = []
 
     def finish_experiment(self):
         self._stop_log_observer()
-        self._save_observed_updates()
+        self._stop_data_writer()
+        self._save_trace()
         for condition, deferreds in self.stopcondition_deferreds.items():
             for deferred in deferreds:
                 self.factory.setup.conditionhandler.remove_deferred_for_condition(deferred, condition)
@@ -84,8 +158,13 @@ class Experiment(StateMachineMixIn, BaseObservable, IObserver):
             device.unsubscribe(self)
 
     def _stop_devices(self, result):
-        condition = DevicesStateEqualsCondition(f"Devices stopped by {self.log_name}", self.devices_and_channels.values(), devicestate.Stopped)
-        for device in self.devices_and_channels.values():
+        # a device in Error takes no commands, its queue was cleared
+        devices = [device for device in self.devices_and_channels.values()
+                   if device.state not in (devicestate.Error, devicestate.Stopped)]
+        if not devices:
+            return defer.succeed(None)
+        condition = DevicesStateEqualsCondition(f"Devices stopped by {self.log_name}", devices, devicestate.Stopped)
+        for device in devices:
             device.stop()
         return self.factory.setup.conditionhandler.add_condition(condition)
 
@@ -103,27 +182,83 @@ class Experiment(StateMachineMixIn, BaseObservable, IObserver):
             self.command_index += 1
             experiment.execute().addCallback(lambda _: self._run_command())
         except IndexError:
-            condition = DevicesWaitingCondition(f"Devices reached last command of {self.log_name}", list(self.devices_and_channels.values()))
-            wait_commands = [device.wait for device in self.devices_and_channels.values()]
-            experiment_done = defer.DeferredList([command(condition).deferred_result for command in wait_commands])
-            experiment_done.addCallback(self._commands_finished)
-            experiment_done.addCallback(self.set_state, Finished)
-            experiment_done.addCallback(self.deferred_success.callback)
+            self._wait_for_devices()
         else:
             function(*args, **kwargs)  
             self.command_index += 1
             self._run_command()
-        
+
+    def _wait_for_devices(self):
+        condition = DevicesWaitingCondition(f"Devices reached last command of {self.log_name}", list(self.devices_and_channels.values()))
+        wait_commands = [device.wait for device in self.devices_and_channels.values()]
+        experiment_done = defer.DeferredList([command(condition).deferred_result for command in wait_commands])
+        experiment_done.addCallback(self._commands_finished)
+        experiment_done.addCallback(self.set_state, Finished)
+        experiment_done.addCallback(self.deferred_success.callback)
+
+    def _run_steps(self):
+        """Dispatches every step of the step graph of the factory once the steps it comes after are finished or
+        dispatched, so independent device queues and subexperiments run in parallel."""
+        self._steps_left = len(self.commands)
+        self._dispatched_steps = set()
+        self._steps_waited_for = []
+        self._after_finished = defaultdict(list)
+        self._after_dispatched = defaultdict(list)
+        for index, (after_finished, after_dispatched) in enumerate(self.factory.step_graph):
+            self._steps_waited_for.append(after_finished | after_dispatched)
+            for previous in after_finished:
+                self._after_finished[previous].append(index)
+            for previous in after_dispatched:
+                self._after_dispatched[previous].append(index)
+        if not self.commands:
+            self._wait_for_devices()
+        for index in [index for index, waited_for in enumerate(self._steps_waited_for) if not waited_for]:
+            self._dispatch_step(index)
+
+    def _dispatch_step(self, index: int):
+        self._dispatched_steps.add(index)
+        step = self.commands[index]
+        if isinstance(step, Experiment):
+            step_finished = step.execute()
+        else:
+            function, args, kwargs = step
+            function(*args, **kwargs)
+            step_finished = None
+            if self._after_finished[index]:
+                # the device has worked through the step once it reaches a wait queued behind it
+                condition = TimeCondition(f"Step {index} of {self.log_name} done", 0)
+                step_finished = self.factory.step_devices[index].wait(condition).deferred_result
+        self._release_steps(index, self._after_dispatched)
+        if step_finished is None:
+            self._step_finished(None, index)
+        else:
+            step_finished.addCallback(self._step_finished, index)
+
+    def _release_steps(self, index: int, waiting_steps: dict[int, list[int]]):
+        for waiting_step in waiting_steps[index]:
+            self._steps_waited_for[waiting_step].discard(index)
+            if not self._steps_waited_for[waiting_step] and waiting_step not in self._dispatched_steps:
+                self._dispatch_step(waiting_step)
+
+    def _step_finished(self, result, index: int):
+        self._release_steps(index, self._after_finished)
+        self._steps_left -= 1
+        if not self._steps_left:
+            self._wait_for_devices()
+        return result
 
     def execute(self):
         self.state = Running
         for condition in self.stopcondition_deferreds.keys():
             self.factory.setup.conditionhandler.add_condition(condition, self.deferred_fail)
-        self._run_command()
+        if self.factory.step_graph is None:
+            self._run_command()
+        else:
+            self._run_steps()
         return self.deferred_success.addCallback(lambda _: Finished)
 
     def update(self, observable, observable_key, updated_value, timestamp):
-        self.observed_updates[self._device_to_name[observable]][observable_key].append((timestamp, updated_value))
+        self.data_writer.write(self._device_to_name[observable], observable_key, timestamp, updated_value)
         if observable_key == "state" and updated_value == "Error":
             self.state = Failed
 
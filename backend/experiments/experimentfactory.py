@@ -1,4 +1,6 @@
 from collections import defaultdict
+from typing import Optional
+
 from twisted.internet import defer
 
 from backend.conditions.conditions import DevicesWaitingCondition
@@ -17,16 +19,37 @@ class ExperimentFactory:
         self.experiment_observable_details = experimentconfig["observables"] or []
         self.stopcondition_parameters = experimentconfig["stopconditions"] or []
         self.condition_parameters = experimentconfig["conditions"] or {}
+        # s the experiment is expected to take, used for scheduling until experiments of this type finished
+        self.estimated_duration: Optional[float] = experimentconfig.get("duration")
 
         self.devices_and_channels = {}
 
-        commandconfig = experimentconfig["commands"]
+        # step graph of the optional dependency form of commands, None runs the commands one after another
+        self.step_graph: Optional[list[tuple[set[int], set[int]]]] = None
+        # device or channel of every device command step, None for subexperiments
+        self.step_devices = []
+        # (device name, function name) of every device command step, None for subexperiments
+        self.step_names: list[Optional[tuple[str, str]]] = []
+
+        commandconfig, step_options = [], []
+        for command_or_subexp in experimentconfig["commands"]:
+            # device commands are [device, function, [args], {kwargs}], subexperiments [experiment, {kwargs}], both
+            # may end with {id: ..., after: [...]} options of the step
+            if len(command_or_subexp) in (3, 5):
+                command_or_subexp, options = command_or_subexp[:-1], command_or_subexp[-1] or {}
+            else:
+                options = None
+            commandconfig.append(command_or_subexp)
+            step_options.append(options)
+
         # collecting all devices and channels
+        step_devicenames = []
         for i, command_or_subexp in enumerate(commandconfig):
             if len(command_or_subexp) == 4:
                 devicename = command_or_subexp[0]
                 if devicename not in self.devices_and_channels.keys():
                     self.devices_and_channels[devicename] = self.setup.devices_and_channels[devicename]
+                step_devicenames.append({devicename})
             else:
                 other_experimentfactory = self.setup.experimentfactories[command_or_subexp[0]]
                 for details in other_experimentfactory.experiment_observable_details:
@@ -35,6 +58,7 @@ class ExperimentFactory:
                 for devicename, device in other_experimentfactory.devices_and_channels.items():
                     if device not in self.devices_and_channels.values():
                         self.devices_and_channels[devicename] = device
+                step_devicenames.append(set(other_experimentfactory.devices_and_channels))
 
         # then get commandconfig ready
         for command_or_subexp in commandconfig:
@@ -42,9 +66,60 @@ class ExperimentFactory:
                 device = self.devices_and_channels[command_or_subexp[0]]
                 method = getattr(device, command_or_subexp[1])
                 self.commandconfig.append((method, command_or_subexp[2], command_or_subexp[3]))
+                self.step_devices.append(device)
+                self.step_names.append((command_or_subexp[0], command_or_subexp[1]))
             else:
                 command_or_subexp[0] = self.setup.experimentfactories[command_or_subexp[0]]
                 self.commandconfig.append(command_or_subexp)
+                self.step_devices.append(None)
+                self.step_names.append(None)
+
+        dependencies = experimentconfig.get("dependencies")
+        if dependencies not in (None, "devices"):
+            raise ParameterError(f"Unknown dependencies {dependencies} of {self.experiment_name}, only devices can be "
+                                 f"inferred.")
+        if dependencies == "devices" or any(options is not None for options in step_options):
+            self.step_graph = self._get_step_graph(step_devicenames, [options or {} for options in step_options])
+
+    def _get_step_graph(self, step_devicenames: list[set[str]], step_options: list[dict]) \
+            -> list[tuple[set[int], set[int]]]:
+        """For every step the steps that have to be finished and the steps that have to be dispatched before it.
+
+        Steps wait for the steps named in after to finish. Of steps using the same device, a step waits for the one
+        before to finish if one of them is a subexperiment, device commands are kept in order by the queue of the
+        device already, so they only wait for the one before to be dispatched.
+        """
+        step_ids = {}
+        for index, options in enumerate(step_options):
+            step_id = str(options.get("id", index))
+            if step_id in step_ids:
+                raise ParameterError(f"Step id {step_id} is used twice in {self.experiment_name}.")
+            step_ids[step_id] = index
+        step_graph = []
+        last_step_of_device = {}
+        for index, (devicenames, options) in enumerate(zip(step_devicenames, step_options)):
+            after_finished, after_dispatched = set(), set()
+            after = options.get("after", [])
+            for step_id in [after] if isinstance(after, (str, int)) else after:
+                try:
+                    previous = step_ids[str(step_id)]
+                except KeyError:
+                    raise ParameterError(f"Step {index} of {self.experiment_name} comes after unknown step {step_id}.")
+                if previous >= index:
+                    raise ParameterError(f"Step {index} of {self.experiment_name} can only come after steps "
+                                         f"listed before it, not {step_id}.")
+                after_finished.add(previous)
+            for devicename in devicenames:
+                previous = last_step_of_device.get(devicename)
+                if previous is None:
+                    pass
+                elif self.step_devices[index] is None or self.step_devices[previous] is None:
+                    after_finished.add(previous)
+                else:
+                    after_dispatched.add(previous)
+                last_step_of_device[devicename] = index
+            step_graph.append((after_finished, after_dispatched - after_finished))
+        return step_graph
 
     def _make_all_devices_wait(self, condition_title):
         condition = DevicesWaitingCondition(condition_title, list(self.setup.current_experiment.devices_and_channels.values()))
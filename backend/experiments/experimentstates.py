@@ -1,7 +1,8 @@
 from abc import ABC
-import time
 
+from backend import clock
 from backend.helpers_exceptions import IState
+from backend.tracing import tracer
 
 
 class ExperimentState(IState, ABC):
@@ -22,19 +23,23 @@ class Waiting(ExperimentState):
 class Running(ExperimentState):
     def enter(self):
         self.experiment.start_log_observer()
-        self.experiment.starting_time = time.time()
+        self.experiment.start_data_writer()
+        self.experiment.starting_time = clock.seconds()
+        self.experiment.trace_start = tracer.now()
         for device in self.experiment.devices_and_channels.values():
             device.subscribe(self.experiment)
 
 class Finished(ExperimentState):
     def enter(self):
-        self.experiment.finishing_time = time.time()  
+        self.experiment.finishing_time = clock.seconds()  
         self.experiment.finish_experiment()      
 
 class Failed(ExperimentState):
     def enter(self):
-        self.experiment.stop()
-        self.experiment.finish_experiment()
+        def devices_stopped(result):
+            self.experiment.finish_experiment()
+            return result
+        self.experiment.deferred_stopped = self.experiment.stop().addCallback(devices_stopped)
 
 
 class Stopped(Failed): pass
@@ -1,9 +1,16 @@
 import time
 from abc import ABC, abstractmethod
-from collections import defaultdict
+from array import array
+from bisect import bisect_right
+from itertools import count
+import math
+from typing import Optional
 
 from twisted.python import failure
 
+from backend import clock
+from backend.downsampling import MinMaxSummary, MinMaxBuckets, lttb
+
 
 class WrongStateError(Exception):
     """Raised when some Action is not possible in current State."""
@@ -31,7 +38,10 @@ class IObservable(ABC):
             self,
             variable_name: str,
             from_timestamp: float = None,
-            to_timestamp: float = time.time()
+            to_timestamp: float = time.time(),
+            max_points: int = None,
+            resolution: float = None,
+            downsampling: str = "minmax"
     ) -> tuple[tuple[float, float | str | failure.Failure]]:
         raise NotImplementedError
 
@@ -52,13 +62,251 @@ class IState(ABC):
         raise NotImplementedError
 
 
+class TimeSeries:
+    """
+    Time-ordered samples of a single observable key.
+
+    Timestamps are kept in an array of doubles so range lookups can bisect them. Values of float and int series are
+    converted once on arrival and kept in typed arrays, everything else is kept as given. A typed series falls back to
+    a wider type (int -> float -> untyped) as soon as a value doesn't fit.
+
+    Old samples are dropped according to the retention policy: at most max_samples samples and no sample older than
+    max_age seconds relative to the newest one. Dropped samples are only cut off lazily, so trimming stays amortized
+    O(1) per appended sample.
+
+    Every sample gets a sequence number on arrival, counted across all series, so clients can ask for the samples
+    they haven't seen yet with since().
+
+    Long ranges can be fetched downsampled. For float and int series the minimum and maximum per bucket are kept at
+    several bucket widths, these summaries are brought up to date when they are needed, so a downsampled range costs
+    about as much as the points it returns, independent of the number of samples in it.
+    """
+    datatypes = {"int": int, "float": float, "str": str}
+    typecodes = {int: "q", float: "d"}
+    _sequence_numbers = count(1)
+    last_sequence = 0  # sequence number of the newest sample of any series
+    summary_widths = (1., 10., 60., 600., 3600.)  # s
+    downsampling_methods = ("minmax", "lttb")
+
+    def __init__(self, max_samples: Optional[int] = None, max_age: Optional[float] = None,
+                 datatype: Optional[type | str] = None):
+        self.max_samples = max_samples
+        self.max_age = max_age
+        self.datatype = None
+        self._timestamps = array("d")
+        self._values = []
+        self._sequences = array("q")
+        self._in_sequence = True  # False once a late sample was inserted before newer ones
+        self._start = 0  # index of the oldest retained sample
+        self._summaries: Optional[list[MinMaxSummary]] = None
+        self._summarized = 0  # samples before this index are in the summaries
+        self.set_datatype(datatype)
+
+    def __len__(self):
+        return len(self._timestamps) - self._start
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        return zip(self._timestamps[self._start:], self._values[self._start:])
+
+    def __getitem__(self, index: int) -> tuple[float, float | str | failure.Failure]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("TimeSeries index out of range")
+        index += self._start
+        return self._timestamps[index], self._values[index]
+
+    @property
+    def timestamps(self) -> array:
+        return self._timestamps[self._start:]
+
+    @property
+    def values(self) -> array | list:
+        return self._values[self._start:]
+
+    def set_datatype(self, datatype: Optional[type | str]):
+        """Converts the stored values to datatype, if they don't fit the series stays untyped."""
+        datatype = self.datatypes.get(datatype, datatype)
+        if datatype not in self.typecodes:
+            datatype = None
+        self._compact()
+        self._summaries = None
+        if datatype is None:
+            self._values = list(self._values)
+        else:
+            try:
+                self._values = array(self.typecodes[datatype], (self._convert(datatype, value) for value in self._values))
+            except (TypeError, ValueError, OverflowError):
+                return self.set_datatype(float if datatype is int else None)
+        self.datatype = datatype
+
+    @staticmethod
+    def _convert(datatype: type, value):
+        if datatype is int and isinstance(value, float):
+            if not value.is_integer():
+                raise ValueError(f"{value} is not an integer")
+            return int(value)
+        return datatype(value)
+
+    def append(self, timestamp: float, value) -> float | int | str | failure.Failure:
+        """Adds a sample and returns the value as it was stored."""
+        if self.datatype is not None:
+            try:
+                value = self._convert(self.datatype, value)
+            except (TypeError, ValueError, OverflowError):
+                self.set_datatype(float if self.datatype is int else None)
+                return self.append(timestamp, value)
+        sequence = TimeSeries.last_sequence = next(self._sequence_numbers)
+        if not self._timestamps or timestamp >= self._timestamps[-1]:
+            self._timestamps.append(timestamp)
+            self._values.append(value)
+            self._sequences.append(sequence)
+        else:
+            # late sample, keep the series sorted
+            index = bisect_right(self._timestamps, timestamp, self._start)
+            self._timestamps.insert(index, timestamp)
+            self._values.insert(index, value)
+            self._sequences.insert(index, sequence)
+            self._in_sequence = False
+            if self._summaries is not None and index < self._summarized:
+                for summary in self._summaries:
+                    summary.add(timestamp, value)
+                self._summarized += 1
+        self._apply_retention()
+        return value
+
+    def _apply_retention(self):
+        start = self._start
+        if self.max_samples is not None:
+            start = max(start, len(self._timestamps) - self.max_samples)
+        if self.max_age is not None:
+            start = bisect_left(self._timestamps, self._timestamps[-1] - self.max_age, start)
+        self._start = start
+        if start > 64 and start * 2 > len(self._timestamps):
+            self._compact()
+
+    def _compact(self):
+        del self._timestamps[:self._start]
+        del self._values[:self._start]
+        del self._sequences[:self._start]
+        self._summarized = max(self._summarized - self._start, 0)
+        self._start = 0
+
+    def latest(self) -> tuple[float, float | str | failure.Failure]:
+        return self[-1]
+
+    def between(self, from_timestamp: float, to_timestamp: float) -> list[tuple[float, float | str | failure.Failure]]:
+        """All samples with from_timestamp < timestamp <= to_timestamp."""
+        first = bisect_right(self._timestamps, from_timestamp, self._start)
+        last = bisect_right(self._timestamps, to_timestamp, first)
+        return list(zip(self._timestamps[first:last], self._values[first:last]))
+
+    def downsampled(self, from_timestamp: float, to_timestamp: float, max_points: Optional[int] = None,
+                    resolution: Optional[float] = None, method: str = "minmax") \
+            -> list[tuple[float, float | str | failure.Failure]]:
+        """
+        Samples with from_timestamp < timestamp <= to_timestamp reduced to about max_points points or to a point
+        every resolution s, the ranges that aren't reduced further are returned as they are.
+        :param method: "minmax" keeps the minimum and maximum per bucket, "lttb" keeps the points that shape the plot
+        most (Largest-Triangle-Three-Buckets). Samples of series that aren't float or int are taken at even steps.
+        """
+        if method not in self.downsampling_methods:
+            raise ValueError(f"Unknown downsampling method {method}, use one of {self.downsampling_methods}")
+        if max_points is not None and max_points <= 0:
+            raise ValueError(f"max_points must be positive, not {max_points}")
+        if resolution is not None and resolution <= 0:
+            raise ValueError(f"resolution must be positive, not {resolution}")
+        first = bisect_right(self._timestamps, from_timestamp, self._start)
+        last = bisect_right(self._timestamps, to_timestamp, first)
+        count = last - first
+        if count < 3 or (max_points is None and resolution is None):
+            return list(zip(self._timestamps[first:last], self._values[first:last]))
+        span = self._timestamps[last - 1] - self._timestamps[first]
+        points = count
+        if max_points is not None:
+            points = min(points, max(int(max_points), 2))
+        if resolution is not None:
+            points = min(points, int(span / float(resolution)) + 1)
+        if points >= count:
+            return list(zip(self._timestamps[first:last], self._values[first:last]))
+        if self.datatype is None:
+            step = math.ceil(count / points)
+            indices = list(range(first, last, step))
+            if indices[-1] != last - 1:
+                indices[-1] = last - 1
+            return [(self._timestamps[index], self._values[index]) for index in indices]
+        if method == "lttb":
+            # lttb runs on a few min/max buckets per point instead of all samples
+            source_buckets = 2 * points
+            source = self._minmax(first, last, span / source_buckets) if count > 2 * source_buckets else \
+                list(zip(self._timestamps[first:last], self._values[first:last]))
+            return lttb(source, points)
+        return self._minmax(first, last, 2 * span / points)
+
+    def _minmax(self, first: int, last: int, width: float) -> list[tuple[float, float]]:
+        """Minimum and maximum of the samples first to last in buckets of width s, taken from the coarsest summary
+        whose buckets fit, samples in the partial buckets at both ends are added as they are."""
+        self._update_summaries()
+        timestamps = self._timestamps
+        buckets = MinMaxBuckets(width)
+        summary = None
+        for candidate in self._summaries:
+            if candidate.width <= width:
+                summary = candidate
+        if summary is not None:
+            # buckets completely within the range
+            first_bucket = math.ceil(timestamps[first] / summary.width)
+            last_bucket = math.floor(timestamps[last - 1] / summary.width)
+            if first_bucket < last_bucket:
+                inner_first = bisect_left(timestamps, first_bucket * summary.width, first, last)
+                inner_last = bisect_left(timestamps, last_bucket * summary.width, inner_first, last)
+                buckets.add_samples(zip(timestamps[first:inner_first], self._values[first:inner_first]))
+                for index in summary.between(first_bucket, last_bucket):
+                    buckets.add(summary.buckets[index] * summary.width, summary.min_timestamps[index],
+                                summary.min_values[index], summary.max_timestamps[index], summary.max_values[index])
+                first = inner_last
+        buckets.add_samples(zip(timestamps[first:last], self._values[first:last]))
+        return buckets.result()
+
+    def _update_summaries(self):
+        if self._summaries is None:
+            self._summaries = [MinMaxSummary(width) for width in self.summary_widths]
+            self._summarized = 0
+        start = max(self._summarized, self._start)
+        for summary in self._summaries:
+            summary.trim(self._timestamps[self._start])
+            summary.extend(self._timestamps[start:], self._values[start:])
+        self._summarized = len(self._timestamps)
+
+    def since(self, sequence: int) -> list[tuple[float, float | str | failure.Failure]]:
+        """All samples with a sequence number greater than sequence, ordered by timestamp."""
+        if self._in_sequence:
+            first = bisect_right(self._sequences, sequence, self._start)
+            return list(zip(self._timestamps[first:], self._values[first:]))
+        return [(self._timestamps[index], self._values[index])
+                for index in range(self._start, len(self._sequences)) if self._sequences[index] > sequence]
+
+
 class BaseObservable(IObservable, ABC):
+    max_samples: Optional[int] = None  # retention policy for every observable key, None means unlimited
+    max_age: Optional[float] = None
+
     def __init__(self, *args, **kwargs):
         self._subscribers = []
-        self.observables: dict[str, list[tuple[float, float | str]]] = None
+        self._observable_datatypes: dict[str, type | str] = {}
+        self.observables: dict[str, TimeSeries] = None
         self.reset_observables()
         super().__init__(*args, **kwargs)
 
+    @classmethod
+    def set_retention_policy(cls, max_samples: Optional[int] = None, max_age: Optional[float] = None):
+        """Sets the retention policy used for observable keys created from now on."""
+        cls.max_samples = max_samples
+        cls.max_age = max_age
+
     def subscribe(self, observer: IObserver):
         self._subscribers.append(observer)
 
@@ -68,40 +316,77 @@ class BaseObservable(IObservable, ABC):
         except ValueError:
             pass
 
+    def set_observable_datatype(self, observable_key: str, datatype: type | str):
+        """Stores the values of observable_key as datatype (e.g. float, "int"), this survives reset_observables."""
+        self._observable_datatypes[observable_key] = datatype
+        try:
+            self.observables[observable_key].set_datatype(datatype)
+        except KeyError:
+            pass
+
+    def _get_timeseries(self, observable_key: str) -> TimeSeries:
+        try:
+            return self.observables[observable_key]
+        except KeyError:
+            timeseries = self.observables[observable_key] = TimeSeries(
+                self.max_samples, self.max_age, self._observable_datatypes.get(observable_key))
+            return timeseries
+
     def reset_observables(self):
-        self.observables = defaultdict(list)
+        self.observables = {}
 
     def update_subscribers(self, observable_key, updated_value, timestamp):
         for subscriber in self._subscribers:
             subscriber.update(self, observable_key, updated_value, timestamp)
 
-    def update_observables(self, observables: dict, timestamp: float = time.time()):
+    def update_observables(self, observables: dict, timestamp: float = None):
+        if timestamp is None:
+            timestamp = clock.seconds()
         for key, value in observables.items():
-            self.observables[key].append((timestamp, value))
+            value = self._get_timeseries(key).append(timestamp, value)
             self.update_subscribers(key, value, timestamp)
 
     def get_updates(
         self,
         variable_name: str,
         from_timestamp: float = None,
-        to_timestamp: float = None
+        to_timestamp: float = None,
+        max_points: int = None,
+        resolution: float = None,
+        downsampling: str = "minmax"
     ) -> list[tuple[float, float | str | failure.Failure]]:
-            updates = []
-            from_timestamp = from_timestamp or 0
-            to_timestamp = to_timestamp or time.time()
-            for time_value_pair in self.observables[variable_name]:
-                if from_timestamp < time_value_pair[0] <= to_timestamp:
-                    updates.append(time_value_pair)
-            return updates
+        """Samples of variable_name between the timestamps, downsampled if max_points or resolution are given, see
+        TimeSeries.downsampled."""
+        from_timestamp = from_timestamp or 0
+        to_timestamp = to_timestamp or clock.seconds()
+        try:
+            timeseries = self.observables[variable_name]
+        except KeyError:
+            return []
+        if max_points is None and resolution is None:
+            return timeseries.between(from_timestamp, to_timestamp)
+        return timeseries.downsampled(from_timestamp, to_timestamp, max_points, resolution, downsampling)
+
+    def get_updates_since(self, variable_name: str, sequence: int) -> list[tuple[float, float | str | failure.Failure]]:
+        """Samples of variable_name that arrived after the one with the sequence number, see TimeSeries.since."""
+        try:
+            timeseries = self.observables[variable_name]
+        except KeyError:
+            return []
+        return timeseries.since(sequence)
 
     def get_latest_update(self, variable_name: str) -> tuple[float, float | str | failure.Failure]:
-        return self.observables[variable_name][-1]
+        try:
+            return self.observables[variable_name].latest()
+        except KeyError:
+            raise IndexError(f"No values for {variable_name}")
 
 
 class StateMachineMixIn:
     def __init__(self, *args, initial_stateclass=None, **kwargs):
         self._state = None if initial_stateclass is None else initial_stateclass(self)
-        self.log.info(f"{self} was initialized with state: {self._state.__class__.__name__}")
+        self.log.info("{machine} was initialized with state: {state}", machine=self,
+                      state=self._state.__class__.__name__)
         super().__init__(*args, **kwargs)
 
     def set_state(self, result, state: IState):
@@ -133,8 +418,8 @@ class StateMachineMixIn:
     @stateobject.setter
     def stateobject(self, state):
         self._state = state
-        self.log.info(f"State of {self} changed to: {state.__class__.__name__}")
-        self._state.time_entered = time.time()
+        self.log.info("State of {machine} changed to: {state}", machine=self, state=state.__class__.__name__)
+        self._state.time_entered = clock.seconds()
         self._state.enter()
         if isinstance(self, IObservable):
             self.update_observables({"state": state.__class__.__name__})
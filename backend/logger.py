@@ -0,0 +1,27 @@
+"""
+Logger that drops events below the log level of the setup before they are made. Events are logged with the format
+string and its arguments, e.g. log.info("Received {reply}", reply=reply), so a disabled level costs one set lookup
+and no formatting.
+"""
+from twisted.logger import Logger as TwistedLogger, LogLevel
+
+enabled_levels = set(LogLevel.iterconstants())
+
+
+def set_log_level(level: LogLevel | str):
+    """Events of levels below level are dropped by all Loggers."""
+    if isinstance(level, str):
+        level = LogLevel.levelWithName(level)
+    enabled_levels.clear()
+    enabled_levels.update(enabled for enabled in LogLevel.iterconstants() if enabled >= level)
+
+
+class Logger(TwistedLogger):
+    def emit(self, level: LogLevel, format: str = None, **kwargs):
+        if level in enabled_levels:
+            super().emit(level, format, **kwargs)
+
+    @staticmethod
+    def is_enabled(level: LogLevel) -> bool:
+        """Whether events of level are logged, to skip collecting arguments that are expensive to get."""
+        return level in enabled_levels
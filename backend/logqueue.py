@@ -0,0 +1,154 @@
+"""
+Log observers that write in a thread of their own. The reactor only puts events into a bounded queue, the writer
+thread passes them on to the file observer and flushes the file once per batch instead of once per event.
+"""
+import queue
+import threading
+from typing import Callable, IO
+
+from twisted.logger import ILogObserver, formatEvent
+from zope.interface import implementer
+
+
+class BatchFlushedFile:
+    """A file whose flush waits for flush_batch, file observers flush after every event."""
+
+    def __init__(self, file: IO):
+        self.file = file
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# the same event is passed to every observer, it is formatted once
+_last_snapshot: tuple[dict, dict] = ({}, {})
+
+
+def snapshot_event(event: dict) -> dict:
+    """
+    Copy of event to write from another thread. Its format is replaced by the formatted message, arguments that may
+    change later, like commands or deferreds, are left out.
+    """
+    global _last_snapshot
+    last_event, snapshot = _last_snapshot
+    if last_event is not event:
+        snapshot = {key: value for key, value in event.items()
+                    if key.startswith("log_") or isinstance(value, (str, int, float, bool, type(None)))}
+        if event.get("log_format") is not None:
+            snapshot["log_format"] = formatEvent(event).replace("{", "{{").replace("}", "}}")
+        _last_snapshot = event, snapshot
+    # file observers add to the event they write
+    return dict(snapshot)
+
+
+@implementer(ILogObserver)
+class QueuedLogObserver:
+    """
+    Queues the events it observes for observer, which is called from a writer thread. At most max_queued events wait,
+    further events are dropped, or if block is set, the logging thread waits until there is room. Files are flushed
+    after every batch of events and at least every flush_interval s.
+
+    Events are formatted when they are queued, see snapshot_event, the writer thread only writes them.
+    """
+    active: set["QueuedLogObserver"] = set()  # started and not yet stopped
+
+    def __init__(self, name: str, observer: ILogObserver, files: list[BatchFlushedFile] = (),
+                 max_queued: int = 10000, flush_interval: float = .5, block: bool = False, close_files: bool = True):
+        self.name = name
+        self.observer = observer
+        self.files = list(files)
+        self.max_queued = max_queued
+        self.flush_interval = flush_interval
+        self.block = block
+        self.close_files = close_files
+        self.dropped = 0
+        self.written = 0
+        self.max_depth = 0
+        self._queue = queue.Queue(max_queued)
+        self._thread = None
+
+    def __call__(self, event: dict):
+        event = snapshot_event(event)
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            if self.block:
+                self._queue.put(event)
+            else:
+                self.dropped += 1
+                return
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"log writer {self.name}", daemon=True)
+        self._thread.start()
+        self.active.add(self)
+        return self
+
+    def stop(self):
+        """Writes the events still queued, ends the writer thread and closes the files."""
+        self.active.discard(self)
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self.close_files:
+            for file in self.files:
+                file.close()
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "max queued": self.max_depth, "capacity": self.max_queued,
+                "written": self.written, "dropped": self.dropped}
+
+    def _run(self):
+        while True:
+            try:
+                event = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # everything queued meanwhile goes into the same batch
+            while event is not None:
+                self._observe(event)
+                try:
+                    event = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            for file in self.files:
+                file.flush_batch()
+            if event is None:
+                return
+
+    def _observe(self, event: dict):
+        try:
+            self.observer(event)
+        except Exception:
+            # the log is where errors would go, there is nothing left to report to
+            pass
+        else:
+            self.written += 1
+
+
+def queued_file_observer(name: str, file: IO, observer_factory: Callable[[IO], ILogObserver],
+                         **kwargs) -> QueuedLogObserver:
+    """Started QueuedLogObserver writing to file with the observer made by observer_factory, e.g.
+    jsonFileLogObserver. kwargs are those of QueuedLogObserver."""
+    batch_flushed_file = BatchFlushedFile(file)
+    return QueuedLogObserver(name, observer_factory(batch_flushed_file), [batch_flushed_file], **kwargs).start()
+
+
+def log_queue_options(config: dict) -> dict:
+    """kwargs of QueuedLogObserver from the log queue block of config."""
+    queue_config = config.get("log queue") or {}
+    return {"max_queued": int(queue_config.get("max queued events", 10000)),
+            "flush_interval": float(queue_config.get("flush interval", 500)) / 1000,
+            "block": queue_config.get("when full", "drop") == "block"}
@@ -0,0 +1,172 @@
+"""
+Counters, gauges and histograms of the backend, exposed in the Prometheus text format by /api/metrics:
+
+    scrape_configs:
+      - job_name: labs
+        metrics_path: /api/metrics
+        static_configs: [{targets: ["localhost:11123"]}]
+
+Updating a metric is a dict lookup and an addition, they are updated on the command path.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Iterable, Optional
+
+default_buckets = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)  # s
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable) -> str:
+    labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f"{{{labels}}}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        """(name, formatted labels, value) of every sample."""
+        raise NotImplementedError
+
+    def exposition(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = defaultdict(int)
+        if not labels:
+            self.values[()] = 0
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] += amount
+
+    def samples(self):
+        for label_values, value in list(self.values.items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Gauge(Metric):
+    """A value that goes up and down. With a callback the values are taken from it, by label values, when the
+    metrics are read."""
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (),
+                 callback: Optional[Callable[[], dict[tuple, float]]] = None):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, *label_values):
+        self.values[label_values] = value
+
+    def samples(self):
+        values = self.callback() if self.callback is not None else self.values
+        for label_values, value in list(values.items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = default_buckets):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # per label values: observations per bucket, not cumulative, their sum and count
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        try:
+            counts, total = self.values[label_values]
+        except KeyError:
+            counts, total = self.values[label_values] = [[0] * len(self.buckets), [0.]]
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def samples(self):
+        for label_values, (counts, total) in list(self.values.items()):
+            cumulative = 0
+            for bucket, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (f"{self.name}_bucket",
+                       _format_labels(self.labels + ("le",), label_values + (_format_value(bucket),)), cumulative)
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum", labels, total[0]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"There already is a metric {metric.name}.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def exposition(self) -> str:
+        """All metrics in the Prometheus text format."""
+        return "\n".join(metric.exposition() for metric in self.metrics.values()) + "\n"
+
+
+registry = MetricsRegistry()
+
+command_response_seconds = registry.register(Histogram(
+    "labs_command_response_seconds", "Time from writing a command until its reply arrived.", ("device", "command")))
+command_retries = registry.register(Counter(
+    "labs_command_retries_total", "Commands written again after an error, a timeout or an unexpected reply.",
+    ("device", "command", "reason")))
+command_timeouts = registry.register(Counter(
+    "labs_command_timeouts_total", "Commands without reply within their timeout.", ("device", "command")))
+command_failures = registry.register(Counter(
+    "labs_command_failures_total", "Commands that failed, after their retries.", ("device", "command")))
+commands_dropped = registry.register(Counter(
+    "labs_commands_dropped_total", "Commands dropped unsent after their max_queue_time.", ("device", "command")))
+command_queue_depth = registry.register(Gauge(
+    "labs_command_queue_depth", "Commands waiting in the queue of a device or channel.", ("device",)))
+condition_checks = registry.register(Counter(
+    "labs_condition_checks_total", "Conditions evaluated by the condition handlers."))
+conditions_met = registry.register(Counter(
+    "labs_conditions_met_total", "Conditions that turned true and called back."))
+experiments = registry.register(Gauge("labs_experiments", "Experiments of the queue by state.", ("state",)))
+reactor_lag_seconds = registry.register(Histogram(
+    "labs_reactor_lag_seconds", "How late the reactor ran the calls of the reactor monitor.",
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5.)))
+
+
+def command_name(command) -> str:
+    """Name of command for the labels, the name get_cmd gave it, else its class and for series the name of their first
+    command. Never the values of the command, they would make a label value for every value."""
+    name = getattr(command, "name", None)
+    if name:
+        return name
+    if getattr(command, "commandlist", None):
+        return f"{type(command).__name__} {command_name(command.commandlist[0])}"
+    return type(command).__name__
+
+
+def command_labels(command) -> tuple[str, str]:
+    """Device and command name of command, the labels of the command metrics."""
+    device = command.device
+    return getattr(device, "log_name", repr(device)), command_name(command)
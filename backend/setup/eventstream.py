@@ -0,0 +1,111 @@
+from collections import defaultdict, deque
+import json
+from typing import Optional
+
+from twisted.internet import task
+from twisted.internet.interfaces import IPushProducer
+from twisted.web import http
+from zope.interface import implementer
+
+from backend.clock import get_clock
+from backend.helpers_exceptions import IObserver, IObservable
+from backend.logger import Logger
+
+
+@implementer(IPushProducer)
+class ObservableStream(IObserver):
+    """Streams the updates of observables to one client as server-sent events.
+
+    Updates are collected as they arrive and written as one frame per interval, a frame is a json object like the
+    response of get_updates: {"timestamp": ..., "updates": {component: {observable: [[timestamp, value], ...]}}}.
+    The stream is registered as producer of the request, while the transport is paused because the client reads too
+    slowly, updates are buffered instead of written. At most max_buffered_samples are buffered per observable, older
+    ones are dropped and their number is sent as "dropped" with the next frame.
+    """
+    keepalive_interval = 15.  # s without updates after which a comment is sent, so proxies keep the connection
+
+    def __init__(self, request: http.Request, components: dict[str, IObservable],
+                 component_observable_pairs: dict[str, list[str]], interval: float = .25,
+                 max_buffered_samples: int = 1000, clock=None):
+        """
+        :param components: observables by their component name
+        :param component_observable_pairs: observable names to stream by component name, an empty list streams all
+        :param interval: s between frames
+        """
+        self.log = Logger(namespace="Event Stream")
+        self.request = request
+        self.interval = interval
+        self.max_buffered_samples = max_buffered_samples
+        self.paused = False
+        self.finished = False
+        # observable -> (component name, observable names or None for all)
+        self._sources: dict[IObservable, tuple[str, Optional[frozenset[str]]]] = {}
+        for componentname, observablenames in component_observable_pairs.items():
+            self._sources[components[componentname]] = (componentname, frozenset(observablenames) or None)
+        self._buffer: dict[str, dict[str, deque]] = defaultdict(dict)
+        self._dropped = 0
+        self._clock = clock or get_clock()
+        self._last_write = self._clock.seconds()
+        self._loop = task.LoopingCall(self._write_frame)
+        self._loop.clock = self._clock
+
+    def start(self):
+        self.request.setHeader("Content-Type", "text/event-stream")
+        self.request.setHeader("Cache-Control", "no-cache")
+        self.request.registerProducer(self, True)
+        self.request.notifyFinish().addBoth(self._finished)
+        for observable in self._sources:
+            observable.subscribe(self)
+        # the headers are sent right away, so clients know the stream is open
+        self.request.write(b": stream opened\n\n")
+        self._loop.start(self.interval, now=False)
+        self.log.info("Streaming to {client}", client=self.request.getClientAddress())
+
+    def update(self, observable, observable_key, updated_value, timestamp):
+        componentname, observablenames = self._sources[observable]
+        if observablenames is not None and observable_key not in observablenames:
+            return
+        try:
+            samples = self._buffer[componentname][observable_key]
+        except KeyError:
+            samples = self._buffer[componentname][observable_key] = deque(maxlen=self.max_buffered_samples)
+        if len(samples) == self.max_buffered_samples:
+            self._dropped += 1
+        samples.append((timestamp, updated_value))
+
+    def _write_frame(self):
+        if self.paused:
+            return
+        now = self._clock.seconds()
+        if self._buffer:
+            frame = {"timestamp": now, "updates": {componentname: {key: list(samples) for key, samples in keys.items()}
+                                                   for componentname, keys in self._buffer.items()}}
+            if self._dropped:
+                frame["dropped"] = self._dropped
+            self._buffer.clear()
+            self._dropped = 0
+            self.request.write(b"data: " + json.dumps(frame, default=str).encode() + b"\n\n")
+            self._last_write = now
+        elif now - self._last_write > self.keepalive_interval:
+            self.request.write(b": keepalive\n\n")
+            self._last_write = now
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def stopProducing(self):
+        self._finished(None)
+
+    def _finished(self, result):
+        if self.finished:
+            return
+        self.finished = True
+        if self._loop.running:
+            self._loop.stop()
+        for observable in self._sources:
+            observable.unsubscribe(self)
+        self._buffer.clear()
+        self.log.info("Stopped streaming to {client}", client=self.request.getClientAddress())
@@ -11,3 +11,8 @@ class NonUniqueIDError(Exception):
 class ExperimentOrderError(Exception):
     """Raised when the Experiment cannot be inserted at a given index."""
     pass
+
+
+class UnknownCursorError(Exception):
+    """Raised when a cursor for get_updates is malformed, from an earlier run or expired."""
+    pass
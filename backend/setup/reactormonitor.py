@@ -0,0 +1,73 @@
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from twisted.internet import reactor, task
+
+from backend import metrics
+from backend.helpers_exceptions import IObservable
+from backend.logger import Logger
+
+
+class ReactorLagMonitor:
+    """Measures how late the reactor runs a call scheduled every interval and publishes it as reactor_lag in s.
+
+    A watchdog thread notices when the reactor stalls for longer than the threshold and captures the stack of the
+    reactor thread at that moment, which is logged together with the lag once the reactor runs again.
+    """
+    observable_name = "reactor_lag"
+
+    def __init__(self, observable: IObservable, interval: float = .1, threshold: float = .2, clock=reactor):
+        """
+        :param observable: the lag is published on it
+        :param interval: s between measurements
+        :param threshold: s of lag from which on a stall is logged
+        """
+        self.log = Logger(namespace="Reactor Monitor")
+        self.observable = observable
+        self.interval = interval
+        self.threshold = threshold
+        self._loop = task.LoopingCall(self._measure)
+        self._loop.clock = clock
+        self._last_run = None
+        self._reactor_thread_id = None
+        self._stalled_stack: Optional[str] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._running = threading.Event()
+
+    def start(self):
+        self._reactor_thread_id = threading.get_ident()
+        self._last_run = time.monotonic()
+        self._running.set()
+        self._watchdog = threading.Thread(target=self._watch, name="reactor watchdog", daemon=True)
+        self._watchdog.start()
+        self._loop.start(self.interval, now=False)
+
+    def stop(self):
+        self._running.clear()
+        if self._loop.running:
+            self._loop.stop()
+
+    def _measure(self):
+        now = time.monotonic()
+        lag = max(now - self._last_run - self.interval, 0.)
+        self._last_run = now
+        self.observable.update_observables({self.observable_name: lag})
+        metrics.reactor_lag_seconds.observe(lag)
+        if lag > self.threshold:
+            stack, self._stalled_stack = self._stalled_stack, None
+            self.log.warn("Reactor stalled for {lag:.3f} s. It was busy in:\n{stack}",
+                          lag=lag, stack=stack or "(not captured, the stall ended before the watchdog checked)")
+
+    def _watch(self):
+        captured_for = None
+        while self._running.is_set():
+            time.sleep(self.threshold / 2)
+            last_run = self._last_run
+            if time.monotonic() - last_run > self.interval + self.threshold and captured_for != last_run:
+                captured_for = last_run
+                frame = sys._current_frames().get(self._reactor_thread_id)
+                if frame is not None:
+                    self._stalled_stack = "".join(traceback.format_stack(frame))
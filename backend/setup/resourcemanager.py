@@ -0,0 +1,42 @@
+from typing import Iterable, Optional
+
+from backend.logger import Logger
+
+
+class ResourceManager:
+    """Locks the devices used by running experiments, so experiments only run concurrently on disjoint devices.
+
+    Channels lock the device they belong to, device wide commands like stop() act on all of its channels.
+    """
+
+    def __init__(self):
+        self.log = Logger(namespace="Resource Manager")
+        self._owners: dict[object, str] = {}
+        self._resources: dict[str, frozenset] = {}
+
+    @staticmethod
+    def resources_of(devices_and_channels: Iterable) -> frozenset:
+        """The devices behind devices_and_channels."""
+        return frozenset(getattr(device_or_channel, "device", device_or_channel)
+                         for device_or_channel in devices_and_channels)
+
+    def is_free(self, resources: frozenset) -> bool:
+        return not any(resource in self._owners for resource in resources)
+
+    def owner_of(self, resource) -> Optional[str]:
+        return self._owners.get(resource)
+
+    def acquire(self, owner: str, resources: frozenset) -> bool:
+        """Locks all resources for owner or, if any of them is locked, none."""
+        if not self.is_free(resources):
+            return False
+        for resource in resources:
+            self._owners[resource] = owner
+        self._resources[owner] = resources
+        self.log.debug("{owner} acquired {resources}", owner=owner, resources=resources)
+        return True
+
+    def release(self, owner: str):
+        for resource in self._resources.pop(owner, ()):
+            del self._owners[resource]
+        self.log.debug("{owner} released its resources", owner=owner)
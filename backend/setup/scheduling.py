@@ -0,0 +1,295 @@
+"""Orders the waiting experiments of the queue and predicts when they run."""
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+import time
+from typing import Optional
+
+from backend.logger import Logger
+
+
+@dataclass
+class Job:
+    """An experiment of the queue as the schedulers see it."""
+    id: str
+    type: str
+    duration: float  # estimated s, without setup changes
+    resources: frozenset
+    # arguments of the device commands, by (device name, function name), as set last in the experiment
+    settings: dict[tuple[str, str], tuple] = field(default_factory=dict)
+    priority: int = 0
+    deadline: Optional[float] = None
+    started: Optional[float] = None  # time the experiment started at, if it is running
+
+
+@dataclass
+class PlannedExperiment:
+    id: str
+    type: str
+    start: float
+    end: float
+    setup_change: float  # s of the duration spent on changing settings of the experiment before
+    priority: int
+    deadline: Optional[float]
+    running: bool
+
+    @property
+    def late(self) -> bool:
+        return self.deadline is not None and self.end > self.deadline
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "type": self.type, "start": self.start, "end": self.end,
+                "setup_change": self.setup_change, "priority": self.priority, "deadline": self.deadline,
+                "running": self.running, "late": self.late}
+
+
+@dataclass
+class Plan:
+    scheduler: str
+    start: float
+    experiments: list[PlannedExperiment]
+
+    @property
+    def end(self) -> float:
+        return max((planned.end for planned in self.experiments), default=self.start)
+
+    @property
+    def makespan(self) -> float:
+        return self.end - self.start
+
+    def to_dict(self) -> dict:
+        return {"scheduler": self.scheduler, "start": self.start, "end": self.end, "makespan": self.makespan,
+                "late": [planned.id for planned in self.experiments if planned.late],
+                "experiments": [planned.to_dict() for planned in self.experiments]}
+
+
+class SetupChangeCosts:
+    """
+    s it takes to change the setting of a device command, e.g. a valve position or a thermostat setpoint, between
+    experiments. Configured by function name either as s per change or as {fixed: s, per unit: s}, per unit is
+    multiplied with the change of the first argument.
+    """
+
+    def __init__(self, config: Optional[dict] = None):
+        self._costs: dict[str, tuple[float, float]] = {}
+        for function_name, cost in (config or {}).items():
+            if isinstance(cost, dict):
+                self._costs[function_name] = (float(cost.get("fixed", 0)), float(cost.get("per unit", 0)))
+            else:
+                self._costs[function_name] = (float(cost), 0.)
+
+    def __contains__(self, function_name: str) -> bool:
+        return function_name in self._costs
+
+    def __call__(self, function_name: str, old: tuple, new: tuple) -> float:
+        if old == new:
+            return 0.
+        fixed, per_unit = self._costs[function_name]
+        try:
+            difference = abs(float(self._first_value(new)) - float(self._first_value(old)))
+        except (IndexError, TypeError, ValueError):
+            difference = 0.
+        return fixed + per_unit * difference
+
+    @staticmethod
+    def _first_value(setting: tuple):
+        args, kwargs = setting
+        return args[0] if args else kwargs[0][1]
+
+    def between(self, settings: dict[tuple[str, str], tuple], new_settings: dict[tuple[str, str], tuple]) -> float:
+        """s to change settings to new_settings, settings that were never set cost nothing."""
+        cost = 0.
+        for key, new in new_settings.items():
+            if key[1] in self._costs and key in settings:
+                cost += self(key[1], settings[key], new)
+        return cost
+
+
+class Scheduler(ABC):
+    """Orders the waiting experiments, the order decides which experiment starts next on every device."""
+    name: str
+
+    def __init__(self, costs: SetupChangeCosts, max_concurrent_experiments: int = 1):
+        self.log = Logger(namespace="Scheduler")
+        self.costs = costs
+        self.max_concurrent_experiments = max_concurrent_experiments
+
+    @abstractmethod
+    def order(self, waiting: list[Job], running: list[Job], now: float) -> list[Job]:
+        """The waiting jobs in the order to start them."""
+        raise NotImplementedError
+
+    def plan(self, waiting: list[Job], running: list[Job], now: float) -> Plan:
+        return Plan(self.name, now, self.timeline(self.order(waiting, running, now), running, now))
+
+    def timeline(self, waiting: list[Job], running: list[Job], now: float) -> list[PlannedExperiment]:
+        """
+        Predicts start and end of the running and waiting jobs. A waiting job starts once its devices are free and
+        fewer than max_concurrent_experiments run, like the setup starts them.
+        """
+        planned, free_at, settings = self._plan_running(running, now)
+        for job in waiting:
+            self._plan_job(job, planned, free_at, settings, now)
+        return planned
+
+    def _plan_running(self, running: list[Job], now: float) -> tuple[list[PlannedExperiment], dict, dict]:
+        """The planned running jobs, when their resources are free and the settings they leave."""
+        planned = []
+        free_at = {}  # resource -> time the last job using it ends
+        settings = {}
+        for job in running:
+            end = max(job.started + job.duration, now)
+            planned.append(PlannedExperiment(job.id, job.type, job.started, end, 0., job.priority, job.deadline, True))
+            self._occupy(job, end, free_at, settings)
+        return planned, free_at, settings
+
+    def _plan_job(self, job: Job, planned: list[PlannedExperiment], free_at: dict, settings: dict,
+                  now: float) -> PlannedExperiment:
+        """Plans the waiting job after planned."""
+        start = max([now] + [free_at[resource] for resource in job.resources if resource in free_at])
+        start = self._free_slot(planned, start)
+        setup_change = self.costs.between(settings, job.settings)
+        end = start + setup_change + job.duration
+        planned_job = PlannedExperiment(job.id, job.type, start, end, setup_change, job.priority, job.deadline, False)
+        planned.append(planned_job)
+        self._occupy(job, end, free_at, settings)
+        return planned_job
+
+    def _free_slot(self, planned: list[PlannedExperiment], start: float) -> float:
+        """Earliest time from start on at which fewer than max_concurrent_experiments of planned run."""
+        while True:
+            ends = [other.end for other in planned if other.start <= start < other.end]
+            if len(ends) < self.max_concurrent_experiments:
+                return start
+            start = min(ends)
+
+    @staticmethod
+    def _occupy(job: Job, end: float, free_at: dict, settings: dict):
+        for resource in job.resources:
+            free_at[resource] = end
+        settings.update(job.settings)
+
+
+class FifoScheduler(Scheduler):
+    """Keeps the order of the queue."""
+    name = "fifo"
+
+    def order(self, waiting: list[Job], running: list[Job], now: float) -> list[Job]:
+        return list(waiting)
+
+
+class MakespanScheduler(Scheduler):
+    """
+    Orders experiments by priority, higher first, and those of the same priority so deadlines are met and the last
+    experiment finishes as early as possible. Starts from the earliest deadline first and moves single experiments to
+    other places as long as that improves the plan. It runs in the reactor thread, so at most max_evaluations orders
+    are evaluated and it stops after max_seconds of wall time. The order is kept until the jobs change.
+    """
+    name = "makespan"
+    max_evaluations = 1000
+    max_seconds = .05
+
+    def __init__(self, costs: SetupChangeCosts, max_concurrent_experiments: int = 1):
+        super().__init__(costs, max_concurrent_experiments)
+        self._cached_order: tuple[tuple, list[str]] = ((), [])
+        self._planned: list[PlannedExperiment] = []  # the timeline of the order being improved, see _prefixes
+
+    @staticmethod
+    def _jobs_key(waiting: list[Job], running: list[Job]) -> tuple:
+        return (tuple((job.id, job.duration, job.resources, job.priority, job.deadline) for job in waiting),
+                tuple((job.id, job.started, job.duration) for job in running))
+
+    def _prefixes(self, order: list[Job], now: float, prefixes: list, first: int) -> list:
+        """
+        prefixes[index] is the state of the timeline before order[index] is planned: the number of planned jobs, when
+        resources are free, the settings and the rating so far. The states from first on are made anew.
+        """
+        count, free_at, settings, rating = prefixes[first]
+        planned = self._planned[:count]
+        free_at, settings = dict(free_at), dict(settings)
+        prefixes = prefixes[:first + 1]
+        for job in order[first:]:
+            rating = self._add_to_rating(rating, self._plan_job(job, planned, free_at, settings, now))
+            prefixes.append((len(planned), dict(free_at), dict(settings), rating))
+        self._planned = planned
+        return prefixes
+
+    def _rate(self, order: list[Job], now: float, prefixes: list, first: int, best: tuple[float, float, float]) \
+            -> tuple[float, float, float]:
+        """
+        Total s deadlines are missed by, end of the last experiment and sum of the ends, lower is better. Only the
+        jobs from first on are planned, the timeline before is taken from prefixes. None of the three goes down as
+        jobs are added, so planning stops once the rating isn't better than best anymore.
+        """
+        count, free_at, settings, rating = prefixes[first]
+        planned = self._planned[:count]
+        free_at, settings = dict(free_at), dict(settings)
+        for job in order[first:]:
+            rating = self._add_to_rating(rating, self._plan_job(job, planned, free_at, settings, now))
+            if rating >= best:
+                break
+        return rating
+
+    @staticmethod
+    def _add_to_rating(rating: tuple[float, float, float], planned: PlannedExperiment) -> tuple[float, float, float]:
+        lateness, last_end, ends = rating
+        if planned.deadline is not None:
+            lateness += max(planned.end - planned.deadline, 0.)
+        return lateness, max(last_end, planned.end), ends + planned.end
+
+    def order(self, waiting: list[Job], running: list[Job], now: float) -> list[Job]:
+        key = self._jobs_key(waiting, running)
+        cached_key, cached_ids = self._cached_order
+        if key == cached_key:
+            jobs = {job.id: job for job in waiting}
+            return [jobs[job_id] for job_id in cached_ids]
+        deadline = time.perf_counter() + self.max_seconds
+        no_deadline = float("inf")
+        order = sorted(waiting, key=lambda job: (-job.priority, no_deadline if job.deadline is None else job.deadline))
+        # the order found before, with the new jobs at the end, if it is better improvements add up over the calls
+        positions = {job_id: index for index, job_id in enumerate(cached_ids)}
+        previous_order = sorted(order, key=lambda job: (-job.priority, positions.get(job.id, len(positions))))
+        # jobs only move within the range of their priority
+        ranges, first = [], 0
+        for index in range(1, len(order) + 1):
+            if index == len(order) or order[index].priority != order[first].priority:
+                ranges.append((first, index))
+                first = index
+        self._planned, free_at, settings = self._plan_running(running, now)
+        rating = (0., now, 0.)
+        for planned in self._planned:
+            rating = self._add_to_rating(rating, planned)
+        prefixes = self._prefixes(order, now, [(len(self._planned), free_at, settings, rating)], 0)
+        best = prefixes[-1][3]
+        evaluations = 1
+        if positions and previous_order != order:
+            rating = self._rate(previous_order, now, prefixes, 0, best)
+            evaluations += 1
+            if rating < best:
+                order, best = previous_order, rating
+                prefixes = self._prefixes(order, now, prefixes, 0)
+        improved = True
+        while improved and evaluations < self.max_evaluations and time.perf_counter() < deadline:
+            improved = False
+            for first, end in ranges:
+                for source in range(first, end):
+                    for target in range(first, end):
+                        if target == source or evaluations >= self.max_evaluations or \
+                                time.perf_counter() >= deadline:
+                            continue
+                        candidate = order[:]
+                        candidate.insert(target, candidate.pop(source))
+                        # the jobs before the first moved one keep their places in the timeline
+                        changed = min(source, target)
+                        rating = self._rate(candidate, now, prefixes, changed, best)
+                        evaluations += 1
+                        if rating < best:
+                            order, best, improved = candidate, rating, True
+                            prefixes = self._prefixes(order, now, prefixes, changed)
+        self._planned = []
+        self._cached_order = key, [job.id for job in order]
+        self.log.debug("Ordered {count} experiments after {evaluations} evaluations, the last ends in {makespan:.0f} s",
+                       count=len(order), evaluations=evaluations, makespan=best[1] - now)
+        return order
+
+
+schedulers: dict[str, type[Scheduler]] = {scheduler.name: scheduler for scheduler in (FifoScheduler, MakespanScheduler)}
@@ -1,53 +1,105 @@
-from collections import ChainMap, defaultdict
+from collections import ChainMap, OrderedDict, defaultdict
+import json
 from pathlib import Path
-import time
 import sys
+import uuid
 
-from twisted.internet import defer, reactor
+from twisted.internet import defer, reactor, threads
 from twisted.logger import (textFileLogObserver, FilteringLogObserver, LogLevelFilterPredicate, LogLevel,
-                            globalLogBeginner, Logger, jsonFileLogObserver)
+                            globalLogBeginner, jsonFileLogObserver)
 
+from backend import clock, metrics
+from backend.devices import devicestate
 from backend.devices.devicefactory import DeviceFactory
 from backend.experiments import experimentstates
 from backend.experiments.experimentfactory import ExperimentFactory
-from backend.helpers_exceptions import IObserver, StateMachineMixIn, BaseObservable
+from backend.experiments.experiment import Experiment
+from backend.experiments.datawriter import write_values_json
+from backend.logger import Logger, set_log_level
+from backend.logqueue import QueuedLogObserver, log_queue_options, queued_file_observer
+from backend.tracing import tracer
+from backend.helpers_exceptions import IObserver, StateMachineMixIn, BaseObservable, TimeSeries
 from .setupstates import *
-from .setuptofrontend import SetupChannelFactory
+from .setuptofrontend import SetupChannelFactory, TextResult
+from .reactormonitor import ReactorLagMonitor
+from .resourcemanager import ResourceManager
+from .scheduling import Job, Plan, SetupChangeCosts, schedulers
+from .helpers_exceptions import UnknownCursorError
 from backend.conditions.conditionhandler import ConditionHandler
 
 
-def initialize_logger(level, filename):
+def initialize_logger(level, filename, **queue_options):
+    """Logs to stdout and as json to filename from writer threads, queue_options are those of QueuedLogObserver."""
+    set_log_level(level)
     filter_predicate = LogLevelFilterPredicate(defaultLogLevel=LogLevel.levelWithName(level))
 
-    json_observer = jsonFileLogObserver(open(filename, "w"))
-    json_observer = FilteringLogObserver(json_observer, [filter_predicate])
-
-    app_observer = textFileLogObserver(sys.stdout)
-    app_observer = FilteringLogObserver(app_observer, [filter_predicate])
-    globalLogBeginner.beginLoggingTo([app_observer, json_observer])
+    json_observer = queued_file_observer("log.json", open(filename, "w"), jsonFileLogObserver, **queue_options)
+    app_observer = queued_file_observer("stdout", sys.stdout, textFileLogObserver, close_files=False,
+                                        **queue_options)
+    for observer in (json_observer, app_observer):
+        reactor.addSystemEventTrigger("after", "shutdown", observer.stop)
+    globalLogBeginner.beginLoggingTo([FilteringLogObserver(observer, [filter_predicate])
+                                      for observer in (app_observer, json_observer)])
 
 
 class Setup(IObserver, StateMachineMixIn, BaseObservable):
     listenTCP = reactor.listenTCP
+    start_logging = staticmethod(initialize_logger)
+    max_cursor_pairs = 128  # component_observable_pairs remembered for cursors, the least recently used are dropped
 
     def __init__(self, config: dict):
         self.config = config
-        logpath = Path("logs/")
-        logpath.mkdir(parents=True, exist_ok=True)
-        initialize_logger(self.config["log_level"], logpath / "log.json")
+        # counts changes of state, queue, experiments and components, responses to the frontend are cached per revision
+        self.revision = 0
+        self.log_directory = Path(self.config.get("log directory", "logs"))
+        self.log_directory.mkdir(parents=True, exist_ok=True)
+        self.start_logging(self.config["log_level"], self.log_directory / "log.json", **log_queue_options(self.config))
         self.log = Logger(namespace="Experimental Setup")
+        retention = self.config.get("observable retention") or {}
+        BaseObservable.set_retention_policy(retention.get("max samples"), retention.get("max age"))
         self.conditionhandler = ConditionHandler()
+        tracing_config = self.config.get("tracing")
+        if tracing_config:
+            tracer.enable(int(tracing_config.get("max commands", 100000)))
         super().__init__(initial_stateclass=Initializing)
+        self.reactor_monitor = None
+        monitor_config = self.config.get("reactor monitor")
+        if monitor_config:
+            self.set_observable_datatype(ReactorLagMonitor.observable_name, float)
+            self.reactor_monitor = ReactorLagMonitor(
+                self, float(monitor_config["interval"]) / 1000, float(monitor_config["threshold"]) / 1000)
+            reactor.callWhenRunning(self.reactor_monitor.start)
+        # cursors are "{token}.{pairs id}.{sequence number}", the token tells cursors from earlier runs apart
+        self._cursor_token = uuid.uuid4().hex[:8]
+        self._cursor_pairs: OrderedDict[int, Optional[dict]] = OrderedDict()
+        self._cursor_pairs_ids: dict[str, int] = {}
+        self._next_cursor_pairs_id = 0
         self.experimentfactories = {}
         self._devices = {}
         self._channels = {}
         self.experiments = {}
         self.experiment_id_order = []
         self._current_experiment_index = -1
-        self._frontend_server = SetupChannelFactory(self)
+        # experiments whose devices are all free start while others run, up to this many at once
+        self.max_concurrent_experiments = int(self.config.get("max concurrent experiments", 1))
+        self.resource_manager = ResourceManager()
+        self.running_experiments: dict[str, Experiment] = {}
+        self._started_experiment_ids: set[str] = set()
+        scheduling_config = self.config.get("scheduling") or {}
+        self.scheduler = schedulers[scheduling_config.get("scheduler", "fifo")](
+            SetupChangeCosts(scheduling_config.get("setup change costs")), self.max_concurrent_experiments)
+        self.default_experiment_duration = float(scheduling_config.get("default duration", 600))
+        # priority and deadline of queued experiments by id
+        self.schedule_constraints: dict[str, dict] = {}
+        stream_config = self.config.get("event stream") or {}
+        self._frontend_server = SetupChannelFactory(
+            self, stream_interval=float(stream_config.get("frame interval", 250)) / 1000,
+            stream_max_buffered_samples=int(stream_config.get("max buffered samples", 1000)))
         self.listenTCP(int(self.config["listen port"]), self._frontend_server)
         self.devices_and_channels = ChainMap(self._devices, self._channels)
-        self._device_factory = DeviceFactory()
+        metrics.command_queue_depth.callback = self._queue_depths
+        metrics.experiments.callback = self._experiment_counts
+        self._device_factory = self.get_device_factory()
         deferred_devices = []
         for name, parameters in self.config["devices"].items():
             deferred_devices.append(self.get_device_or_channel(name, parameters))
@@ -55,6 +107,14 @@ class Setup(IObserver, StateMachineMixIn, BaseObservable):
         deferred_devices = defer.DeferredList(deferred_devices)
         deferred_devices.addCallback(self._get_experimentfactories)
         deferred_devices.addCallback(self.set_state, Paused)
+        deferred_devices.addErrback(self._initialization_failed)
+
+    def get_device_factory(self) -> DeviceFactory:
+        return DeviceFactory()
+
+    def _initialization_failed(self, failure):
+        self.log.failure("Initializing the setup failed", failure)
+        self.state = Failed
 
     @property
     def current_experiment(self):
@@ -73,16 +133,23 @@ class Setup(IObserver, StateMachineMixIn, BaseObservable):
             raise IndexError
         else:
             self._current_experiment_index = new_index
+            self.revision += 1
+
+    @StateMachineMixIn.stateobject.setter
+    def stateobject(self, state):
+        self.revision += 1
+        StateMachineMixIn.stateobject.fset(self, state)
     
     def remote_start(self):
         return self.start()
 
     def remote_stop(self):
-        if self.current_experiment is None:
+        if self.current_experiment is None and not self.running_experiments:
             for device in self.devices_and_channels.values():
                 device.stop()
         else:
-            self.current_experiment.state = experimentstates.Stopped
+            for experiment in list(self.running_experiments.values()) or [self.current_experiment]:
+                experiment.state = experimentstates.Stopped
         self.state = Stopped
 
     def remote_pause(self):
@@ -98,11 +165,62 @@ class Setup(IObserver, StateMachineMixIn, BaseObservable):
     def remote_add_experiment(self, experiment_id: str, experiment_type: str, **kwargs):
         return self.add_experiment(experiment_id, experiment_type, **kwargs)
 
+    def remote_set_schedule_constraints(self, experiment_id: str, priority: int = 0, deadline: Optional[str] = None):
+        """
+        Experiments with higher priority run before those with lower priority, the scheduler tries to finish
+        experiments before their deadline, a timestamp in s.
+        """
+        if experiment_id not in self.experiments:
+            raise KeyError(f"No experiment {experiment_id}.")
+        self.schedule_constraints[experiment_id] = {"priority": int(priority),
+                                                    "deadline": None if deadline is None else float(deadline)}
+        self.revision += 1
+
+    def remote_schedule_plan(self):
+        """Order the waiting experiments will start in and the predicted start and end of them and the running ones."""
+        return self.plan_schedule().to_dict()
+
+    def remote_log_stats(self):
+        """Queued, written and dropped events of the log writers by log file."""
+        return {observer.name: observer.stats() for observer in QueuedLogObserver.active}
+
+    def remote_experiment_trace(self, experiment_id: str):
+        """Chrome trace of the commands of the experiment so far, see backend.tracing."""
+        if experiment_id not in self.experiments:
+            raise KeyError(f"No experiment {experiment_id}.")
+        if not tracer.enabled:
+            raise ValueError("Tracing is not enabled, see tracing in the config.")
+        return self.experiments[experiment_id].chrome_trace()
+
+    def remote_metrics(self):
+        """Metrics of the devices, commands, conditions and the reactor in the Prometheus text format."""
+        return TextResult(metrics.registry.exposition(), "text/plain; version=0.0.4; charset=utf-8")
+
+    def _queue_depths(self) -> dict[tuple, int]:
+        return {(device_or_channel.log_name,): len(device_or_channel.cmd_queue)
+                for device_or_channel in set(self.devices_and_channels.values())}
+
+    def _experiment_counts(self) -> dict[tuple, int]:
+        counts = defaultdict(int)
+        for experiment in self.experiments.values():
+            counts[(experiment.state.__name__,)] += 1
+        return counts
+
+    def remote_save_experiment_values(self, experiment_id: str):
+        """Writes values.json with the updates recorded so far for the experiment and responds with its path."""
+        if experiment_id not in self.experiments:
+            raise KeyError(f"No experiment {experiment_id}.")
+        experiment = self.experiments[experiment_id]
+        if experiment.data_writer is None:
+            raise ValueError(f"Experiment {experiment_id} has not started yet.")
+        return threads.deferToThread(write_values_json, experiment.log_path).addCallback(str)
+
     def remote_station_overview(self):
         try:
             return {
                 "status": self.state.__name__,
                 "running_experiment_name": self.current_experiment.id,
+                "running_experiment_names": list(self.running_experiments),
                 "total_experiments_queued": len(self.experiment_id_order),
                 "current_run_number": self.current_experiment_index + 1
             }
@@ -110,6 +228,7 @@ class Setup(IObserver, StateMachineMixIn, BaseObservable):
             return {
                 "status": self.state.__name__,
                 "running_experiment_name": "",
+                "running_experiment_names": list(self.running_experiments),
                 "total_experiments_queued": len(self.experiment_id_order),
                 "current_run_number": ""
             }
@@ -135,8 +254,22 @@ class Setup(IObserver, StateMachineMixIn, BaseObservable):
             experiments.append(data)
         return experiments
 
-    def remote_get_updates(self, component_observable_pairs: Optional[dict] = None, from_timestamp: Optional[str] = None, to_timestamp: Optional[str] = None):
-        response = {"timestamp": time.time()}
+    def remote_get_updates(self, component_observable_pairs: Optional[dict] = None, from_timestamp: Optional[str] = None, to_timestamp: Optional[str] = None, cursor: Optional[str] = None, max_points: Optional[int] = None, resolution: Optional[float] = None, downsampling: str = "minmax"):
+        """
+        Samples of the observables in component_observable_pairs, by default those of the current experiment.
+        Without a cursor the samples between the timestamps are returned, downsampled to max_points per observable
+        or a point every resolution s with downsampling "minmax" or "lttb", if either is given. With the cursor of an
+        earlier response only the samples that arrived after it are returned, for the component_observable_pairs given
+        with the request the cursor came from, unless new ones are given. Every response contains the cursor to
+        continue from.
+        """
+        sequence = None
+        if cursor is not None:
+            cursor_pairs, sequence = self._parse_cursor(cursor)
+            if component_observable_pairs is None:
+                component_observable_pairs = cursor_pairs
+        pairs_id = self._register_cursor_pairs(component_observable_pairs)
+        response = {"timestamp": clock.seconds(), "cursor": f"{self._cursor_token}.{pairs_id}.{TimeSeries.last_sequence}"}
         from_timestamp = float(from_timestamp) if from_timestamp is not None else None
         to_timestamp = float(to_timestamp) if to_timestamp is not None else None
         if self.current_experiment is None:
@@ -146,19 +279,61 @@ class Setup(IObserver, StateMachineMixIn, BaseObservable):
             response["current_experiment"] = self.current_experiment.id
             response["experiment_started"] = self.current_experiment.starting_time
         if component_observable_pairs is None:
-            component_observable_pairs = defaultdict(list)
-            if self.current_experiment is None:
-                component_observable_pairs = {device: [] for device in self.devices_and_channels.keys()}
-            else:
-                for observable_detail in self.current_experiment.observable_details:
-                    component_observable_pairs[observable_detail[0]].append(observable_detail[1])
+            component_observable_pairs = self.get_default_component_observable_pairs()
         updates = response["updates"] = defaultdict(dict)
         for componentname, observablenames in component_observable_pairs.items():
+            component = self.devices_and_channels[componentname]
             for observablename in observablenames:
-                updates[componentname][observablename] = self.devices_and_channels[componentname].get_updates(
-                    observablename, from_timestamp, to_timestamp)
+                if sequence is None:
+                    updates[componentname][observablename] = component.get_updates(
+                        observablename, from_timestamp, to_timestamp, max_points, resolution, downsampling)
+                else:
+                    updates[componentname][observablename] = component.get_updates_since(observablename, sequence)
         return response
 
+    def _register_cursor_pairs(self, component_observable_pairs: Optional[dict]) -> int:
+        """Remembers component_observable_pairs for cursors and returns their id, None stands for the default."""
+        key = json.dumps(component_observable_pairs, sort_keys=True)
+        try:
+            pairs_id = self._cursor_pairs_ids[key]
+        except KeyError:
+            pairs_id = self._cursor_pairs_ids[key] = self._next_cursor_pairs_id
+            self._next_cursor_pairs_id += 1
+            self._cursor_pairs[pairs_id] = component_observable_pairs
+            if len(self._cursor_pairs) > self.max_cursor_pairs:
+                _, dropped_pairs = self._cursor_pairs.popitem(last=False)
+                del self._cursor_pairs_ids[json.dumps(dropped_pairs, sort_keys=True)]
+        else:
+            self._cursor_pairs.move_to_end(pairs_id)
+        return pairs_id
+
+    def _parse_cursor(self, cursor: str) -> tuple[Optional[dict], int]:
+        try:
+            token, pairs_id, sequence = cursor.split(".")
+            pairs_id, sequence = int(pairs_id), int(sequence)
+        except (AttributeError, ValueError):
+            raise UnknownCursorError(f"Malformed cursor {cursor!r}.")
+        if token != self._cursor_token:
+            raise UnknownCursorError(f"Cursor {cursor!r} is from an earlier run, request again without it.")
+        try:
+            return self._cursor_pairs[pairs_id], sequence
+        except KeyError:
+            raise UnknownCursorError(f"Cursor {cursor!r} expired, request again without it.")
+
+    def get_default_component_observable_pairs(self) -> dict[str, list[str]]:
+        """The observables of the running or current experiments or, without one, the components with empty lists."""
+        experiments = list(self.running_experiments.values())
+        if not experiments and self.current_experiment is not None:
+            experiments.append(self.current_experiment)
+        if not experiments:
+            return {device: [] for device in self.devices_and_channels.keys()}
+        component_observable_pairs = defaultdict(list)
+        for experiment in experiments:
+            for observable_detail in experiment.observable_details:
+                if observable_detail[1] not in component_observable_pairs[observable_detail[0]]:
+                    component_observable_pairs[observable_detail[0]].append(observable_detail[1])
+        return component_observable_pairs
+
     def remote_station_components(self):
         components_list = []
         for name, device_or_channel in self.devices_and_channels.items():
@@ -190,19 +365,35 @@ class Setup(IObserver, StateMachineMixIn, BaseObservable):
                 name = f"{parameters['driver']} {parameters['address']}"
                 device.subscribe(self)
             self._devices[name] = device
+            self.revision += 1
             return device_or_channel
         return deferred_device_or_channel.addCallback(observe_and_add, name)
 
     def _get_experimentfactories(self, result):
         for name, experimentconfig in self.config["experiments"].items():
             self.experimentfactories[name] = ExperimentFactory(self, experimentconfig, name)
+        self.revision += 1
+        self._set_observable_datatypes()
         return result
 
+    def _set_observable_datatypes(self):
+        """Numeric observables listed in the experiments are stored in typed columns instead of strings."""
+        for experiment_factory in self.experimentfactories.values():
+            for componentname, observablename, datatype, *_ in experiment_factory.experiment_observable_details:
+                try:
+                    self.devices_and_channels[componentname].set_observable_datatype(observablename, datatype)
+                except KeyError:
+                    self.log.warn("Can't set datatype of {observable}, {component} is not available.",
+                                  observable=observablename, component=componentname)
+
     def _get_conditions(self, result):
         return result
 
     def insert_experiment_after(self, existing_id: str, experiment_id: str, experiment_type: str, **kwargs):
-        return self.stateobject.insert_experiment_after(existing_id, experiment_id, experiment_type, **kwargs)
+        try:
+            return self.stateobject.insert_experiment_after(existing_id, experiment_id, experiment_type, **kwargs)
+        finally:
+            self.revision += 1
 
     def add_experiment(self, experiment_id: str, experiment_type: str, **kwargs):
         return self.insert_experiment_after(None, experiment_id, experiment_type, **kwargs)
@@ -211,16 +402,155 @@ class Setup(IObserver, StateMachineMixIn, BaseObservable):
         if self.state == Paused or self.state == Stopped:
             self.state = Ready
 
+    @property
+    def started_experiment_index(self) -> int:
+        """Index of the last experiment in the queue that was started, -1 if none was."""
+        for index in range(len(self.experiment_id_order) - 1, -1, -1):
+            if self.experiment_id_order[index] in self._started_experiment_ids:
+                return index
+        return -1
+
+    def schedule_experiments(self) -> list[Experiment]:
+        """
+        Takes the queued experiments that can start now in queue order and locks their devices. An experiment may
+        start before an earlier queued one only if they share no devices, so the order on every device is kept.
+        :return: the experiments to execute
+        """
+        self.reorder_queue()
+        scheduled = []
+        needed_earlier = set()  # devices of queued experiments that didn't start
+        for index, experiment_id in enumerate(self.experiment_id_order):
+            if len(self.running_experiments) >= self.max_concurrent_experiments:
+                break
+            if experiment_id in self._started_experiment_ids:
+                continue
+            experiment = self.experiments[experiment_id]
+            resources = self.resource_manager.resources_of(experiment.devices_and_channels.values())
+            if needed_earlier.isdisjoint(resources) and self.resource_manager.acquire(experiment_id, resources):
+                self._started_experiment_ids.add(experiment_id)
+                self.running_experiments[experiment_id] = experiment
+                self.current_experiment_index = index
+                scheduled.append(experiment)
+            else:
+                needed_earlier |= resources
+        return scheduled
+
+    def estimate_duration(self, experiment_type: str) -> float:
+        """Mean duration of the finished experiments of the type, else the duration from the config or the default."""
+        durations = [experiment.finishing_time - experiment.starting_time for experiment in self.experiments.values()
+                     if experiment.factory.experiment_name == experiment_type and experiment.state is
+                     experimentstates.Finished]
+        if durations:
+            return sum(durations) / len(durations)
+        estimated_duration = self.experimentfactories[experiment_type].estimated_duration
+        return self.default_experiment_duration if estimated_duration is None else float(estimated_duration)
+
+    @staticmethod
+    def _experiment_settings(experiment: Experiment, settings: Optional[dict] = None) -> dict:
+        """Arguments of the device commands of the experiment and its subexperiments by (device name, function)."""
+        settings = {} if settings is None else settings
+        for step, names in zip(experiment.commands, experiment.factory.step_names):
+            if names is None:
+                Setup._experiment_settings(step, settings)
+            else:
+                _, args, kwargs = step
+                settings[names] = (tuple(args), tuple(sorted(kwargs.items())))
+        return settings
+
+    def _get_job(self, experiment: Experiment) -> Job:
+        return Job(experiment.id, experiment.factory.experiment_name,
+                   self.estimate_duration(experiment.factory.experiment_name),
+                   self.resource_manager.resources_of(experiment.devices_and_channels.values()),
+                   self._experiment_settings(experiment), started=experiment.starting_time,
+                   **self.schedule_constraints.get(experiment.id, {}))
+
+    def _get_jobs(self) -> tuple[list[Job], list[Job]]:
+        """Jobs of the waiting experiments in queue order and of the running ones."""
+        waiting = [self._get_job(self.experiments[experiment_id]) for experiment_id in self.experiment_id_order
+                   if experiment_id not in self._started_experiment_ids]
+        running = [self._get_job(experiment) for experiment in self.running_experiments.values()
+                   if experiment.starting_time is not None]
+        return waiting, running
+
+    def plan_schedule(self) -> Plan:
+        return self.scheduler.plan(*self._get_jobs(), clock.seconds())
+
+    def reorder_queue(self):
+        """Puts the waiting experiments into the order of the scheduler, started experiments keep their places."""
+        waiting, running = self._get_jobs()
+        if len(waiting) < 2:
+            return
+        ordered_ids = iter([job.id for job in self.scheduler.order(waiting, running, clock.seconds())])
+        new_order = [experiment_id if experiment_id in self._started_experiment_ids else next(ordered_ids)
+                     for experiment_id in self.experiment_id_order]
+        if new_order != self.experiment_id_order:
+            self.log.info("{scheduler} scheduler reordered the queue to {order}", scheduler=self.scheduler.name,
+                          order=new_order)
+            self.experiment_id_order[:] = new_order
+            self.revision += 1
+
     def execute_experiment(self, experiment):
         def stop_observing(result, experiment):
             experiment.unsubscribe(self)
             return result
-        for device in self.devices_and_channels.values():
+        if len(self.running_experiments) > 1:
+            devices = experiment.devices_and_channels.values()
+        else:
+            devices = self.devices_and_channels.values()
+        for device in devices:
             device.reset_observables()
         experiment.subscribe(self)
         deferred = experiment.execute()
         deferred.addBoth(stop_observing, experiment)
-        deferred.addCallbacks(self.set_state, self.set_state, callbackArgs=[Ready], errbackArgs=[Failed])
+        deferred.addCallbacks(self._experiment_finished, self._experiment_failed, callbackArgs=[experiment],
+                              errbackArgs=[experiment])
+
+    def _experiment_finished(self, result, experiment):
+        self._release_experiment(experiment)
+        # a stopped or failed setup stays so, it only frees the devices
+        if self.state is not Busy:
+            return result
+        if not self.running_experiments:
+            self.state = Ready
+        else:
+            for next_experiment in self.schedule_experiments():
+                self.execute_experiment(next_experiment)
+        return result
+
+    def _experiment_failed(self, failure, experiment):
+        self.log.failure("Running {experiment} failed", failure, experiment=experiment.id)
+        if experiment.state not in (experimentstates.Failed, experimentstates.Stopped):
+            experiment.state = experimentstates.Failed
+        self._experiment_ended(experiment)
+
+    def _experiment_ended(self, experiment):
+        """Goes on with the queue once the devices of an experiment that failed or was stopped stopped. If it left
+        one of its devices in Error the setup fails, the experiments waiting for the device could not run."""
+        if self.running_experiments.pop(experiment.id, None) is None:
+            return
+        devices_in_error = [device for device in experiment.devices_and_channels.values()
+                            if device.state is devicestate.Error]
+        if devices_in_error:
+            self.resource_manager.release(experiment.id)
+            self.log.critical("{experiment} left {devices} in Error", experiment=experiment.id,
+                              devices=[device.log_name for device in devices_in_error])
+            self.state = Failed
+            return
+
+        def devices_stopped(result):
+            self.resource_manager.release(experiment.id)
+            return self._experiment_finished(result, experiment)
+        # its devices are kept from other experiments until then
+        experiment.deferred_stopped.addCallback(devices_stopped)
+
+    def _release_experiment(self, experiment):
+        if self.running_experiments.pop(experiment.id, None) is not None:
+            self.resource_manager.release(experiment.id)
 
     def update(self, observable, observable_key, updated_value, timestamp):
-        pass
\ No newline at end of file
+        if observable_key == "state" and isinstance(observable, Experiment):
+            self.revision += 1
+            if updated_value == "Finished":
+                self._release_experiment(observable)
+            elif updated_value in ("Failed", "Stopped"):
+                self._experiment_ended(observable)
\ No newline at end of file
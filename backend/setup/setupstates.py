@@ -22,10 +22,10 @@ class SetupState(IState, ABC):
             raise NonUniqueIDError(f"{experiment_id} already used.")
         new_index = len(self.setup.experiment_id_order)
         if existing_id is not None:
-            for index, exp_id in enumerate(self.setup.experiment_order):
+            for index, exp_id in enumerate(self.setup.experiment_id_order):
                 if exp_id == existing_id:
                     new_index = index + 1
-            if not new_index > self.setup.current_experiment_index:
+            if not new_index > self.setup.started_experiment_index:
                 raise ExperimentOrderError("Experiment can't be inserted before current running experiment.")
         self.setup.experiment_id_order.insert(new_index, experiment_id)
         experiment = self.setup.experimentfactories[experiment_type].get_experiment(experiment_id, **kwargs)
@@ -45,13 +45,11 @@ class Initializing(SetupState):
 
 class Ready(SetupState):
     def enter(self):
-        try:
-            self.setup.current_experiment_index += 1
-        except IndexError:
-            return
-        else:
+        experiments = self.setup.schedule_experiments()
+        if experiments:
             self.setup.state = Busy
-            self.setup.execute_experiment(self.setup.current_experiment)
+            for experiment in experiments:
+                self.setup.execute_experiment(experiment)
 
     def insert_experiment_after(self, existing_id: Optional[str], experiment_id: str, experiment_type: str, **kwargs):
         super().insert_experiment_after(existing_id, experiment_id, experiment_type, **kwargs)
@@ -62,13 +60,20 @@ class Busy(SetupState):
     def enter(self):
         pass
 
+    def insert_experiment_after(self, existing_id: Optional[str], experiment_id: str, experiment_type: str, **kwargs):
+        super().insert_experiment_after(existing_id, experiment_id, experiment_type, **kwargs)
+        # it may run next to the running ones if its devices are free
+        for experiment in self.setup.schedule_experiments():
+            self.setup.execute_experiment(experiment)
+
     def get_current_experiment(self):
         id = self.setup.experiment_id_order[self.setup.current_experiment_index]
         return self.setup.experiments[id]
 
 
 class Paused(Busy):
-    pass
+    def insert_experiment_after(self, existing_id: Optional[str], experiment_id: str, experiment_type: str, **kwargs):
+        SetupState.insert_experiment_after(self, existing_id, experiment_id, experiment_type, **kwargs)
 
 
 class Shutdown(SetupState):
@@ -1,43 +1,210 @@
+import gzip
+import hashlib
 import re
 import json
+from typing import Optional
+import zlib
 
 from twisted.web import http
 from twisted.web.server import NOT_DONE_YET
 from twisted.internet import defer
 from twisted.python import failure
-from twisted.logger import Logger
+
+from backend.logger import Logger
+from .eventstream import ObservableStream
 
 log = Logger()
+api_path = re.compile(r"/api/(?P<function>.+)")
+
+
+class TextResult(str):
+    """Result of a remote function that is sent as it is instead of as json."""
+
+    def __new__(cls, text: str, content_type: str = "text/plain; charset=utf-8"):
+        result = super().__new__(cls, text)
+        result.content_type = content_type
+        return result
+
+
+class EncodedResponse:
+    """The body of a response with its ETag, compressed variants are made when they are first needed. Results are
+    sent as json unless they are a TextResult."""
+    minimum_compressed_size = 1024  # bytes, smaller bodies are sent uncompressed
+
+    def __init__(self, result):
+        if isinstance(result, TextResult):
+            self.body = result.encode()
+            self.content_type = result.content_type
+        else:
+            self.body = json.dumps(result).encode()
+            self.content_type = "application/json"
+        # weak, because the compressed variants are equivalent but not byte-equal
+        self.etag = f'W/"{hashlib.blake2b(self.body, digest_size=8).hexdigest()}"'
+        self._encoded = {"identity": self.body}
+
+    def encoded(self, encoding: str) -> bytes:
+        try:
+            return self._encoded[encoding]
+        except KeyError:
+            if encoding == "gzip":
+                data = gzip.compress(self.body, compresslevel=6, mtime=0)
+            else:
+                data = zlib.compress(self.body, 6)
+            self._encoded[encoding] = data
+            return data
+
 
 class SetupHandledRequest(http.Request):
     def process(self):
-        pathmatch = re.match(r"/api/(?P<function>.+)", self.path.decode())
-        setup = self.channel.factory.setup
-        self.setHeader('Content-Type', 'text/html')
+        pathmatch = api_path.match(self.path.decode())
+        factory = self.channel.factory
+        setup = factory.setup
+        self.setHeader('Content-Type', 'text/plain; charset=utf-8')
+        if pathmatch is not None and pathmatch.group("function") == "stream":
+            return self.stream()
+        if pathmatch is not None and pathmatch.group("function") == "batch":
+            return self.batch()
         try:
-            handler = getattr(setup, f"remote_{pathmatch.group('function')}")
+            function = pathmatch.group('function')
+            handler = getattr(setup, f"remote_{function}")
         except AttributeError:
             self.setResponseCode(http.NOT_IMPLEMENTED)
             self.write(b"Not Found. Sorry, no such function.")
             self.finish()
         else:
-            kwargs = {}
-            for key, value in self.args.items():
-                value = value[0].decode()
-                try:
-                    value = json.loads(value)
-                except json.decoder.JSONDecodeError:
-                    pass
-                kwargs[key.decode()] = value
-            d = defer.maybeDeferred(handler, **kwargs)
-            d.addCallbacks(self.delayed_response, self.delayed_failure)
+            if not self.args:
+                response = factory.get_cached_response(function)
+                if response is not None:
+                    self.write_response(response)
+                    return NOT_DONE_YET
+            d = defer.maybeDeferred(handler, **self.get_kwargs())
+            d.addCallbacks(self.delayed_response, self.delayed_failure,
+                           callbackArgs=[None if self.args else function, setup.revision])
             return NOT_DONE_YET
 
-    def delayed_response(self, result):
-        self.write(json.dumps(result).encode())
-        self.finish()
+    def get_kwargs(self) -> dict:
+        kwargs = {}
+        for key, value in self.args.items():
+            value = value[0].decode()
+            try:
+                value = json.loads(value)
+            except json.decoder.JSONDecodeError:
+                pass
+            kwargs[key.decode()] = value
+        return kwargs
+
+    def batch(self):
+        """
+        Runs several remote functions and responds with all their results in one list. The calls are a json list of
+        {"function": ..., "kwargs": {...}}, either as the calls argument or as the request body. They run one after
+        another in the same reactor turn, so they all see the same state of the setup. Each entry of the response is
+        {"result": ...} or, if the call failed, {"error": ...}.
+        """
+        try:
+            calls = self.get_kwargs()["calls"]
+        except KeyError:
+            self.content.seek(0)
+            calls = self.content.read()
+        try:
+            if isinstance(calls, (str, bytes)):
+                calls = json.loads(calls)
+            calls = [(call["function"], call.get("kwargs") or {}) for call in calls]
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            self.setResponseCode(http.BAD_REQUEST)
+            self.write(f"Calls must be a json list of {{function, kwargs}}: {e}".encode())
+            self.finish()
+            return
+        setup = self.channel.factory.setup
+        results = []
+        for function, kwargs in calls:
+            try:
+                handler = getattr(setup, f"remote_{function}")
+            except AttributeError:
+                results.append(defer.fail(AttributeError(f"No such function: {function}")))
+            else:
+                results.append(defer.maybeDeferred(handler, **kwargs))
+        d = defer.DeferredList(results, consumeErrors=True)
+        d.addCallback(self._batch_results, [function for function, _ in calls])
+        d.addCallbacks(self.delayed_response, self.delayed_failure)
+        return NOT_DONE_YET
+
+    @staticmethod
+    def _batch_results(results: list[tuple[bool, object]], functions: list[str]) -> list[dict]:
+        batch_results = []
+        for function, (success, result) in zip(functions, results):
+            if success:
+                batch_results.append({"result": result})
+            else:
+                log.error("Batched call of {function} failed: {error}", function=function, error=result.value)
+                batch_results.append({"error": str(result.value)})
+        return batch_results
+
+    def stream(self):
+        """Keeps the response open and streams observable updates as server-sent events, see ObservableStream.
+        Takes component_observable_pairs like get_updates."""
+        factory = self.channel.factory
+        setup = factory.setup
+        component_observable_pairs = self.get_kwargs().get("component_observable_pairs")
+        if component_observable_pairs is None:
+            component_observable_pairs = setup.get_default_component_observable_pairs()
+        try:
+            stream = ObservableStream(self, setup.devices_and_channels, component_observable_pairs,
+                                      factory.stream_interval, factory.stream_max_buffered_samples)
+        except (KeyError, AttributeError) as e:
+            self.setResponseCode(http.BAD_REQUEST)
+            self.write(f"Unknown component {e}".encode())
+            self.finish()
+        else:
+            stream.start()
+            return NOT_DONE_YET
+
+    def delayed_response(self, result, function: Optional[str] = None, revision: Optional[int] = None):
+        """
+        :param function: name of the remote function, if the response may be cached
+        :param revision: revision of the setup the result was computed at
+        """
+        response = EncodedResponse(result)
+        if function is not None:
+            self.channel.factory.cache_response(function, revision, response)
+        self.write_response(response)
         return result
 
+    def write_response(self, response: EncodedResponse):
+        self.setHeader("Content-Type", response.content_type)
+        self.setHeader("ETag", response.etag)
+        self.setHeader("Vary", "Accept-Encoding")
+        if_none_match = self.getHeader("If-None-Match")
+        if if_none_match is not None and (if_none_match.strip() == "*" or response.etag in (
+                tag.strip() for tag in if_none_match.split(","))):
+            self.setResponseCode(http.NOT_MODIFIED)
+            self.finish()
+            return
+        encoding = self.get_encoding(len(response.body))
+        if encoding != "identity":
+            self.setHeader("Content-Encoding", encoding)
+        self.write(response.encoded(encoding))
+        self.finish()
+
+    def get_encoding(self, size: int) -> str:
+        """gzip or deflate if the client accepts it and the body is large enough, identity otherwise."""
+        if size < EncodedResponse.minimum_compressed_size:
+            return "identity"
+        accepted = {}
+        for coding in (self.getHeader("Accept-Encoding") or "").split(","):
+            coding, _, parameters = coding.partition(";")
+            quality = 1.
+            parameters = parameters.strip()
+            if parameters.startswith("q="):
+                try:
+                    quality = float(parameters[2:])
+                except ValueError:
+                    quality = 0.
+            accepted[coding.strip().lower()] = quality
+        for encoding in ("gzip", "deflate"):
+            if accepted.get(encoding, accepted.get("*", 0.)) > 0:
+                return encoding
+        return "identity"
+
     def delayed_failure(self, error: failure.Failure):
         log.error(str(error.value))
         self.setResponseCode(http.INTERNAL_SERVER_ERROR)
@@ -52,7 +219,28 @@ class SetupChannel(http.HTTPChannel):
 
 class SetupChannelFactory(http.HTTPFactory):
     protocol = SetupChannel
+    # responses of these functions without arguments are cached until the revision of the setup changes
+    cacheable_functions = frozenset({"get_experiment_types", "station_components", "station_overview",
+                                     "station_run_tables"})
 
-    def __init__(self, setup, *args, **kwargs):
+    def __init__(self, setup, *args, stream_interval: float = .25, stream_max_buffered_samples: int = 1000, **kwargs):
+        """
+        :param stream_interval: s between the frames of /api/stream
+        :param stream_max_buffered_samples: per observable, kept for clients that read too slowly
+        """
         self.setup = setup
-        super().__init__(*args, **kwargs)
\ No newline at end of file
+        self.stream_interval = stream_interval
+        self.stream_max_buffered_samples = stream_max_buffered_samples
+        self._response_cache: dict[str, tuple[int, EncodedResponse]] = {}
+        super().__init__(*args, **kwargs)
+
+    def get_cached_response(self, function: str) -> Optional[EncodedResponse]:
+        try:
+            revision, response = self._response_cache[function]
+        except KeyError:
+            return None
+        return response if revision == self.setup.revision else None
+
+    def cache_response(self, function: str, revision: int, response: EncodedResponse):
+        if function in self.cacheable_functions:
+            self._response_cache[function] = revision, response
@@ -0,0 +1,3 @@
+from .instruments import SimulatedInstrument, instruments
+from .simulator import SimulatedSetup, Simulator
+from .transport import SimulatedTransport
@@ -0,0 +1,76 @@
+"""
+Simulates a batch of experiments on the station of a config:
+
+    python -m backend.simulation config.yml batch.yml
+
+The batch is a YAML list of experiments, either [id, type, {parameters}] or {id: ..., type: ..., parameters: ...}.
+"""
+import argparse
+import json
+import sys
+
+from yaml import load, SafeLoader
+
+from .simulator import Simulator
+
+
+def read_batch(filename: str) -> list[tuple[str, str, dict]]:
+    with open(filename, "r") as file:
+        entries = load(file, SafeLoader) or []
+    batch = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            batch.append((str(entry["id"]), entry["type"], entry.get("parameters") or {}))
+        else:
+            experiment_id, experiment_type, *parameters = entry
+            batch.append((str(experiment_id), experiment_type, parameters[0] if parameters else {}))
+    return batch
+
+
+def print_report(report: dict):
+    print(f"{'id':<20} {'type':<30} {'state':<10} {'start / s':>10} {'end / s':>10} {'duration / s':>13}")
+    for experiment in report["experiments"]:
+        times = [f"{value:.1f}" if value is not None else "-"
+                 for value in (experiment["start"], experiment["end"], experiment["duration"])]
+        print(f"{experiment['id']:<20} {experiment['type']:<30} {experiment['state']:<10} "
+              f"{times[0]:>10} {times[1]:>10} {times[2]:>13}")
+    print(f"\nSetup {report['setup_state']} after {report['virtual_time']:.1f} s simulated in "
+          f"{report['wall_time']:.2f} s")
+    for failure in report["failures"]:
+        print(f"{failure['time']:10.1f} s {failure['level']:<8} {failure['namespace']}: {failure['message']}")
+    print()
+    for address, instrument in report["instruments"].items():
+        print(f"{instrument['instrument']} on {address}: {instrument['lines_received']} lines, "
+              f"{instrument['errors_injected']} injected errors, device {instrument['device_state']}")
+
+
+def main(arguments=None):
+    argument_parser = argparse.ArgumentParser(prog="python -m backend.simulation", description=__doc__,
+                                              formatter_class=argparse.RawDescriptionHelpFormatter)
+    argument_parser.add_argument("config", help="station config, e.g. config.yml")
+    argument_parser.add_argument("batch", help="YAML list of the experiments to run")
+    argument_parser.add_argument("--latency", type=float, help="ms until instruments reply, default per instrument")
+    argument_parser.add_argument("--jitter", type=float, help="ms added randomly to the latency")
+    argument_parser.add_argument("--error-rate", type=float, help="fraction of lines answered with an error")
+    argument_parser.add_argument("--seed", type=int, help="seed of the random jitter and errors")
+    argument_parser.add_argument("--timeout", type=float, default=7 * 24 * 3600, help="simulated s to give up after")
+    argument_parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    arguments = argument_parser.parse_args(arguments)
+
+    with open(arguments.config, "r") as file:
+        config = load(file, SafeLoader)
+    simulator = Simulator(config,
+                          latency=None if arguments.latency is None else arguments.latency / 1000,
+                          jitter=None if arguments.jitter is None else arguments.jitter / 1000,
+                          error_rate=arguments.error_rate, seed=arguments.seed)
+    report = simulator.run(read_batch(arguments.batch), arguments.timeout)
+    if arguments.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
+    return 0 if all(experiment["state"] == "Finished" for experiment in report["experiments"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
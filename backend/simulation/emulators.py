@@ -0,0 +1,210 @@
+"""
+Puts the simulated instruments behind Linux pseudo-terminals and TCP ports, so the unchanged drivers reach them over
+a real serial port or socket on the real reactor. Serial devices get a /dev/pts/... address, network devices a port
+on localhost:
+
+    python -m backend.simulation.emulators config.yml --write-config emulated.yml
+    python main.py  # with emulated.yml as config.yml, in an other shell
+
+Pseudo-terminals only exist on POSIX systems.
+"""
+import argparse
+import os
+import tty
+
+from twisted.internet import reactor as default_reactor
+from twisted.internet.abstract import isIPAddress
+from twisted.internet.interfaces import IReadDescriptor
+from twisted.internet.protocol import Protocol, ServerFactory
+from yaml import load, dump, SafeLoader, SafeDumper
+from zope.interface import implementer
+
+from backend.logger import Logger
+from .instruments import SimulatedInstrument, instrument_settings, instruments
+
+
+class Emulator:
+    """An instrument reachable at address."""
+    address: str
+
+    def start(self):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    @property
+    def instruments(self) -> list[SimulatedInstrument]:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"lines_received": sum(instrument.lines_received for instrument in self.instruments),
+                "errors_injected": sum(instrument.errors_injected for instrument in self.instruments)}
+
+
+@implementer(IReadDescriptor)
+class PtyEmulator(Emulator):
+    """An instrument behind a pseudo-terminal, drivers open address like a serial port."""
+
+    def __init__(self, instrument_class: type[SimulatedInstrument], reactor=None, **instrument_kwargs):
+        self.reactor = reactor or default_reactor
+        self.master_fd, self.slave_fd = os.openpty()
+        # no echo and no line editing, the terminal passes bytes through like a serial line
+        tty.setraw(self.slave_fd)
+        os.set_blocking(self.master_fd, False)
+        self.address = os.ttyname(self.slave_fd)
+        self.instrument = instrument_class(self._send, self.reactor, **instrument_kwargs)
+
+    @property
+    def instruments(self) -> list[SimulatedInstrument]:
+        return [self.instrument]
+
+    def start(self):
+        self.reactor.addReader(self)
+
+    def stop(self):
+        self.reactor.removeReader(self)
+        self.instrument.stop()
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def _send(self, data: bytes):
+        os.write(self.master_fd, data)
+
+    def fileno(self) -> int:
+        return self.master_fd
+
+    def doRead(self):
+        try:
+            data = os.read(self.master_fd, 4096)
+        except BlockingIOError:
+            return
+        self.instrument.data_received(data)
+
+    def connectionLost(self, reason):
+        pass
+
+    def logPrefix(self) -> str:
+        return self.instrument.name
+
+
+class InstrumentProtocol(Protocol):
+    def connectionMade(self):
+        self.instrument = self.factory.instrument_class(self.transport.write, self.factory.reactor,
+                                                        **self.factory.instrument_kwargs)
+        self.factory.connected_instruments.append(self.instrument)
+
+    def dataReceived(self, data: bytes):
+        self.instrument.data_received(data)
+
+    def connectionLost(self, reason):
+        self.instrument.stop()
+
+
+class TcpEmulator(Emulator, ServerFactory):
+    """An instrument behind a TCP port of interface, every connection talks to an instrument of its own."""
+    protocol = InstrumentProtocol
+    noisy = False
+
+    def __init__(self, instrument_class: type[SimulatedInstrument], reactor=None, interface: str = "127.0.0.1",
+                 port: int = 0, **instrument_kwargs):
+        self.reactor = reactor or default_reactor
+        self.instrument_class = instrument_class
+        self.instrument_kwargs = instrument_kwargs
+        self.interface = interface
+        self.port = port
+        self.listening_port = None
+        self.connected_instruments: list[SimulatedInstrument] = []
+
+    @property
+    def address(self) -> str:
+        return f"{self.interface}:{self.listening_port.getHost().port}"
+
+    @property
+    def instruments(self) -> list[SimulatedInstrument]:
+        return self.connected_instruments
+
+    def start(self):
+        self.listening_port = self.reactor.listenTCP(self.port, self, interface=self.interface)
+
+    def stop(self):
+        for instrument in self.connected_instruments:
+            instrument.stop()
+        return self.listening_port.stopListening()
+
+
+def emulator_for(driver: str, address: str, reactor=None, **instrument_kwargs) -> Emulator:
+    """
+    Emulator of the instrument of driver, behind a TCP port if address is a network address. Settings the instrument
+    doesn't have are left out.
+    """
+    instrument_class = instruments[driver]
+    settings = instrument_kwargs.pop("settings", None) or {}
+    instrument_kwargs["settings"] = {setting: value for setting, value in settings.items()
+                                     if hasattr(instrument_class, setting)}
+    if isIPAddress(address.split(":", 1)[0]):
+        return TcpEmulator(instrument_class, reactor, **instrument_kwargs)
+    return PtyEmulator(instrument_class, reactor, **instrument_kwargs)
+
+
+def emulate(config: dict, reactor=None, **instrument_kwargs) -> tuple[dict[str, Emulator], dict]:
+    """
+    Starts an emulator for every address of the devices in config with a simulated instrument. The instrument
+    settings of the simulation block of config are applied on top of the settings given.
+    :return: the emulators by original address and a copy of config with the addresses of the emulators
+    """
+    log = Logger(namespace="Emulators")
+    emulators = {}
+    emulated_config = dict(config)
+    emulated_config["devices"] = {}
+    settings = instrument_settings(config)
+    for name, parameters in config["devices"].items():
+        parameters = dict(parameters)
+        address = parameters["address"]
+        if address not in emulators:
+            try:
+                address_settings = {**(instrument_kwargs.get("settings") or {}), **settings.get(address, {})}
+                emulators[address] = emulator_for(parameters["driver"], address, reactor,
+                                                  **dict(instrument_kwargs, settings=address_settings))
+            except KeyError:
+                log.warn("There is no simulated instrument for {name} with driver {driver}", name=name,
+                         driver=parameters["driver"])
+                emulated_config["devices"][name] = parameters
+                continue
+            emulators[address].start()
+        parameters["address"] = emulators[address].address
+        emulated_config["devices"][name] = parameters
+    return emulators, emulated_config
+
+
+def main(arguments=None):
+    argument_parser = argparse.ArgumentParser(prog="python -m backend.simulation.emulators", description=__doc__,
+                                              formatter_class=argparse.RawDescriptionHelpFormatter)
+    argument_parser.add_argument("config", help="station config, e.g. config.yml")
+    argument_parser.add_argument("--write-config", help="file to write the config with the emulated addresses to")
+    argument_parser.add_argument("--latency", type=float, help="ms until instruments reply, default per instrument")
+    argument_parser.add_argument("--jitter", type=float, default=0., help="ms added randomly to the latency")
+    argument_parser.add_argument("--error-rate", type=float, default=0.,
+                                 help="fraction of lines answered with an error or not at all")
+    argument_parser.add_argument("--seed", type=int, help="seed of the random jitter and errors")
+    argument_parser.add_argument("--set", action="append", default=[], metavar="SETTING=VALUE",
+                                 help="changes a setting of the instruments that have it, e.g. event_interval=0.5")
+    arguments = argument_parser.parse_args(arguments)
+
+    with open(arguments.config, "r") as file:
+        config = load(file, SafeLoader)
+    settings = dict(setting.split("=", 1) for setting in arguments.set)
+    emulators, emulated_config = emulate(
+        config, latency=None if arguments.latency is None else arguments.latency / 1000,
+        jitter=arguments.jitter / 1000, error_rate=arguments.error_rate, seed=arguments.seed,
+        settings=settings)
+    for name, parameters in emulated_config["devices"].items():
+        print(f"{name:<30} {parameters['driver']:<25} {parameters['address']}")
+    if arguments.write_config:
+        with open(arguments.write_config, "w") as file:
+            dump(emulated_config, file, SafeDumper, sort_keys=False)
+    default_reactor.run()
+
+
+if __name__ == "__main__":
+    main()
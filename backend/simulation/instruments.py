@@ -0,0 +1,617 @@
+"""
+Simulated instruments, one per driver in backend.drivers. They answer the lines the drivers write like the instruments
+would, with latencies, and send the events the drivers wait for, e.g. the end of a dispense, on the clock they are
+given. They only see bytes, so they run behind the in-memory transport of the simulator as well as behind real
+serial ports or sockets.
+"""
+import math
+import random
+import re
+from typing import Callable, Optional
+from xml.etree import ElementTree
+
+from twisted.internet.interfaces import IDelayedCall, IReactorTime
+
+from backend.logger import Logger
+
+
+class SimulatedInstrument:
+    """
+    Splits what the driver writes into lines and answers them. Replies are sent latency plus up to jitter s later,
+    with probability error_rate a line is answered with error_reply instead, or not at all if the instrument has
+    none, like a line lost on the wire.
+    """
+    delimiter = "\r"  # of the lines written by the driver and of the replies
+    latency = .02  # s
+    name = "Simulated instrument"
+
+    def __init__(self, send: Callable[[bytes], None], clock: IReactorTime, latency: Optional[float] = None,
+                 jitter: float = 0., error_rate: float = 0., seed: Optional[int] = None,
+                 settings: Optional[dict] = None):
+        """:param settings: class attributes to change for this instrument, e.g. event_interval or switch_time"""
+        self.log = Logger(namespace=self.name)
+        self.send = send
+        self.clock = clock
+        if latency is not None:
+            self.latency = latency
+        for setting, value in (settings or {}).items():
+            if not hasattr(type(self), setting):
+                raise AttributeError(f"{self.name} has no setting {setting}")
+            setattr(self, setting, type(getattr(type(self), setting))(value))
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lines_received = 0
+        self.errors_injected = 0
+        self._buffer = b""
+        self._delayed_calls: set[IDelayedCall] = set()
+
+    def data_received(self, data: bytes):
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(self.delimiter.encode())
+        for line in lines:
+            self.lines_received += 1
+            line = line.decode(errors="replace")
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors_injected += 1
+                error = self.error_reply(line)
+                self.log.debug("Injected error {error!r} for {line!r}", error=error, line=line)
+                if error is not None:
+                    self.reply(error)
+                continue
+            self.handle_line(line)
+
+    def handle_line(self, line: str):
+        raise NotImplementedError
+
+    def error_reply(self, line: str) -> Optional[str]:
+        return None
+
+    def later(self, delay: float, function: Callable, *args) -> IDelayedCall:
+        """Calls function after delay s, unless the instrument is stopped before."""
+        def call():
+            self._delayed_calls.discard(delayed_call)
+            function(*args)
+        delayed_call = self.clock.callLater(max(delay, 0.), call)
+        self._delayed_calls.add(delayed_call)
+        return delayed_call
+
+    def cancel(self, delayed_call: Optional[IDelayedCall]):
+        if delayed_call is not None and delayed_call.active():
+            delayed_call.cancel()
+        self._delayed_calls.discard(delayed_call)
+
+    def reply(self, text: str, delay: float = 0., delimited: bool = True):
+        delay += self.latency + self.random.uniform(0, self.jitter)
+        self.later(delay, self.send, (text + self.delimiter if delimited else text).encode())
+
+    def stop(self):
+        for delayed_call in list(self._delayed_calls):
+            self.cancel(delayed_call)
+
+
+class EldexOptos(SimulatedInstrument):
+    """Piston pump, commands are two letters and a value, settings are answered with a bare OK."""
+    name = "Simulated Eldex Optos"
+    latency = .05
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate = 0.  # mL/min
+        self.running = False
+        self.high_pressure_limit = 6000
+        self.low_pressure_limit = 0
+        self.compressibility = 0
+        self.refill_rate_factor = 0
+        self.piston_diameter, self.pump_stroke, self.pump_material = 1, 1, 0
+        self.keypad_disabled = False
+
+    @property
+    def pressure(self) -> int:
+        if not self.running:
+            return 0
+        return min(int(80 + 60 * self.rate + self.random.uniform(-5, 5)), 9999)
+
+    def handle_line(self, line: str):
+        command, value = line[:2], line[2:]
+        if command.startswith("Z"):
+            command, value = "Z", line[1:]
+        replies = {
+            "RF": lambda: f"OK{min(round(self.rate * 1000), 99999):05d}",
+            "RP": lambda: f"OK,{self.pressure:04d}",
+            "RH": lambda: f"OK{self.high_pressure_limit:04d}",
+            "LH": lambda: f"OK{self.low_pressure_limit:04d}",
+            "RC": lambda: f"OK{self.compressibility:02d}",
+            "RR": lambda: f"OK{self.refill_rate_factor}",
+            "RD": lambda: f"OK{self.piston_diameter}",
+            "RS": lambda: f"OK{self.pump_stroke}",
+            "RM": lambda: f"OK{self.pump_material}",
+            "RX": lambda: "OK000",
+            "ID": lambda: f"OK{self.piston_diameter}{self.pump_stroke}{self.pump_material}101",
+            "RI": lambda: (f"OK{min(round(self.rate * 1000), 99999):05d}{self.pressure:04d}"
+                           f"{self.high_pressure_limit:04d}{self.low_pressure_limit:04d}{self.compressibility:02d}"
+                           f"{self.refill_rate_factor}{self.piston_diameter}{self.pump_stroke}{self.pump_material}"
+                           f"{int(self.keypad_disabled)}0{int(self.running)}"),
+        }
+        try:
+            if command in replies:
+                self.reply(replies[command]())
+                return
+            self.set(command, value)
+        except ValueError:
+            self.reply("ER", delimited=False)
+        else:
+            self.reply("OK", delimited=False)
+
+    def set(self, command: str, value: str):
+        if command == "RU":
+            self.running = True
+        elif command in ("ST", "SX"):
+            self.running = False
+        elif command == "SF":
+            self.rate = float(value)
+        elif command == "SH":
+            self.high_pressure_limit = int(float(value))
+        elif command == "SL":
+            self.low_pressure_limit = int(float(value))
+        elif command == "SC":
+            self.compressibility = int(float(value))
+        elif command == "SR":
+            self.refill_rate_factor = int(float(value))
+        elif command == "SD":
+            self.piston_diameter = int(value)
+        elif command == "SS":
+            self.pump_stroke = int(value)
+        elif command == "SM":
+            self.pump_material = int(value)
+        elif command in ("KD", "KE"):
+            self.keypad_disabled = command == "KD"
+        elif command != "Z":
+            raise ValueError(f"Unknown command {command}")
+
+
+
+class RegloICC(SimulatedInstrument):
+    """
+    Peristaltic pump with channels, commands start with the channel, 0 addresses all of them. Dispenses in volume at
+    rate mode report their progress as ^U events every event_interval s and their end as ^X event, if events are
+    enabled with xE1.
+    """
+    name = "Simulated Ismatec Reglo ICC"
+    delimiter = "\r\n"
+    latency = .03
+    event_interval = 1.  # s
+    channelcount = 4
+    max_rate = 35.  # mL/min
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events = False
+        self.channels = {channel: {"mode": "L", "rate": 0., "volume": 0., "clockwise": True, "running": False,
+                                   "started": None, "dosed": 0., "timer": None}
+                         for channel in range(1, self.channelcount + 1)}
+
+    @staticmethod
+    def _from_volume_type_2(value: str) -> float:
+        """1000+0 is 1.000e+0"""
+        return float(f"{value[0]}.{value[1:4]}e{value[4:]}")
+
+    @staticmethod
+    def _to_volume_type_1(value: float) -> str:
+        mantissa, exponent = f"{abs(value):.3e}".split("e")
+        return f"{mantissa.replace('.', '')}E{exponent[0]}{int(exponent[1:])}"
+
+    def _addressed(self, channel: str) -> list[dict]:
+        if channel.isdigit() and int(channel) in self.channels:
+            return [self.channels[int(channel)]]
+        return list(self.channels.values())
+
+    def handle_line(self, line: str):
+        match = re.match(r"(None|\d?)(x?.)(.*)", line)
+        if match is None:
+            self.reply("#")
+            return
+        channel, command, value = match.groups()
+        channels = self._addressed(channel)
+        if command == "xE":
+            if value:
+                self.events = value == "1"
+                self.reply("*")
+            else:
+                self.reply(str(int(self.events)))
+        elif command == "xA":
+            self.reply("*" if value else str(self.channelcount))
+        elif command == "(":
+            self.reply("100")
+        elif command in ("f", "v"):
+            key = "rate" if command == "f" else "volume"
+            for settings in channels:
+                if value:
+                    settings[key] = self._from_volume_type_2(value)
+            self.reply(self._to_volume_type_1(channels[0][key]))
+        elif command in "LMOGQNP" and len(command) == 1:
+            for settings in channels:
+                settings["mode"] = command
+            self.reply("*")
+        elif command in ("J", "K"):
+            for settings in channels:
+                settings["clockwise"] = command == "J"
+            self.reply("*")
+        elif command == "H":
+            self._start(channels)
+        elif command in ("I", "xI"):
+            for number, settings in self.channels.items():
+                if settings in channels and settings["running"]:
+                    self._finish(number, "1")
+            self.reply("*")
+        else:
+            self.reply("*")
+
+    def _start(self, channels: list[dict]):
+        for settings in channels:
+            if not 0 < settings["rate"] <= self.max_rate or (settings["mode"] == "O" and settings["volume"] <= 0):
+                self.reply("-")
+                return
+        now = self.clock.seconds()
+        for number, settings in self.channels.items():
+            if settings in channels and not settings["running"]:
+                settings.update(running=True, started=now, dosed=0.)
+                settings["timer"] = self.later(self.event_interval, self._progress, number)
+        self.reply("*")
+
+    def _dosed(self, settings: dict) -> float:
+        """mL pumped since the start"""
+        dosed = settings["rate"] * (self.clock.seconds() - settings["started"]) / 60
+        if settings["mode"] == "O":
+            dosed = min(dosed, settings["volume"])
+        return dosed
+
+    def _progress(self, number: int):
+        settings = self.channels[number]
+        dosed = self._dosed(settings)
+        done = settings["mode"] == "O" and dosed >= settings["volume"]
+        if self.events:
+            remaining = max(settings["volume"] - dosed, 0.) * 60 / settings["rate"] if settings["mode"] == "O" else 0
+            self.reply(f"^U{number}|{'A' if settings['clockwise'] else 'B'}|{math.ceil(remaining)}|"
+                       f"{round(dosed * 1000)}|0", delay=-self.latency)
+        if done:
+            self._finish(number, "A")
+            return
+        delay = self.event_interval
+        if settings["mode"] == "O":
+            delay = min(delay, (settings["volume"] - dosed) * 60 / settings["rate"])
+        settings["timer"] = self.later(delay, self._progress, number)
+
+    def _finish(self, number: int, reason: str):
+        settings = self.channels[number]
+        self.cancel(settings["timer"])
+        settings.update(running=False, timer=None, dosed=self._dosed(settings))
+        if self.events:
+            self.reply(f"^X{number}|{reason}", delay=-self.latency)
+
+    def error_reply(self, line: str) -> Optional[str]:
+        return "#"
+
+
+class KnauerAzuraVU(SimulatedInstrument):
+    """Multiposition valve behind a socket, a move is answered with OK once the valve reached the position."""
+    name = "Simulated Knauer AzuraVU"
+    latency = .01
+    switch_time = .6  # s per move
+    position_count = 6
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.position = 1
+        self.moving_until = 0.
+
+    def handle_line(self, line: str):
+        query = line.endswith("?")
+        command, _, value = line.rstrip("?").partition(":")
+        if command == "IDENTIFY":
+            self.reply(f"IDENTIFY:VU,KNAUER,AZURA VU 4.1,SIM0001,1.0.0,{self.position_count},"
+                       f"{self.position_count + 1}")
+        elif command == "POSITION" and query:
+            self.reply(f"POSITION:{self.position}", delay=max(self.moving_until - self.clock.seconds(), 0.))
+        elif command == "POSITION":
+            try:
+                position = int(value)
+            except ValueError:
+                position = 0
+            if not 1 <= position <= self.position_count:
+                self.reply(f"ERROR:21,Position {value} out of range")
+                return
+            start = max(self.moving_until, self.clock.seconds())
+            self.moving_until = start + (self.switch_time if position != self.position else 0.)
+            self.position = position
+            self.reply("OK", delay=self.moving_until - self.clock.seconds())
+        elif command == "VALVE":
+            self.reply(f"VALVE:SIM0001,1,{self.position_count},{self.position_count + 1},0,1000,100,100000,0,0,0,0,"
+                       f"A1234,{self.position_count}")
+        elif command == "STATUS":
+            moving = int(self.moving_until > self.clock.seconds())
+            self.reply(f"STATUS:{int(self.clock.seconds() * 1000)},{moving},0,0,{self.position},0,0,0,0,0,0,"
+                       f"{self.position},0,{self.position},0,1,40")
+        else:
+            self.reply(f"ERROR:1,Unknown command {command}")
+
+    def error_reply(self, line: str) -> Optional[str]:
+        return "ERROR:99,Simulated error"
+
+
+class TDKLambdaZplus(SimulatedInstrument):
+    """Power supply with a resistive load, only queries are answered."""
+    name = "Simulated TDK Lambda Z+"
+    delimiter = "\r\n"
+    latency = .02
+    max_voltage = 60.  # V
+    max_current = 14.  # A
+    load_resistance = 5.  # Ohm
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.voltage_setpoint = 0.
+        self.current_setpoint = 0.
+        self.output = False
+
+    def _output(self) -> tuple[float, float, str]:
+        """voltage, current and mode of the output"""
+        if not self.output:
+            return 0., 0., "OFF"
+        if self.voltage_setpoint / self.load_resistance <= self.current_setpoint:
+            return self.voltage_setpoint, self.voltage_setpoint / self.load_resistance, "CV"
+        return self.current_setpoint * self.load_resistance, self.current_setpoint, "CC"
+
+    def _noisy(self, value: float) -> str:
+        return f"{value * (1 + self.random.uniform(-.001, .001)):.3f}"
+
+    def handle_line(self, line: str):
+        if not line.endswith("?"):
+            self.set(line)
+            return
+        command = line[:-1].split(":", 1)[0] if line.startswith("*") else line[:-1]
+        voltage, current, mode = self._output()
+        replies = {
+            "*OPC": lambda: "1",
+            "*IDN": lambda: f"TDK-LAMBDA,Z+{self.max_voltage:.0f}-{self.max_current:.0f},SIM0001,1.0",
+            "MEAS:CURR": lambda: self._noisy(current),
+            "MEAS:VOLT": lambda: self._noisy(voltage),
+            "MEAS:POW": lambda: self._noisy(voltage * current),
+            "VOLT": lambda: f"{self.voltage_setpoint:.3f}",
+            "CURR": lambda: f"{self.current_setpoint:.3f}",
+            "OUTP": lambda: str(int(self.output)),
+            "OUTP:MODE": lambda: mode,
+            "SYST:ERR": lambda: '0,"No error"',
+            "SYST:VERS": lambda: "Rev:1.0",
+        }
+        self.reply(replies.get(command, lambda: "0")())
+
+    def set(self, line: str):
+        command, _, value = line.partition(" ")
+        if command == "OUTP":
+            self.output = value.strip() == "1"
+        elif command in ("VOLT", "CURR"):
+            maximum = self.max_voltage if command == "VOLT" else self.max_current
+            try:
+                setpoint = maximum if value.strip().upper() == "MAX" else min(float(value), maximum)
+            except ValueError:
+                return
+            if command == "VOLT":
+                self.voltage_setpoint = setpoint
+            else:
+                self.current_setpoint = setpoint
+
+
+class JulaboPrestoA40(SimulatedInstrument):
+    """
+    Thermostat that heats and cools with limited rates towards the working temperature while started and drifts
+    towards the ambient temperature while stopped. Only queries are answered.
+    """
+    name = "Simulated Julabo Presto A40"
+    delimiter = "\r\n"
+    latency = .1
+    heating_rate = 2 / 60  # K/s
+    cooling_rate = 1.5 / 60  # K/s
+    drift_rate = .2 / 60  # K/s
+    ambient_temperature = 20.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.setpoint = self.ambient_temperature
+        self.running = False
+        self._temperature = self.ambient_temperature
+        self._updated = self.clock.seconds()
+
+    @property
+    def temperature(self) -> float:
+        now = self.clock.seconds()
+        elapsed, self._updated = now - self._updated, now
+        target = self.setpoint if self.running else self.ambient_temperature
+        if self.running:
+            rate = self.heating_rate if target > self._temperature else self.cooling_rate
+        else:
+            rate = self.drift_rate
+        change = target - self._temperature
+        self._temperature += math.copysign(min(abs(change), rate * elapsed), change)
+        return self._temperature
+
+    def handle_line(self, line: str):
+        command, _, value = line.partition(" ")
+        if command == "version":
+            self.reply("JULABO PRESTO A40 VERSION 1.0")
+        elif command == "status":
+            self.reply("03 REMOTE START" if self.running else "02 REMOTE STOP")
+        elif command == "in_pv_00":
+            self.reply(f"{self.temperature:.2f}")
+        elif command == "in_pv_01":
+            self.reply(f"{100. if self.running and abs(self.setpoint - self.temperature) > .1 else 5.:.0f}")
+        elif command == "in_sp_00":
+            self.reply(f"{self.setpoint:.2f}")
+        elif command == "in_mode_05":
+            self.reply(str(int(self.running)))
+        elif command.startswith("in_"):
+            self.reply("0")
+        elif command == "out_mode_05":
+            self.temperature  # the temperature changes with the old state until now
+            self.running = value.strip() == "1"
+        elif command == "out_sp_00":
+            self.temperature
+            try:
+                self.setpoint = float(value)
+            except ValueError:
+                self.reply("-08 INVALID VALUE")
+        elif not command.startswith("out_"):
+            self.reply("-05 UNKNOWN COMMAND")
+
+    def error_reply(self, line: str) -> Optional[str]:
+        return "-08 INVALID COMMAND"
+
+
+class Omnicoll(SimulatedInstrument):
+    """Fraction collector, it never answers but ignores commands with a wrong checksum."""
+    name = "Simulated Lambda Omnicoll"
+    latency = .05
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fraction = 1
+        self.valve_open = False
+        self.ignored = 0
+
+    def handle_line(self, line: str):
+        message, checksum = line[:-2], line[-2:]
+        if not message.startswith("#") or str(hex(sum(map(ord, message)))[-2:]).upper() != checksum:
+            self.ignored += 1
+            self.log.warn("Ignored {line!r} with wrong checksum", line=line)
+            return
+        command = message[5:6]
+        if command in ("w", "f"):
+            self.fraction += 1
+        elif command == "b":
+            self.fraction = max(self.fraction - 1, 1)
+        elif command in ("o", "c"):
+            self.valve_open = command == "o"
+
+
+class Airvalve(SimulatedInstrument):
+    name = "Simulated airvalve"
+    delimiter = "\n"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.is_open = False
+
+    def handle_line(self, line: str):
+        if line in ("AIRVALVE_OPEN", "AIRVALVE_CLOSE"):
+            self.is_open = line == "AIRVALVE_OPEN"
+
+
+class Spinsolve80(SimulatedInstrument):
+    """
+    Benchtop NMR speaking XML messages. Started protocols report their progress every progress_interval s and send a
+    completed notification after their duration.
+    """
+    name = "Simulated Spinsolve 80"
+    delimiter = "</Message>"
+    latency = .05
+    progress_interval = 5.  # s
+    durations = {  # s by protocol and the value of its Scan or Shim option
+        ("1D PROTON", "QuickScan"): 15.,
+        ("1D PROTON", "StandardScan"): 75.,
+        ("SHIM 1H SAMPLE", "QuickShim2"): 300.,
+        ("SHIM 1H SAMPLE", "PowerShim"): 2400.,
+    }
+    default_duration = 60.
+    check_shim_time = 15.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.protocol: Optional[str] = None
+        self._started = self._duration = 0.
+        self._timer: Optional[IDelayedCall] = None
+
+    def message(self, body: str, delay: float = 0.):
+        self.reply(f'<?xml version="1.0" encoding="utf-8"?>\n<Message>{body}', delay)
+
+    def notify(self, element: str, delay: float = 0.):
+        timestamp = self.clock.seconds() + delay
+        self.message(f'<StatusNotification timestamp="{timestamp:.0f}">{element}</StatusNotification>', delay)
+
+    def handle_line(self, line: str):
+        try:
+            root = ElementTree.fromstring(line.strip() + self.delimiter)
+        except ElementTree.ParseError:
+            self.message('<Error error="Could not parse request"/>')
+            return
+        for request in root:
+            if request.tag == "Start":
+                self._start(request)
+            elif request.tag == "Abort":
+                self._finish(successful=False)
+            elif request.tag == "CheckShimRequest":
+                self.message('<CheckShimResponse linewidth50="0.8" linewidth0.55="4.1" SNR="2500"/>',
+                             self.check_shim_time)
+            elif request.tag == "AvailableOptionsRequest":
+                self.message(f'<AvailableOptionsResponse protocol="{request.get("protocol")}">'
+                             f'<Option name="Scan"><Value>QuickScan</Value><Value>StandardScan</Value></Option>'
+                             f'</AvailableOptionsResponse>')
+
+    def _start(self, request: ElementTree.Element):
+        if self.protocol is not None:
+            self.notify('<State status="Busy" error="An other protocol is running"/>')
+            return
+        options = {option.get("name"): option.get("value") for option in request.iter("Option")}
+        self.protocol = request.get("protocol")
+        if "Number" in options and "RepetitionTime" in options:
+            self._duration = float(options["Number"]) * float(options["RepetitionTime"])
+        else:
+            self._duration = self.durations.get((self.protocol, options.get("Scan", options.get("Shim"))),
+                                                self.default_duration)
+        self._started = self.clock.seconds()
+        self.notify(f'<State protocol="{self.protocol}" status="Running" dataFolder=""/>')
+        self._timer = self.later(min(self.progress_interval, self._duration), self._progress)
+
+    def _progress(self):
+        elapsed = self.clock.seconds() - self._started
+        if elapsed >= self._duration:
+            self._finish(successful=True)
+            return
+        self.notify(f'<Progress percentage="{100 * elapsed / self._duration:.0f}" '
+                    f'secondsRemaining="{self._duration - elapsed:.0f}"/>')
+        self._timer = self.later(min(self.progress_interval, self._duration - elapsed), self._progress)
+
+    def _finish(self, successful: bool):
+        if self.protocol is None:
+            return
+        self.cancel(self._timer)
+        self.notify(f'<Completed completed="true" successful="{str(successful).lower()}"/>')
+        self.notify(f'<State protocol="{self.protocol}" status="Ready" dataFolder=""/>')
+        self.protocol = None
+
+
+# simulated instrument by driver module name
+instruments: dict[str, type[SimulatedInstrument]] = {
+    "eldex_optos": EldexOptos,
+    "reglo_icc": RegloICC,
+    "ismatec_reglo_icc": RegloICC,
+    "knauer_azura_vu_4_1": KnauerAzuraVU,
+    "azura_vu": KnauerAzuraVU,
+    "tdk_lambda_zplus": TDKLambdaZplus,
+    "julabo_presto_a40": JulaboPrestoA40,
+    "omnicoll": Omnicoll,
+    "lambda_instruments_omnicoll": Omnicoll,
+    "airvalve": Airvalve,
+    "spinsolve_80": Spinsolve80,
+}
+
+
+def instrument_settings(config: dict) -> dict[str, dict]:
+    """Settings of the simulated instruments by address, from instrument settings in the simulation block of config,
+    which gives them by device name, e.g. reagent_valve: {position_count: 7}."""
+    devices = config.get("devices") or {}
+    settings = {}
+    for name, device_settings in ((config.get("simulation") or {}).get("instrument settings") or {}).items():
+        if name not in devices:
+            raise KeyError(f"There is no device {name} for its instrument settings.")
+        settings.setdefault(devices[name]["address"], {}).update(device_settings or {})
+    return settings
@@ -0,0 +1,195 @@
+"""
+Runs the whole station on a virtual clock: the configured devices talk to simulated instruments in memory and the
+clock jumps from one scheduled call to the next, so a batch of experiments that takes hours on the station runs in
+seconds. Everything else, the setup, its queue and scheduler, the experiments, commands and conditions, is the code
+that runs the station.
+"""
+from pathlib import Path
+import tempfile
+import time
+from typing import Callable, Iterable, Optional
+
+from twisted.internet import defer, task
+from twisted.logger import LogLevel, formatEvent, globalLogPublisher
+
+from backend.clock import get_clock, set_clock
+from backend.logger import Logger
+from backend.devices.devicefactory import DeviceFactory
+from backend.devices.helpers_exceptions import UnknownDeviceError
+from backend.experiments import experimentstates
+from backend.setup import setupstates
+from backend.setup.setup import Setup
+from backend.tracing import tracer
+from .instruments import instrument_settings, instruments
+from .transport import SimulatedTransport
+
+finished_experiment_states = (experimentstates.Finished, experimentstates.Failed, experimentstates.Stopped)
+finished_setup_states = (setupstates.Failed, setupstates.Stopped, setupstates.Shutdown)
+
+
+class SimulatedSetup(Setup):
+    """Setup whose devices are connected to the simulated instruments of simulator, it doesn't listen for the
+    frontend and leaves logging to the simulator."""
+    listenTCP = staticmethod(lambda port, factory: None)
+    start_logging = staticmethod(lambda level, filename, **queue_options: None)
+
+    def __init__(self, config: dict, simulator: "Simulator"):
+        self.simulator = simulator
+        super().__init__(config)
+
+    def get_device_factory(self) -> DeviceFactory:
+        return DeviceFactory(self.simulator.connect)
+
+
+class Simulator:
+    """
+    Runs batches of experiments on a SimulatedSetup of config. Latency, jitter and error rate of the instruments are
+    taken from the simulation block of config unless given, instruments without latency use their own. The settings
+    of single instruments are taken from its instrument settings.
+    """
+
+    def __init__(self, config: dict, latency: Optional[float] = None, jitter: Optional[float] = None,
+                 error_rate: Optional[float] = None, seed: Optional[int] = None,
+                 log_directory: Optional[str] = None):
+        self.log = Logger(namespace="Simulator")
+        simulation_config = config.get("simulation") or {}
+        if latency is None and "latency" in simulation_config:
+            latency = float(simulation_config["latency"]) / 1000
+        if jitter is None:
+            jitter = float(simulation_config.get("jitter", 0)) / 1000
+        if error_rate is None:
+            error_rate = float(simulation_config.get("error rate", 0))
+        self.latency, self.jitter, self.error_rate, self.seed = latency, jitter, error_rate, seed
+        self.settings = instrument_settings(config)  # by address
+        self.config = dict(config)
+        self.config.pop("reactor monitor", None)  # it measures the lag of the real reactor
+        self.config["log directory"] = log_directory or tempfile.mkdtemp(prefix="simulation-")
+        self.clock = task.Clock()
+        self.clock.advance(time.time())
+        self.setup: Optional[SimulatedSetup] = None
+        self.transports: dict[str, SimulatedTransport] = {}
+        self.devices: dict[str, object] = {}  # by address
+        self.start = self.clock.seconds()
+        self.log_events: list[tuple[float, dict]] = []  # warnings and errors with the virtual time they were logged at
+        self._ends: dict[str, float] = {}
+
+    def connect(self, device, driver: str) -> defer.Deferred:
+        """Connects device to a new simulated instrument of its driver, like its connect method to the real one."""
+        try:
+            instrument_class = instruments[driver]
+        except KeyError:
+            self.log.error("There is no simulated instrument for {driver}", driver=driver)
+            return defer.fail(UnknownDeviceError())
+        protocol = device.protocol_factory.buildProtocol(device.address)
+        seed = None if self.seed is None else self.seed + len(self.transports)
+        transport = SimulatedTransport(protocol, instrument_class, self.clock, latency=self.latency,
+                                       jitter=self.jitter, error_rate=self.error_rate, seed=seed,
+                                       settings=self.settings.get(device.full_address))
+        self.transports[device.full_address] = transport
+        self.devices[device.full_address] = device
+        self.clock.callLater(0, protocol.makeConnection, transport)
+        return device.protocol_factory.d_protocol.addCallback(device.connection_done)
+
+    def _observe_log(self, event: dict):
+        if event.get("log_level") in (LogLevel.warn, LogLevel.error, LogLevel.critical):
+            self.log_events.append((self.clock.seconds(), event))
+
+    def run(self, batch: Iterable[tuple[str, str, dict]], timeout: float = 7 * 24 * 3600) -> dict:
+        """
+        Queues the experiments of batch, (id, type, parameters), and runs them until all finished or failed, the
+        setup failed, nothing is left to happen or timeout s of virtual time passed.
+        :return: the report, see report
+        """
+        previous_clock, previous_trace_clock = get_clock(), tracer.now
+        set_clock(self.clock)
+        tracer.now = self.clock.seconds
+        globalLogPublisher.addObserver(self._observe_log)
+        wall_start = time.perf_counter()
+        self.start = start = self.clock.seconds()
+        end = start + timeout
+        added = []
+        try:
+            self.setup = SimulatedSetup(self.config, self)
+            self._advance_until(lambda: self.setup.state is not setupstates.Initializing, end)
+            if self.setup.state is setupstates.Paused:
+                for experiment_id, experiment_type, parameters in batch:
+                    try:
+                        self.setup.add_experiment(experiment_id, experiment_type, **parameters)
+                    except Exception:
+                        self.log.failure("Could not add {id} of type {type}", id=experiment_id, type=experiment_type)
+                    else:
+                        added.append(experiment_id)
+                self.setup.start()
+                self._advance_until(lambda: self._batch_done(added), end)
+            return self.report(start, time.perf_counter() - wall_start)
+        finally:
+            for transport in self.transports.values():
+                transport.instrument.stop()
+            globalLogPublisher.removeObserver(self._observe_log)
+            set_clock(previous_clock)
+            tracer.now = previous_trace_clock
+
+    def _batch_done(self, experiment_ids: list[str]) -> bool:
+        return self.setup.state in finished_setup_states or all(
+            self.setup.experiments[experiment_id].state in finished_experiment_states
+            for experiment_id in experiment_ids)
+
+    def _advance_until(self, done: Callable[[], bool], end: float) -> bool:
+        """Runs the scheduled calls in order of their time until done or nothing is left to run before end."""
+        while True:
+            self._record_ends()
+            if done():
+                return True
+            calls = self.clock.getDelayedCalls()
+            if not calls:
+                self.log.warn("Nothing is left to happen after {time:.1f} s, waiting commands: {commands}",
+                              time=self.clock.seconds() - self.start, commands=self._waiting_commands())
+                return False
+            next_time = min(call.getTime() for call in calls)
+            if next_time > end:
+                self.clock.advance(end - self.clock.seconds())
+                self.log.warn("Simulation timed out")
+                return False
+            try:
+                self.clock.advance(max(next_time - self.clock.seconds(), 0.))
+            except Exception:
+                # the reactor logs errors of scheduled calls and goes on with the next ones
+                self.log.failure("Unhandled error in a scheduled call")
+
+    def _waiting_commands(self) -> dict[str, str]:
+        return {address: str(device.current_command) for address, device in self.devices.items()
+                if device.current_command is not None}
+
+    def _record_ends(self):
+        for experiment_id, experiment in self.setup.experiments.items():
+            if experiment_id not in self._ends and experiment.state in finished_experiment_states:
+                self._ends[experiment_id] = experiment.finishing_time or self.clock.seconds()
+
+    def report(self, start: float, wall_time: float) -> dict:
+        """Timeline of the experiments in s from start, warnings and errors logged and traffic per instrument."""
+        timeline = []
+        for experiment_id in self.setup.experiment_id_order:
+            experiment = self.setup.experiments[experiment_id]
+            started = None if experiment.starting_time is None else experiment.starting_time - start
+            ended = self._ends[experiment_id] - start if experiment_id in self._ends else None
+            timeline.append({"id": experiment_id, "type": experiment.factory.experiment_name,
+                             "state": experiment.state.__name__, "start": started, "end": ended,
+                             "duration": None if None in (started, ended) else ended - started})
+        virtual_time = self.clock.seconds() - start
+        return {
+            "setup_state": self.setup.state.__name__,
+            "virtual_time": virtual_time,
+            "wall_time": wall_time,
+            "speedup": virtual_time / wall_time if wall_time else None,
+            "experiments": timeline,
+            "failures": [{"time": logged - start, "level": event["log_level"].name,
+                          "namespace": event.get("log_namespace"), "message": formatEvent(event)}
+                         for logged, event in self.log_events],
+            "instruments": {address: {"instrument": transport.instrument.name,
+                                      "lines_received": transport.instrument.lines_received,
+                                      "errors_injected": transport.instrument.errors_injected,
+                                      "bytes_written": transport.bytes_written,
+                                      "device_state": self.devices[address].state.__name__}
+                            for address, transport in self.transports.items()},
+            "log_directory": str(Path(self.config["log directory"])),
+        }
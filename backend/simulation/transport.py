@@ -0,0 +1,51 @@
+from twisted.internet import address, error
+from twisted.internet.interfaces import ITransport
+from twisted.python import failure
+from zope.interface import implementer
+
+from backend.logger import Logger
+from .instruments import SimulatedInstrument
+
+
+@implementer(ITransport)
+class SimulatedTransport:
+    """Connects the protocol of a device to a simulated instrument in memory, instead of a serial port or socket."""
+    disconnecting = False
+
+    def __init__(self, protocol, instrument_class: type[SimulatedInstrument], clock, **instrument_kwargs):
+        self.log = Logger(namespace="Simulated transport")
+        self.protocol = protocol
+        self.instrument = instrument_class(self._deliver, clock, **instrument_kwargs)
+        self.bytes_written = 0
+        self.connected = True
+
+    def _deliver(self, data: bytes):
+        if not self.connected:
+            return
+        try:
+            self.protocol.dataReceived(data)
+        except Exception:
+            # like the reactor, which drops the connection if the protocol fails on received data
+            self.log.failure("{protocol} failed on {data!r}", protocol=self.protocol, data=data)
+            self.loseConnection()
+
+    def write(self, data: bytes):
+        if self.connected:
+            self.bytes_written += len(data)
+            self.instrument.data_received(data)
+
+    def writeSequence(self, data):
+        self.write(b"".join(data))
+
+    def loseConnection(self):
+        if not self.connected:
+            return
+        self.connected = False
+        self.instrument.stop()
+        self.protocol.connectionLost(failure.Failure(error.ConnectionDone()))
+
+    def getPeer(self):
+        return address.IPv4Address("TCP", "127.0.0.1", 0)
+
+    def getHost(self):
+        return address.IPv4Address("TCP", "127.0.0.1", 0)
@@ -0,0 +1,99 @@
+"""
+Records when commands pass the steps of their lifecycle: queued, dequeued, written, reply received and parsed,
+retried, succeeded and the inter-command delay done, or failed or dropped. Wait commands are recorded from their start
+to the condition being met. Finished commands are kept per device and channel and exported as Chrome trace events,
+which chrome://tracing and https://ui.perfetto.dev show as a timeline:
+
+    tracer.enable()
+    ...
+    trace = tracer.chrome_trace(start, end)
+
+Nothing is recorded until the tracer is enabled.
+"""
+from collections import deque
+import time
+from typing import Callable, Iterable, Optional
+
+# the span that starts at a mark
+phases = {
+    "queued": "queued",
+    "dequeued": "dispatch",
+    "written": "executing",
+    "reply": "parsing",
+    "parsed": "result handling",
+    "retry": "retrying",
+    "succeeded": "inter-command delay",
+}
+
+
+class CommandTracer:
+    def __init__(self):
+        self.enabled = False
+        self.now: Callable[[], float] = time.monotonic
+        self.finished: deque = deque(maxlen=100000)
+
+    def enable(self, max_commands: int = 100000):
+        """Starts recording, the last max_commands finished commands are kept."""
+        self.finished = deque(self.finished, maxlen=max_commands)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def mark(self, command, mark: str, detail: Optional[str] = None):
+        if self.enabled:
+            command.trace_marks.append((mark, self.now(), detail))
+
+    def mark_current(self, command, mark: str, detail: Optional[str] = None):
+        """Marks the command of a command series that is running."""
+        if self.enabled:
+            while hasattr(command, "commandlist"):
+                command = command.current_command
+            command.trace_marks.append((mark, self.now(), detail))
+
+    def finish(self, command, mark: str, detail: Optional[str] = None):
+        """Marks the end of command and keeps it with the commands of its series."""
+        if not self.enabled or not command.trace_marks:
+            return
+        command.trace_marks.append((mark, self.now(), detail))
+        self._keep(command)
+
+    def _keep(self, command):
+        marks, command.trace_marks = command.trace_marks, []
+        if marks:
+            device = command.device
+            self.finished.append((getattr(device, "log_name", repr(device)), getattr(device, "device", device),
+                                  repr(command), command.fail_count if hasattr(command, "fail_count") else 0, marks))
+        for subcommand in getattr(command, "commandlist", ()):
+            self._keep(subcommand)
+
+    def chrome_trace(self, start: float = float("-inf"), end: float = float("inf"), devices: Iterable = None,
+                     process_name: str = "LABS") -> dict:
+        """
+        Chrome trace of the commands that started between start and end on devices, all devices if not given.
+        Every command is an event with one nested event for each span between its marks, retries are instant events.
+        """
+        devices = None if devices is None else {getattr(device, "device", device) for device in devices}
+        events = [{"ph": "M", "name": "process_name", "pid": 1, "tid": 0, "args": {"name": process_name}}]
+        tids = {}
+        for track, device, name, retries, marks in list(self.finished):
+            if not start <= marks[0][1] <= end or (devices is not None and device not in devices):
+                continue
+            if track not in tids:
+                tids[track] = len(tids) + 1
+                events.append({"ph": "M", "name": "thread_name", "pid": 1, "tid": tids[track], "args": {"name": track}})
+            tid = tids[track]
+            first, last = marks[0][1], marks[-1][1]
+            events.append({"ph": "X", "name": name, "cat": "command", "pid": 1, "tid": tid, "ts": first * 1e6,
+                           "dur": (last - first) * 1e6, "args": {"retries": retries, "outcome": marks[-1][0]}})
+            for (mark, timestamp, detail), (_, next_timestamp, _) in zip(marks, marks[1:]):
+                if mark in phases:
+                    events.append({"ph": "X", "name": phases[mark], "cat": "phase", "pid": 1, "tid": tid,
+                                   "ts": timestamp * 1e6, "dur": (next_timestamp - timestamp) * 1e6})
+                if mark == "retry":
+                    events.append({"ph": "i", "s": "t", "name": "retry", "cat": "retry", "pid": 1, "tid": tid,
+                                   "ts": timestamp * 1e6, "args": {"reason": detail}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+tracer = CommandTracer()
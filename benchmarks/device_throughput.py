@@ -0,0 +1,104 @@
+"""Command throughput and retries of the drivers end-to-end, through pseudo-terminals and sockets to emulated
+instruments on the real reactor. Linux only.
+
+    python -m benchmarks.device_throughput [--commands 200] [--error-rate 0.05] [--latency 5] [--jitter 2]
+
+Drivers fail commands whose reply times out by default, which puts the device into Error and stops its queue, the
+commands left are reported as unfinished. --on-timeout retry retries them instead.
+"""
+import argparse
+import importlib
+import statistics
+import time
+
+from twisted.internet import defer, reactor, task
+
+from backend.commands import commandstate
+from backend.commands.helpers_exceptions import CommandAction
+from backend.simulation.emulators import PtyEmulator, TcpEmulator
+from backend.simulation.instruments import instruments
+
+# driver: emulator, device method, name and kwargs of the benchmarked command
+cases = {
+    "eldex_optos": (PtyEmulator, "write", "GET_CURRENT_PRESSURE", {}),
+    "reglo_icc": (PtyEmulator, "write", "GET_STATUS_ASYNCHRONOUS_COMMUNICATION", {"channel": 1}),
+    "tdk_lambda_zplus": (PtyEmulator, "query", "GET_IDN", {}),
+    "julabo_presto_a40": (PtyEmulator, "query", "GET_BATH_TEMP", {}),
+    "omnicoll": (PtyEmulator, "write", "STEP_FORWARD", {"command_execution_time": .01}),
+    "knauer_azura_vu_4_1": (TcpEmulator, "query", "GET_POS", {}),
+}
+
+
+@defer.inlineCallbacks
+def run_case(driver: str, commands: int, error_rate: float, instrument_kwargs: dict, command_kwargs: dict,
+             timeout: float = 30):
+    emulator_class, method, command_name, kwargs = cases[driver]
+    emulator = emulator_class(instruments[driver], reactor, **instrument_kwargs)
+    emulator.start()
+    device = importlib.import_module(f"backend.drivers.{driver}").Device(emulator.address)
+    try:
+        yield device.connect().addTimeout(timeout, reactor)
+        # errors start after the initial commands, a failed command series never finishes
+        for instrument in emulator.instruments:
+            instrument.error_rate = error_rate
+        sent = [getattr(device, method)(command_name, **kwargs, **command_kwargs) for _ in range(commands)]
+        started = time.perf_counter()
+        finished = [time.perf_counter()]
+        results = defer.DeferredList([command.deferred_result for command in sent], consumeErrors=True)
+        results.addCallback(lambda _: finished.__setitem__(0, time.perf_counter()))
+        # a device in Error sends nothing anymore, waiting for it would never end
+        deadline = defer.Deferred()
+        call = reactor.callLater(timeout, deadline.callback, None)
+        yield defer.DeferredList([results, deadline], fireOnOneCallback=True)
+        if call.active():
+            call.cancel()
+        elapsed = (finished[0] if results.called else time.perf_counter()) - started
+    finally:
+        if device.protocol is not None:
+            # lose_connection keeps serial ports open
+            device.protocol.transport.loseConnection()
+        yield task.deferLater(reactor, .1, emulator.stop)
+    response_times = [command.response_time for command in sent if command.response_time is not None]
+    done = [command for command in sent if command.state in (commandstate.Success, commandstate.Fail)]
+    return {
+        "commands/s": len(done) / elapsed,
+        "median response / ms": 1000 * statistics.median(response_times) if response_times else float("nan"),
+        "retries": sum(command.fail_count for command in sent),
+        "failed": sum(command.state is commandstate.Fail for command in sent),
+        "unfinished": commands - len(done),
+        "errors injected": emulator.stats()["errors_injected"],
+        "device state": device.state.__name__,
+    }
+
+
+@defer.inlineCallbacks
+def main(_reactor, arguments):
+    instrument_kwargs = {"latency": arguments.latency / 1000, "jitter": arguments.jitter / 1000,
+                         "seed": arguments.seed}
+    # the commands follow each other without pause, timeouts are short so retries don't dominate
+    command_kwargs = {"inter_command_time": 0, "timeout": arguments.timeout / 1000}
+    if arguments.on_timeout:
+        command_kwargs["on_timeout"] = CommandAction(arguments.on_timeout)
+    print(f"{'driver':<22}{'commands/s':>12}{'median response / ms':>22}{'retries':>9}{'failed':>8}"
+          f"{'unfinished':>12}{'errors injected':>17}  device")
+    for driver in arguments.drivers or cases:
+        result = yield run_case(driver, arguments.commands, arguments.error_rate, instrument_kwargs, command_kwargs,
+                                arguments.case_timeout)
+        print(f"{driver:<22}{result['commands/s']:>12,.0f}{result['median response / ms']:>22.2f}"
+              f"{result['retries']:>9}{result['failed']:>8}{result['unfinished']:>12}"
+              f"{result['errors injected']:>17}  {result['device state']}")
+
+
+if __name__ == "__main__":
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument("drivers", nargs="*", help=f"some of {', '.join(cases)}, default all")
+    argument_parser.add_argument("--commands", type=int, default=200)
+    argument_parser.add_argument("--latency", type=float, default=1., help="ms until the instruments reply")
+    argument_parser.add_argument("--jitter", type=float, default=0., help="ms added randomly to the latency")
+    argument_parser.add_argument("--error-rate", type=float, default=0.)
+    argument_parser.add_argument("--timeout", type=float, default=250., help="ms until commands are retried")
+    argument_parser.add_argument("--on-timeout", choices=[action.value for action in CommandAction],
+                                 help="what commands do when their reply times out, default per driver")
+    argument_parser.add_argument("--case-timeout", type=float, default=30., help="s to wait for the commands of a driver")
+    argument_parser.add_argument("--seed", type=int, default=1)
+    task.react(main, [argument_parser.parse_args()])
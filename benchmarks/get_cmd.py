@@ -0,0 +1,23 @@
+"""Commands built per second by AbstractBaseDevice.get_cmd, without a connection to the device.
+
+    python -m benchmarks.get_cmd
+"""
+import timeit
+
+from backend.drivers.knauer_azura_vu_4_1 import Device
+
+
+def main(number: int = 20000, repeat: int = 5):
+    device = Device("127.0.0.1:10123")
+    cases = {
+        "GET_POS (no values)": lambda: device.get_cmd("GET_POS", query=True),
+        "SET_POS (with values)": lambda: device.get_cmd("SET_POS", command_values={"value": 3}),
+        "GET_POS (urgent)": lambda: device.get_cmd("GET_POS", query=True, urgent=True),
+    }
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=number, repeat=repeat))
+        print(f"{name:<24}{number / best:>12,.0f} commands/s")
+
+
+if __name__ == "__main__":
+    main()
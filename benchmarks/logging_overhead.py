@@ -0,0 +1,76 @@
+"""Time the logging of one device reply costs, with the log calls made per reply: the command written, the reply
+received and parsed and the state changes of the command. Compares logging with f-strings to twisted's Logger, as
+before, with the level gated Logger, with the log files written directly and from writer threads.
+
+    python -m benchmarks.logging_overhead
+"""
+import os
+import timeit
+
+from twisted.logger import (FilteringLogObserver, LogLevel, LogLevelFilterPredicate, LogPublisher,
+                            Logger as TwistedLogger, jsonFileLogObserver, textFileLogObserver)
+
+from backend.commands.results import Result
+from backend.drivers.knauer_azura_vu_4_1 import Device
+from backend.logger import Logger, set_log_level
+from backend.logqueue import queued_file_observer
+
+
+def log_reply(log, command, reply: Result):
+    log.info("Wrote {commandstring} to device.", commandstring=command.parameters.commandstring)
+    log.info("State of {machine} changed to: {state}", machine=command, state="Sent")
+    log.info("Received {reply}", reply=reply)
+    log.info("{command.parameters.commandstring} returned with parameters: {parameters}", command=command,
+             parameters=reply.parameters)
+    log.info("State of {machine} changed to: {state}", machine=command, state="Success")
+
+
+def log_reply_with_fstrings(log, command, reply: Result):
+    log.info(f"Wrote {command.parameters.commandstring} to device.")
+    log.info(f"State of {command} changed to: Sent")
+    log.info(f"Received {reply}")
+    log.info("{command.parameters.commandstring} returned with parameters: {parameters}", command=command,
+             parameters=reply.parameters)
+    log.info(f"State of {command} changed to: Success")
+
+
+def file_observers(level: str, queued: bool, max_queued: int):
+    files = [open(os.devnull, "w"), open(os.devnull, "w")]
+    if queued:
+        observers = [queued_file_observer("json", files[0], jsonFileLogObserver, max_queued=max_queued),
+                     queued_file_observer("text", files[1], textFileLogObserver, max_queued=max_queued)]
+    else:
+        observers = [jsonFileLogObserver(files[0]), textFileLogObserver(files[1])]
+    predicate = LogLevelFilterPredicate(defaultLogLevel=LogLevel.levelWithName(level))
+    return [FilteringLogObserver(observer, [predicate]) for observer in observers], observers
+
+
+def main(number: int = 5000, repeat: int = 5):
+    device = Device("127.0.0.1:10123")
+    command = device.get_cmd("GET_POS", query=True)
+    reply = Result("POSITION:3")
+    reply.parameters = {"position": "3"}
+    cases = [
+        # name, log level, Logger, log calls, log files written from writer threads
+        ("f-strings, warn", "warn", TwistedLogger, log_reply_with_fstrings, False),
+        ("gated, warn", "warn", Logger, log_reply, False),
+        ("f-strings, info", "info", TwistedLogger, log_reply_with_fstrings, False),
+        ("gated, info", "info", Logger, log_reply, False),
+        ("gated, info, queued", "info", Logger, log_reply, True),
+    ]
+    print(f"{'case':<24}{'µs per reply':>14}")
+    for name, level, logger_class, log_calls, queued in cases:
+        set_log_level(level)
+        # room for all events, the time the reactor spends is measured, not how fast the files are written
+        observers, writers = file_observers(level, queued, max_queued=5 * number * repeat)
+        log = logger_class(namespace="benchmark", observer=LogPublisher(*observers))
+        best = min(timeit.repeat(lambda: log_calls(log, command, reply), number=number, repeat=repeat))
+        if queued:
+            for writer in writers:
+                writer.stop()
+        print(f"{name:<24}{1e6 * best / number:>14.1f}")
+    set_log_level(LogLevel.debug)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Time MakespanScheduler.order takes to order the waiting experiments of the queue, which the setup does in the
+reactor thread whenever the queue changes, and the makespan of the order it finds. One added orders the queue after
+an experiment was added to a queue that was ordered before.
+
+    python -m benchmarks.scheduling
+"""
+import random
+import time
+
+from backend.setup.scheduling import Job, MakespanScheduler, SetupChangeCosts
+
+
+def jobs(count: int, seed: int = 1) -> list[Job]:
+    rng = random.Random(seed)
+    devices = [f"device {index}" for index in range(8)]
+    return [Job(f"e{index}", f"type {index % 4}", rng.uniform(60, 600), frozenset(rng.sample(devices, 3)),
+                {("valve", "set_position"): ((rng.randint(1, 6),), ())},
+                priority=rng.choice((0, 0, 0, 1)), deadline=rng.choice((None, None, rng.uniform(600, 6000))))
+            for index in range(count)]
+
+
+def main(repeat: int = 3):
+    print(f"{'waiting':>8}{'ms per order':>14}{'makespan s':>12}{'ms, one added':>15}{'makespan s':>12}")
+    for count in (10, 30, 60):
+        waiting = jobs(count + 1)
+        results = []
+        for jobs_before in ([], waiting[:-1]):
+            best, makespan = float("inf"), None
+            for _ in range(repeat):
+                # a new scheduler each time, so the order isn't taken from its cache
+                scheduler = MakespanScheduler(SetupChangeCosts({"set_position": 5}), max_concurrent_experiments=2)
+                if jobs_before:
+                    scheduler.order(jobs_before, [], 0.)
+                start = time.perf_counter()
+                order = scheduler.order(waiting, [], 0.)
+                best = min(best, time.perf_counter() - start)
+                makespan = scheduler.plan(order, [], 0.).makespan
+            results += [1e3 * best, makespan]
+        print(f"{count + 1:>8}{results[0]:>14.1f}{results[1]:>12.0f}{results[2]:>15.1f}{results[3]:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
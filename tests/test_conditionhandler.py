@@ -0,0 +1,66 @@
+from twisted.internet import task
+from twisted.trial import unittest
+
+from backend import clock
+from backend.conditions.conditionhandler import ConditionHandler
+from backend.conditions.conditions import CombinedCondition, ObservableEqualsValueCondition, TimeCondition
+from backend.helpers_exceptions import BaseObservable
+
+
+class Observable(BaseObservable):
+    pass
+
+
+class CombinedTimeAndObservableConditionTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(clock.set_clock, clock.get_clock())
+        self.clock = task.Clock()
+        self.clock.advance(1000)
+        clock.set_clock(self.clock)
+        self.observable = Observable()
+        self.handler = ConditionHandler([self.observable])
+        self.handler.callLater = self.clock.callLater
+        self.deadlines_reached = 0
+        deadlines_reached = self.handler._deadlines_reached
+
+        def count_deadlines_reached():
+            self.deadlines_reached += 1
+            deadlines_reached()
+        self.handler._deadlines_reached = count_deadlines_reached
+        self.condition = CombinedCondition(
+            "combined", TimeCondition("wait", 10),
+            ObservableEqualsValueCondition("value", self.observable, "value", "done"))
+        self.called_back = []
+        self.handler.add_condition(self.condition).addCallback(self.called_back.append)
+
+    def test_past_deadline_is_not_rescheduled(self):
+        self.clock.advance(10)
+        self.assertEqual(self.deadlines_reached, 1)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(self.called_back, [])
+
+    def test_calls_back_on_update_after_deadline(self):
+        self.clock.advance(10)
+        self.observable.update_observables({"value": "done"})
+        self.assertEqual(self.called_back, [None])
+
+    def test_calls_back_at_deadline_after_update(self):
+        self.observable.update_observables({"value": "done"})
+        self.clock.advance(9)
+        self.assertEqual(self.called_back, [])
+        self.clock.advance(1)
+        self.assertEqual(self.called_back, [None])
+
+
+class TimeConditionTest(unittest.TestCase):
+    def test_zero_wait_is_evaluated_on_next_turn(self):
+        self.addCleanup(clock.set_clock, clock.get_clock())
+        reactor_time = task.Clock()
+        clock.set_clock(reactor_time)
+        handler = ConditionHandler()
+        handler.callLater = reactor_time.callLater
+        called_back = []
+        handler.add_condition(TimeCondition("now", 0)).addCallback(called_back.append)
+        self.assertEqual(called_back, [])
+        reactor_time.advance(0)
+        self.assertEqual(called_back, [None])